@@ -6,28 +6,34 @@ except:
 from mesh import Mesh3D
 from image_converter import ImageToMeshConverter
 from obj_file import ObjFile
+from bmesh_file import BinaryMeshFile
 from off_file import OffFile
 from render_modes import RenderMode
-from sdf import Sdf, Sdf3D
+from sdf import Sdf, Sdf3D, SparseSdf3D
 from sdf_file import SdfFile
 from stable_pose import StablePose
 from stp_file import StablePoseFile
+from stp_cache import StablePoseCache
 from urdf_writer import UrdfWriter, convex_decomposition
 from lighting import MaterialProperties, LightingProperties
 
-from mesh_renderer import ViewsphereDiscretizer, PlanarWorksurfaceDiscretizer, VirtualCamera, SceneObject
-from random_variables import CameraSample, RenderSample, UniformViewsphereRandomVariable, UniformPlanarWorksurfaceRandomVariable, UniformPlanarWorksurfaceImageRandomVariable
+from mesh_renderer import ViewsphereDiscretizer, PlanarWorksurfaceDiscretizer, VirtualCamera, SceneObject, RigidTransformArray, CameraIntrinsicsArray
+from render_pool import RenderPool
+from random_variables import CameraSample, CameraSampleBatch, RenderSample, UniformViewsphereRandomVariable, UniformPlanarWorksurfaceRandomVariable, UniformPlanarWorksurfaceImageRandomVariable
 
 __all__ = ['Mesh3D',
-           'ViewsphereDiscretizer', 'PlanarWorksurfaceDiscretizer', 'VirtualCamera', 'SceneObject',
+           'ViewsphereDiscretizer', 'PlanarWorksurfaceDiscretizer', 'VirtualCamera', 'SceneObject', 'RenderPool',
+           'RigidTransformArray', 'CameraIntrinsicsArray',
            'ImageToMeshConverter',
-           'ObjFile', 'OffFile',
+           'ObjFile', 'OffFile', 'BinaryMeshFile',
            'RenderMode',
-           'Sdf', 'Sdf3D',
+           'Sdf', 'Sdf3D', 'SparseSdf3D',
            'SdfFile',
            'StablePose',
            'StablePoseFile',
+           'StablePoseCache',
            'CameraSample',
+           'CameraSampleBatch',
            'RenderSample',
            'UniformViewsphereRandomVariable',
            'UniformPlanarWorksurfaceRandomVariable',
@@ -0,0 +1,53 @@
+"""
+Atomic file writes that respect the process umask.
+"""
+import binascii
+import contextlib
+import errno
+import os
+
+TMP_ATTEMPTS = 100
+
+@contextlib.contextmanager
+def atomic_write(filename, mode='wb'):
+    """Opens a temporary file next to filename for writing and renames it
+    to filename when the block exits without an error, so that concurrent
+    readers never see a partially written file. The temporary file is
+    removed if the block raises.
+
+    The temporary file is created with a unique name and the default
+    permissions of the current umask, like a file created with open,
+    so concurrent writers of the same file never share a temporary file.
+
+    Parameters
+    ----------
+    filename : :obj:`str`
+        The full path of the file to write.
+    mode : :obj:`str`
+        The mode to open the temporary file with, 'w' or 'wb'.
+
+    Returns
+    -------
+    :obj:`file`
+        The open temporary file.
+    """
+    file_path, file_root = os.path.split(filename)
+    for attempt in range(TMP_ATTEMPTS):
+        tmp_filename = os.path.join(file_path, '.%s.%s.tmp' %(file_root, binascii.hexlify(os.urandom(8))))
+        try:
+            fd = os.open(tmp_filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0666)
+            break
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+    else:
+        raise IOError(errno.EEXIST, 'No usable temporary file name found for %s' %(filename))
+
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.rename(tmp_filename, filename)
+    except:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
@@ -0,0 +1,171 @@
+"""
+File for loading and saving meshes in a compact binary format that can be
+memory-mapped, so that processes loading the same mesh share its pages.
+"""
+import os
+
+import numpy as np
+
+import mesh
+from atomic_file import atomic_write
+
+class BinaryMeshFile(object):
+    """
+    A binary .bmesh file reader and writer.
+
+    The file starts with a fixed-size little-endian header holding the array
+    sizes, density, center of mass and cached mass properties, followed by
+    the contiguous vertex (float64), triangle (int32) and normal (float64)
+    arrays, each aligned to 8 bytes.
+
+    Attributes
+    ----------
+    filepath : :obj:`str`
+        The full path to the .bmesh file associated with this reader/writer.
+    """
+    MAGIC = 'MPYBMSH1'
+    HEADER_SIZE = 128
+    HAS_COM = 1
+    HAS_MASS_PROPS = 2
+    header_ints_ = np.dtype('<i8')
+    header_floats_ = np.dtype('<f8')
+    vertex_dtype_ = np.dtype('<f8')
+    triangle_dtype_ = np.dtype('<i4')
+
+    def __init__(self, filepath):
+        """Construct and initialize a .bmesh file reader and writer.
+
+        Parameters
+        ----------
+        filepath : :obj:`str`
+            The full path to the desired .bmesh file
+
+        Raises
+        ------
+        ValueError
+            If the file extension is not .bmesh.
+        """
+        self.filepath_ = filepath
+        file_root, file_ext = os.path.splitext(self.filepath_)
+        if file_ext != '.bmesh':
+            raise ValueError('Extension %s invalid for binary meshes' %(file_ext))
+
+    @property
+    def filepath(self):
+        """Returns the full path to the .bmesh file associated with this reader/writer.
+
+        Returns
+        -------
+        :obj:`str`
+            The full path to the .bmesh file associated with this reader/writer.
+        """
+        return self.filepath_
+
+    def read(self, mmap=True):
+        """Reads in the .bmesh file and returns a Mesh3D representation of that mesh.
+
+        Parameters
+        ----------
+        mmap : bool
+            Whether to memory-map the arrays instead of reading them into memory.
+            Mapped arrays are copy-on-write, so modifying them never changes the file.
+
+        Returns
+        -------
+        :obj:`Mesh3D`
+            A Mesh3D created from the data in the .bmesh file.
+
+        Raises
+        ------
+        ValueError
+            If the file is not a valid .bmesh file.
+        """
+        f = open(self.filepath_, 'rb')
+        header = f.read(BinaryMeshFile.HEADER_SIZE)
+        f.close()
+        if len(header) != BinaryMeshFile.HEADER_SIZE or header[:8] != BinaryMeshFile.MAGIC:
+            raise ValueError('File %s is not a valid binary mesh' %(self.filepath_))
+        num_vertices, num_triangles, num_normals, flags = np.frombuffer(header, dtype=BinaryMeshFile.header_ints_, count=4, offset=8)
+        values = np.frombuffer(header, dtype=BinaryMeshFile.header_floats_, count=8, offset=40)
+
+        # read arrays
+        offsets = BinaryMeshFile._offsets(num_vertices, num_triangles, num_normals)
+        vertices = self._read_array(offsets[0], (num_vertices, 3), BinaryMeshFile.vertex_dtype_, mmap)
+        triangles = self._read_array(offsets[1], (num_triangles, 3), BinaryMeshFile.triangle_dtype_, mmap)
+        normals = None
+        if num_normals > 0:
+            normals = self._read_array(offsets[2], (num_normals, 3), BinaryMeshFile.vertex_dtype_, mmap)
+
+        center_of_mass = None
+        if flags & BinaryMeshFile.HAS_COM:
+            center_of_mass = values[1:4].copy()
+        m = mesh.Mesh3D(vertices, triangles, normals, density=values[0],
+                        center_of_mass=center_of_mass)
+        if flags & BinaryMeshFile.HAS_MASS_PROPS:
+            m.signed_volume_ = values[4]
+            m.uniform_com_ = values[5:8].copy()
+        return m
+
+    def write(self, mesh):
+        """Writes a Mesh3D object out to a .bmesh file. The file is written to
+        a temporary file first and then moved into place, so concurrent readers
+        never see a partially written file.
+
+        Parameters
+        ----------
+        mesh : :obj:`Mesh3D`
+            The Mesh3D object to write to the .bmesh file.
+        """
+        vertices = np.ascontiguousarray(mesh.vertices, dtype=BinaryMeshFile.vertex_dtype_)
+        triangles = np.ascontiguousarray(mesh.triangles, dtype=BinaryMeshFile.triangle_dtype_)
+        normals = mesh.normals
+        if normals is None:
+            normals = np.zeros([0, 3])
+        normals = np.ascontiguousarray(normals, dtype=BinaryMeshFile.vertex_dtype_)
+
+        # header
+        flags = 0
+        values = np.zeros(8, dtype=BinaryMeshFile.header_floats_)
+        values[0] = mesh.density
+        if mesh.center_of_mass_ is not None:
+            flags |= BinaryMeshFile.HAS_COM
+            values[1:4] = mesh.center_of_mass_
+        if mesh.signed_volume_ is not None:
+            flags |= BinaryMeshFile.HAS_MASS_PROPS
+            values[4] = mesh.signed_volume_
+            values[5:8] = mesh.uniform_com_
+        ints = np.array([vertices.shape[0], triangles.shape[0], normals.shape[0], flags],
+                        dtype=BinaryMeshFile.header_ints_)
+        header = BinaryMeshFile.MAGIC + ints.tobytes() + values.tobytes()
+        header += '\0' * (BinaryMeshFile.HEADER_SIZE - len(header))
+
+        # write arrays at their offsets
+        with atomic_write(self.filepath_) as f:
+            f.write(header)
+            offsets = BinaryMeshFile._offsets(vertices.shape[0], triangles.shape[0], normals.shape[0])
+            for offset, array in zip(offsets, [vertices, triangles, normals]):
+                f.write('\0' * (offset - f.tell()))
+                f.write(array.tobytes())
+
+    def _read_array(self, offset, shape, dtype, mmap):
+        """Reads one of the mesh arrays from the file.
+        """
+        if shape[0] == 0:
+            return np.zeros(shape, dtype=dtype)
+        if mmap:
+            return np.memmap(self.filepath_, dtype=dtype, mode='c', offset=offset, shape=shape)
+        f = open(self.filepath_, 'rb')
+        f.seek(offset)
+        array = np.fromfile(f, dtype=dtype, count=shape[0] * shape[1]).reshape(shape)
+        f.close()
+        return array
+
+    @staticmethod
+    def _offsets(num_vertices, num_triangles, num_normals):
+        """Returns the byte offsets of the vertex, triangle and normal arrays.
+        """
+        vertex_offset = BinaryMeshFile.HEADER_SIZE
+        triangle_offset = vertex_offset + 3 * BinaryMeshFile.vertex_dtype_.itemsize * num_vertices
+        normal_offset = triangle_offset + 3 * BinaryMeshFile.triangle_dtype_.itemsize * num_triangles
+        normal_offset = 8 * ((normal_offset + 7) // 8)
+        return [int(vertex_offset), int(triangle_offset), int(normal_offset)]
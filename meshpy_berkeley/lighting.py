@@ -83,6 +83,44 @@ class LightingProperties(object):
     def set_pose(self, T_obj_camera):
         self.T_light_obj = T_obj_camera.inverse() * self.T_light_camera.as_frames('light', T_obj_camera.to_frame)
 
+    def pose_arrs(self, object_to_camera_poses):
+        """ Returns the lighting properties relative to the object in each of a list
+        of object to camera poses, computed for all poses at once.
+
+        Parameters
+        ----------
+        object_to_camera_poses : :obj:`list` of :obj:`RigidTransform`
+            A list of object to camera transforms.
+
+        Returns
+        -------
+        :obj:`numpy.ndarray` of float
+            An N x 19 contiguous array where each row equals the `arr` property
+            after setting the corresponding pose.
+        """
+        num_poses = len(object_to_camera_poses)
+        if hasattr(object_to_camera_poses, 'rotations'):
+            # poses that are already stacked
+            R_obj_camera = object_to_camera_poses.rotations
+            t_obj_camera = object_to_camera_poses.translations
+        else:
+            R_obj_camera = np.array([T.rotation for T in object_to_camera_poses]).reshape(num_poses, 3, 3)
+            t_obj_camera = np.array([T.translation for T in object_to_camera_poses]).reshape(num_poses, 3)
+
+        # invert each pose and apply it to the light pose
+        light_translations = np.einsum('nji,nj->ni', R_obj_camera, self.T_light_camera.translation - t_obj_camera)
+        light_z_axes = np.einsum('nji,j->ni', R_obj_camera, self.T_light_camera.rotation[:,2])
+
+        arrs = np.zeros([num_poses, 19], dtype=np.float64)
+        arrs[:,0:3] = self.ambient
+        arrs[:,4:7] = self.diffuse
+        arrs[:,8:11] = self.specular
+        arrs[:,[3,7,11]] = 1
+        arrs[:,12:15] = light_translations
+        arrs[:,15:18] = light_z_axes
+        arrs[:,18] = self.cutoff
+        return arrs
+
     @property
     def arr(self):
         """ Returns the lighting properties as a contiguous numpy array. """
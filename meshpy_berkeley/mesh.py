@@ -2,6 +2,7 @@
 Encapsulates mesh for grasping operations
 Authors: Jeff Mahler and Matt Matl
 """
+import hashlib
 import math
 import Queue
 import os
@@ -10,12 +11,14 @@ from subprocess import Popen
 import sys
 
 import numpy as np
+import scipy.sparse as sparse
 import scipy.spatial as ss
 import sklearn.decomposition
 import trimesh as tm
 
 from autolab_core import RigidTransform, Point, Direction, PointCloud, NormalCloud
 
+import bmesh_file
 import obj_file
 import stable_pose as sp
 
@@ -54,14 +57,17 @@ class Mesh3D(object):
     ScalingTypeRelative = 3
     ScalingTypeDiag = 4
     OBJ_EXT = '.obj'
+    BMESH_EXT = '.bmesh'
     PROC_TAG = '_proc'
     C_canonical = np.array([[1.0 / 60.0, 1.0 / 120.0, 1.0 / 120.0],
                             [1.0 / 120.0, 1.0 / 60.0, 1.0 / 120.0],
                             [1.0 / 120.0, 1.0 / 120.0, 1.0 / 60.0]])
+    default_stp_cache_ = None
 
     def __init__(self, vertices, triangles, normals=None,
                  density=1.0, center_of_mass=None,
-                 trimesh=None, T_obj_world=RigidTransform(from_frame='obj', to_frame='world')):
+                 trimesh=None, T_obj_world=RigidTransform(from_frame='obj', to_frame='world'),
+                 stp_cache=None):
         """Construct a 3D triangular mesh.
 
         Parameters
@@ -78,19 +84,33 @@ class Mesh3D(object):
         density : float
             The density of the mesh.
         center_of_mass : :obj:`numpy.ndarray` of float
-            The 3D location of the mesh's center of mass.
-        uniform_com : bool
-            Whether or not to assume a uniform mass density for center of mass comp
+            The 3D location of the mesh's center of mass. If None, the center
+            of mass is computed on first access assuming a uniform mass
+            density for watertight meshes, or as the bounding box center otherwise.
+        trimesh : :obj:`trimesh.Trimesh`
+            An equivalent trimesh object to reuse, if one is available.
+        T_obj_world : :obj:`RigidTransform`
+            The pose of the mesh in the world frame.
+        stp_cache : :obj:`StablePoseCache`
+            An on-disk cache of stable pose analysis results to consult before
+            computing them. If None, the default cache set with
+            `Mesh3D.set_default_stp_cache` is used, if any.
+
+        Note
+        ----
+        All derived quantities (bounding box center, centroid, center of mass,
+        watertightness and the trimesh object) are computed on first use.
         """
-        if vertices is not None:
+        # memory-mapped arrays are used as is so that their pages stay shared between processes
+        if vertices is not None and not isinstance(vertices, np.memmap):
             vertices = np.array(vertices)
         self.vertices_ = vertices
 
-        if triangles is not None:
+        if triangles is not None and not isinstance(triangles, np.memmap):
             triangles = np.array(triangles)
         self.triangles_ = triangles
 
-        if normals is not None:
+        if normals is not None and not isinstance(normals, np.memmap):
             normals = np.array(normals)
             if normals.shape[0] == 3:
                 normals = normals.T
@@ -103,19 +123,19 @@ class Mesh3D(object):
         # Read-Only parameter initialization
         self.mass_ = None
         self.inertia_ = None
-        self.bb_center_ = self._compute_bb_center() 
-        self.centroid_ = self._compute_centroid()
+        self.signed_volume_ = None
+        self.uniform_com_ = None
+        self.covariance_ = None
+        self.bb_center_ = None
+        self.centroid_ = None
+        self.is_watertight_ = None
+        self.vertex_incidence_ = None
+        self.topology_ = None
         self.surface_area_ = None
         self.face_dag_ = None
         self.trimesh_ = trimesh
         self.T_obj_world_ = T_obj_world
-
-        if self.center_of_mass_ is None:
-            if self.is_watertight:
-                self.center_of_mass_ = np.array(self._compute_com_uniform())
-            else:
-                self.center_of_mass_ = np.array(self.bb_center_)
-
+        self.stp_cache_ = stp_cache
 
     ##################################################################
     # Properties
@@ -137,10 +157,16 @@ class Mesh3D(object):
         self.vertices_ = np.array(v)
         self.mass_ = None
         self.inertia_ = None
+        self._reset_mass_properties()
         self.normals_ = None
         self.surface_area_ = None
-        self.bb_center_ = self._compute_bb_center()
-        self.centroid_ = self._compute_centroid()
+        self.bb_center_ = None
+        self.centroid_ = None
+        self.is_watertight_ = None
+        self.vertex_incidence_ = None
+        self.topology_ = None
+        self.face_dag_ = None
+        self.trimesh_ = None
 
     @property
     def triangles(self):
@@ -155,7 +181,13 @@ class Mesh3D(object):
         self.triangles_ = np.array(t)
         self.mass_ = None
         self.inertia_ = None
+        self._reset_mass_properties()
         self.surface_area_ = None
+        self.is_watertight_ = None
+        self.vertex_incidence_ = None
+        self.topology_ = None
+        self.face_dag_ = None
+        self.trimesh_ = None
 
     @property
     def normals(self):
@@ -186,12 +218,18 @@ class Mesh3D(object):
         """:obj:`numpy.ndarray` of float :
         The 3D location of the mesh's center of mass.
         """
-        return self.center_of_mass_
+        if self.center_of_mass_ is not None:
+            return self.center_of_mass_
+        if self.is_watertight:
+            return self._compute_com_uniform()
+        return self.bb_center
 
     @center_of_mass.setter
     def center_of_mass(self, com):
         self.center_of_mass_ = com
         self.inertia_ = None
+        self.covariance_ = None
+        self.face_dag_ = None
 
     @property
     def num_vertices(self):
@@ -233,6 +271,8 @@ class Mesh3D(object):
         The 3D location of the center of the mesh's minimal bounding box
         (read-only).
         """
+        if self.bb_center_ is None:
+            self.bb_center_ = self._compute_bb_center()
         return self.bb_center_
 
     @property
@@ -240,8 +280,31 @@ class Mesh3D(object):
         """:obj:`numpy.ndarray` of float :
         The 3D location of the mesh's vertex mean (read-only).
         """
+        if self.centroid_ is None:
+            self.centroid_ = self._compute_centroid()
         return self.centroid_
 
+    @property
+    def vertex_incidence(self):
+        """:obj:`scipy.sparse.csr_matrix` of int :
+        A sparse #verts by 3*#tris matrix that maps triangle corners to
+        vertices (read-only). Column 3*i+j is the j-th corner of triangle i,
+        and contains a single 1 in the row of the vertex at that corner.
+        Row i lists the triangle corners incident to vertex i.
+        """
+        if self.vertex_incidence_ is None:
+            self.vertex_incidence_ = Mesh3D._compute_vertex_incidence(self.triangles_, self.num_vertices)
+        return self.vertex_incidence_
+
+    @property
+    def topology(self):
+        """:obj:`Mesh3D._Topology` :
+        Array-backed vertex, edge and triangle connectivity of the mesh (read-only).
+        """
+        if self.topology_ is None:
+            self.topology_ = Mesh3D._Topology(self.triangles_, self.vertex_incidence)
+        return self.topology_
+
     ##################################################################
     # Public Class Methods
     ##################################################################
@@ -418,15 +481,11 @@ class Mesh3D(object):
         float
             The total volume of the mesh.
         """
-        total_volume = 0
-        for tri in self.triangles_:
-            volume = self._signed_volume_of_tri(tri)
-            total_volume = total_volume + volume
+        if self.signed_volume_ is None:
+            self._compute_mass_properties()
 
         # Correct for flipped triangles
-        if total_volume < 0:
-            total_volume = -total_volume
-        return total_volume
+        return abs(self.signed_volume_)
 
     def covariance(self):
         """Return the total covariance of the mesh's triangles.
@@ -436,11 +495,9 @@ class Mesh3D(object):
         float
             The total covariance of the mesh's triangles.
         """
-        C_sum = np.zeros([3,3])
-        for tri in self.triangles_:
-            C = self._covariance_of_tri(tri)
-            C_sum = C_sum + C
-        return C_sum
+        if self.covariance_ is None:
+            self._compute_mass_properties()
+        return self.covariance_
 
     def remove_bad_tris(self):
         """Remove triangles with out-of-bounds vertices from the mesh.
@@ -526,8 +583,7 @@ class Mesh3D(object):
         This shifts the mesh without rotating it so that
         the center of its bounding box is at the origin.
         """
-        self.vertices = self.vertices_ - self.center_of_mass_
-        self.trimesh_ = None # flag re-comp of trimesh
+        self.vertices = self.vertices_ - self.center_of_mass
 
     def normalize_vertices(self):
         """Normalize the mesh's orientation along its principal axes.
@@ -571,76 +627,56 @@ class Mesh3D(object):
 
     def compute_vertex_normals(self):
         """ Get normals from triangles"""
-        normals = []
-        # weighted average of triangle normal for each vertex
-        for i in range(len(self.vertices)):
-            inds = np.where(self.triangles == i)
-            tris = self.triangles[inds[0],:]
-            normal = np.zeros(3)
-            for tri in tris:
-                # compute triangle normal
-                t = self.vertices[tri, :]
-                v0 = t[1,:] - t[0,:]
-                v1 = t[2,:] - t[0,:]
-                if np.linalg.norm(v0) == 0:
-                    continue
-                v0 = v0 / np.linalg.norm(v0)
-                if np.linalg.norm(v1) == 0:
-                    continue
-                v1 = v1 / np.linalg.norm(v1)
-                n = np.cross(v0, v1)
-                if np.linalg.norm(n) == 0:
-                    continue
-                n = n / np.linalg.norm(n)
-
-                # compute weight by area of triangle
-                w_area = self._area_of_tri(tri)
-
-                # compute weight by edge angle
-                vertex_ind = np.where(tri == i)[0][0]
-                if vertex_ind == 0:
-                    e0 = t[1,:] - t[0,:]
-                    e1 = t[2,:] - t[0,:]
-                elif vertex_ind == 1:
-                    e0 = t[0,:] - t[1,:]
-                    e1 = t[2,:] - t[1,:]
-                elif vertex_ind == 2:
-                    e0 = t[0,:] - t[2,:]
-                    e1 = t[1,:] - t[2,:]
-                if np.linalg.norm(e0) == 0:
-                    continue
-                if np.linalg.norm(e1) == 0:
-                    continue
-                e0 = e0 / np.linalg.norm(e0)
-                e1 = e1 / np.linalg.norm(e1)
-                w_angle = np.arccos(e0.dot(e1))
-
-                # weighted update
-                # www.bytehazard.com/articles/vertnorm.html
-                normal += w_area * w_angle * n
-
-            # normalize
-            if np.linalg.norm(normal) == 0:
-                normal = np.array([1,0,0])
-            normal = normal / np.linalg.norm(normal)
-            normals.append(normal)
+        tri_verts = self.vertices_[self.triangles_.reshape(-1, 3)]
+
+        # compute triangle normals and areas
+        e01 = tri_verts[:,1,:] - tri_verts[:,0,:]
+        e02 = tri_verts[:,2,:] - tri_verts[:,0,:]
+        cross = np.cross(e01, e02)
+        cross_norms = np.linalg.norm(cross, axis=1)
+        valid = (np.linalg.norm(e01, axis=1) > 0) & (np.linalg.norm(e02, axis=1) > 0) & (cross_norms > 0)
+        tri_normals = np.zeros(cross.shape)
+        tri_normals[valid] = cross[valid] / cross_norms[valid,np.newaxis]
+        w_area = 0.5 * cross_norms
+
+        # compute weight by edge angle at each triangle corner
+        e0 = np.roll(tri_verts, -1, axis=1) - tri_verts
+        e1 = np.roll(tri_verts, -2, axis=1) - tri_verts
+        e0_norms = np.linalg.norm(e0, axis=2)
+        e1_norms = np.linalg.norm(e1, axis=2)
+        corner_valid = valid[:,np.newaxis] & (e0_norms > 0) & (e1_norms > 0)
+        cos_angle = np.sum(e0 * e1, axis=2) / np.where(corner_valid, e0_norms * e1_norms, 1.0)
+        w_angle = np.arccos(np.clip(cos_angle, -1.0, 1.0))
+
+        # weighted sum of the normals of all incident triangles
+        # www.bytehazard.com/articles/vertnorm.html
+        weights = np.where(corner_valid, w_area[:,np.newaxis] * w_angle, 0.0)
+        corner_normals = weights[:,:,np.newaxis] * tri_normals[:,np.newaxis,:]
+        normals = self.vertex_incidence.dot(corner_normals.reshape(-1, 3))
+
+        # normalize
+        normal_norms = np.linalg.norm(normals, axis=1)
+        normals[normal_norms == 0] = np.array([1,0,0])
+        normal_norms[normal_norms == 0] = 1.0
+        normals = normals / normal_norms[:,np.newaxis]
 
         # set numpy array
-        self.normals = np.array(normals)
+        self.normals = normals
 
         # reverse normals based on alignment with convex hull
         hull = ss.ConvexHull(self.vertices)
-        hull_tris = hull.simplices.tolist()
-        hull_vertex_inds = np.unique(hull_tris)
+        hull_vertex_inds = np.unique(hull.simplices)
 
+        # vote in blocks of hull vertices to bound the memory of the inner products
         num_aligned = 0
-        num_misaligned = 0
-        for hull_vertex_ind in hull_vertex_inds:
-            hull_vertex = self.vertices[hull_vertex_ind, :]
-            hull_vertex_normal = normals[hull_vertex_ind]
-            ip = (hull_vertex - self.vertices).dot(hull_vertex_normal)
-            num_aligned += np.sum(ip > 0)
-            num_misaligned += np.sum(ip <= 0)
+        block_size = max(1, 2**22 // self.num_vertices)
+        for i in range(0, hull_vertex_inds.shape[0], block_size):
+            block_inds = hull_vertex_inds[i:i+block_size]
+            hull_vertices = self.vertices[block_inds, :]
+            hull_vertex_normals = normals[block_inds, :]
+            hull_ip = np.sum(hull_vertices * hull_vertex_normals, axis=1)
+            num_aligned += np.count_nonzero(self.vertices.dot(hull_vertex_normals.T) < hull_ip)
+        num_misaligned = hull_vertex_inds.shape[0] * self.num_vertices - num_aligned
 
         if num_misaligned > num_aligned:
             self.normals = -self.normals
@@ -755,7 +791,7 @@ class Mesh3D(object):
             normal_cloud = NormalCloud(self.normals_.T, frame=T.from_frame)
             normal_cloud_tf = T * normal_cloud
             normals = normal_cloud_tf.data.T
-        com = Point(self.center_of_mass_, frame=T.from_frame)
+        com = Point(self.center_of_mass, frame=T.from_frame)
         com_tf = T * com
 
         if self.normals_ is not None:
@@ -893,9 +929,9 @@ class Mesh3D(object):
         hull = ss.ConvexHull(self.vertices_)
         hull_tris = hull.simplices
         if self.normals_ is None:
-            cvh_mesh = Mesh3D(self.vertices_.copy(), hull_tris.copy(), center_of_mass=self.center_of_mass_)
+            cvh_mesh = Mesh3D(self.vertices_.copy(), hull_tris.copy(), center_of_mass=self.center_of_mass)
         else:
-            cvh_mesh = Mesh3D(self.vertices_.copy(), hull_tris.copy(), normals=self.normals_.copy(), center_of_mass=self.center_of_mass_)
+            cvh_mesh = Mesh3D(self.vertices_.copy(), hull_tris.copy(), normals=self.normals_.copy(), center_of_mass=self.center_of_mass)
         cvh_mesh.remove_unreferenced_vertices()
         return cvh_mesh
 
@@ -917,18 +953,16 @@ class Mesh3D(object):
             self._compute_face_dag()
         cvh_mesh = self.face_dag_.mesh
         cvh_verts = self.face_dag_.mesh.vertices
-
-        # propagate probabilities
-        cm = self.center_of_mass
-        prob_map = Mesh3D._compute_prob_map(self.face_dag_.nodes.values(), cvh_verts, cm)
+        cvh_tris = self.face_dag_.mesh.triangles
+        resting_probs = self.face_dag_.resting_probs
 
         # compute stable poses
         stable_poses = []
-        for face, p in prob_map.items():
+        for face_ind in np.where(resting_probs > min_prob)[0]:
+            face = cvh_tris[face_ind]
             x0 = cvh_verts[face[0]]
             r = cvh_mesh._compute_basis([cvh_verts[i] for i in face])
-            if p > min_prob:
-                stable_poses.append(sp.StablePose(p, r, x0, face=face))
+            stable_poses.append(sp.StablePose(resting_probs[face_ind], r, x0, face=face))
 
         return stable_poses
 
@@ -943,127 +977,147 @@ class Mesh3D(object):
             transformation from object to table basis (z-axis upward) specifying the orientation of the mesh
         eps : float
             numeric tolerance in cone projection solver
-        
+
         Returns
         -------
         :obj:`StablePose`
             stable pose specifying the face that the mesh will land on
+
+        Raises
+        ------
+        ValueError
+            If no resting face can be found for the orientation.
+        """
+        faces, rotations, contact_points = self.resting_poses(T_obj_world.rotation[np.newaxis,:,:], eps=eps)
+        if faces[0,0] < 0:
+            raise ValueError('Failed to find a valid resting face')
+        return sp.StablePose(0.0, rotations[0], contact_points[0], face=faces[0])
+
+    def resting_poses(self, rotations, eps=1e-10):
+        """ Returns the stable poses that the mesh will rest on if it lands
+        on an infinite planar worksurface quasi-statically in each of the
+        given orientations. All orientations are processed at once.
+
+        The lowest convex hull vertex in each orientation is the contact vertex.
+        The mesh topples onto the downward-facing neighboring face whose projection
+        onto the table contains the direction from the contact vertex to the center
+        of mass, and then follows the face DAG to its sink. The resting rotation is finally
+        aligned about the table normal with the x (or y) axis of the orientation.
+
+        Parameters
+        ----------
+        rotations : :obj:`numpy.ndarray` of float
+            Nx3x3 array of rotations from object to table basis (z-axis upward)
+        eps : float
+            numeric tolerance in cone projection solver
+
+        Returns
+        -------
+        :obj:`numpy.ndarray` of int
+            Nx3 array of the convex hull vertex indices of the resting face for each
+            orientation, with rows of -1 where no resting face could be found
+        :obj:`numpy.ndarray` of float
+            Nx3x3 array of the resting rotations from object to table basis
+        :obj:`numpy.ndarray` of float
+            Nx3 array of the contact vertex for each orientation, in the object frame
         """
         # compute face dag if necessary
         if self.face_dag_ is None:
             self._compute_face_dag()
-
-        # adjust transform to place mesh in contact with table
-        T_obj_table = self.get_T_surface_obj(T_obj_world, delta=0.0)
-
-        # transform mesh
-        cvh_mesh = self.face_dag_.mesh 
+        cvh_mesh = self.face_dag_.mesh
         cvh_verts = cvh_mesh.vertices
-        mesh_tf = cvh_mesh.transform(T_obj_table)
-        vertices_tf = mesh_tf.vertices
-
-        # find the vertex with the minimum z value
-        min_z = np.min(vertices_tf[:,2])
-        contact_ind = np.where(vertices_tf[:,2] == min_z)[0]
-        if contact_ind.shape[0] == 0:
-            raise ValueError('Unable to find the vertex contacting the table!')
-        vertex_ind = contact_ind[0]
-
-        # project the center of mass onto the table plane
-        table_tri = np.array([[0,0,0],
-                              [1,0,0],
-                              [0,1,0]])
-        proj_cm = Mesh3D._proj_point_to_plane(table_tri, self.center_of_mass)
-        contact_vertex = vertices_tf[vertex_ind]
-        v_cm = proj_cm - contact_vertex
-        v_cm = v_cm[:2]
-
-        # compute which face the vertex will topple onto
-        # break loop when topple tri is found        
-        topple_tri = None
-        neighboring_tris = self.face_dag_.vertex_to_tri[vertex_ind]
-        random.shuffle(neighboring_tris)
-        for neighboring_tri in neighboring_tris:
-            # find indices of other two vertices
-            ind = [0, 1, 2]
-            for i, v in enumerate(neighboring_tri):
-                if np.allclose(contact_vertex, vertices_tf[v]):
-                    ind.remove(i)
-                    
-            # form edges in table plane
-            i1 = neighboring_tri[ind[0]]
-            i2 = neighboring_tri[ind[1]]
-            v1 = Mesh3D._proj_point_to_plane(table_tri, vertices_tf[i1])
-            v2 = Mesh3D._proj_point_to_plane(table_tri, vertices_tf[i2])
-            u1 = v1 - contact_vertex
-            u2 = v2 - contact_vertex
-            U = np.array([u1[:2], u2[:2]]).T
-
-            # solve linear subproblem to find cone coefficients
-            try:
-                alpha = np.linalg.solve(U + eps*np.eye(2), v_cm)
-
-                # exit loop with topple tri if found
-                if np.all(alpha >= 0):
-                    tri_normal = cvh_mesh._compute_basis([cvh_verts[i] for i in neighboring_tri])[2,:]
-                    if tri_normal[2] < 0:
-                        tri_normal = -tri_normal
-
-                    # check whether lower
-                    lower = True
-                    tri_center = np.mean([vertices_tf[i] for i in neighboring_tri], axis=0)
-                    if topple_tri is not None:
-                        topple_tri_center = np.mean([vertices_tf[i] for i in topple_tri], axis=0)
-                        lower = (tri_normal.dot(topple_tri_center-tri_center) > 0)
-                    if lower:
-                        topple_tri = neighboring_tri
-
-            except np.linalg.LinAlgError:
-                logging.warning('Failed to solve linear system')
-
-        # check solution
-        if topple_tri is None:
-            raise ValueError('Failed to find a valid topple triangle')
-
-        # compute the face that the mesh will eventually rest on
-        # by following the child nodes to a sink
-        cur_node = self.face_dag_.nodes[tuple(topple_tri)]
-        visited = []
-        while not cur_node.is_sink:
-            if cur_node in visited:
-                raise ValueError('Found loop!')
-            visited.append(cur_node)
-            cur_node = cur_node.children[0]
-
-        # create stable pose
-        resting_face = cur_node.face
-        x0 = cvh_verts[vertex_ind]
-        R = cvh_mesh._compute_basis([cvh_verts[i] for i in resting_face])
-
-        # align with axes with the original pose
-        best_theta = 0
-        best_dot = 0
-        cur_theta = 0
-        delta_theta = 0.01
-        px = R[:,0].copy()
-        px[2] = 0
-        py = R[:,1].copy()
-        py[2] = 0
-        align_x = True
-        if np.linalg.norm(py) > np.linalg.norm(px):
-            align_x = False
-        while cur_theta <= 2*np.pi:
-            Rz = RigidTransform.z_axis_rotation(cur_theta)
-            Rp = Rz.dot(R)
-            dot_prod = Rp[:,0].dot(T_obj_world.x_axis)
-            if not align_x:
-                dot_prod = Rp[:,1].dot(T_obj_world.y_axis)
-            if dot_prod > best_dot:
-                best_dot = dot_prod
-                best_theta = cur_theta
-            cur_theta += delta_theta
-        R = RigidTransform.z_axis_rotation(best_theta).dot(R)
-        return sp.StablePose(0.0, R, x0, face=resting_face)
+        cvh_tris = cvh_mesh.triangles
+        topology = cvh_mesh.topology
+        rotations = np.asarray(rotations, dtype=np.float64).reshape(-1, 3, 3)
+        num_poses = rotations.shape[0]
+
+        # find the vertex with the minimum z value, in blocks to bound memory
+        vertex_inds = np.zeros(num_poses, dtype=np.int64)
+        block_size = max(1, 2**22 // cvh_mesh.num_vertices)
+        for i in range(0, num_poses, block_size):
+            z = rotations[i:i+block_size,2,:].dot(cvh_verts.T)
+            vertex_inds[i:i+block_size] = np.argmin(z, axis=1)
+
+        # table plane coordinates of the contact vertices and the center of mass
+        contact_points = cvh_verts[vertex_inds]
+        contact_xy = np.einsum('nij,nj->ni', rotations[:,:2,:], contact_points)
+        v_cm = rotations[:,:2,:].dot(self.center_of_mass) - contact_xy
+
+        # expand each pose into one candidate per triangle neighboring its contact vertex
+        offsets = topology.vertex_tri_offsets
+        counts = offsets[vertex_inds+1] - offsets[vertex_inds]
+        pose_inds = np.repeat(np.arange(num_poses), counts)
+        starts = np.cumsum(counts) - counts
+        cand_tri_inds = topology.vertex_tris[offsets[vertex_inds][pose_inds] + np.arange(pose_inds.shape[0]) - starts[pose_inds]]
+        cand_tris = cvh_tris[cand_tri_inds]
+
+        # form the other two edges of each candidate in the table plane
+        corner = np.argmax(cand_tris == vertex_inds[pose_inds][:,np.newaxis], axis=1)
+        rows = np.arange(cand_tris.shape[0])
+        i1 = cand_tris[rows, (corner + 1) % 3]
+        i2 = cand_tris[rows, (corner + 2) % 3]
+        cand_rotations = rotations[pose_inds,:2,:]
+        u1 = np.einsum('nij,nj->ni', cand_rotations, cvh_verts[i1]) - contact_xy[pose_inds]
+        u2 = np.einsum('nij,nj->ni', cand_rotations, cvh_verts[i2]) - contact_xy[pose_inds]
+
+        # solve the 2x2 linear subproblems U * alpha = v_cm to find cone coefficients
+        a, b = u1[:,0] + eps, u2[:,0]
+        c, d = u1[:,1], u2[:,1] + eps
+        det = a * d - b * c
+        solvable = det != 0
+        det[~solvable] = 1.0
+        v = v_cm[pose_inds]
+        alpha1 = (d * v[:,0] - b * v[:,1]) / det
+        alpha2 = (a * v[:,1] - c * v[:,0]) / det
+        valid = solvable & (alpha1 >= 0) & (alpha2 >= 0)
+
+        # only faces with a downward outward normal can topple onto the table
+        hull_normals = cvh_mesh.tri_normals()
+        hull_center = np.mean(cvh_verts, axis=0)
+        inward = np.sum(hull_normals * (hull_center - cvh_verts[cvh_tris[:,0]]), axis=1) > 0
+        hull_normals[inward] = -hull_normals[inward]
+        cand_normal_z = np.sum(rotations[pose_inds,2,:] * hull_normals[cand_tri_inds], axis=1)
+        valid = valid & (cand_normal_z < 0)
+
+        # pick the lowest valid candidate of each pose as the topple triangle
+        cand_z = np.einsum('nj,nkj->n', rotations[pose_inds,2,:], cvh_verts[cand_tris]) / 3.0
+        cand_z[~valid] = np.inf
+        order = np.lexsort((cand_z, pose_inds))
+        best = order[starts]
+        found = np.isfinite(cand_z[best])
+        topple_tri_inds = cand_tri_inds[best]
+
+        # look up the face that the mesh will eventually rest on
+        resting_inds = np.where(found, self.face_dag_.sinks[topple_tri_inds], -1)
+        found = resting_inds >= 0
+        faces = -np.ones([num_poses, 3], dtype=cvh_tris.dtype)
+        faces[found] = cvh_tris[resting_inds[found]]
+
+        # compute the basis of each distinct resting face once
+        R = np.tile(np.eye(3), [num_poses, 1, 1])
+        for resting_ind in np.unique(resting_inds[found]):
+            face_verts = [cvh_verts[i] for i in cvh_tris[resting_ind]]
+            R[resting_inds == resting_ind] = cvh_mesh._compute_basis(face_verts)
+
+        # align with axes with the original pose by maximizing the dot product
+        # of the rotated x (or y) axis with the original one in closed form
+        align_x = np.linalg.norm(R[:,:2,0], axis=1) >= np.linalg.norm(R[:,:2,1], axis=1)
+        axis = np.where(align_x, 0, 1)
+        pose_rows = np.arange(num_poses)
+        p = R[pose_rows,:,axis]
+        q = rotations[pose_rows,:,axis]
+        cos_coef = p[:,0] * q[:,0] + p[:,1] * q[:,1]
+        sin_coef = p[:,0] * q[:,1] - p[:,1] * q[:,0]
+        theta = np.arctan2(sin_coef, cos_coef)
+        best_dot = np.hypot(cos_coef, sin_coef) + p[:,2] * q[:,2]
+        theta[best_dot <= 0] = 0
+        Rz = np.zeros([num_poses, 3, 3])
+        Rz[:,0,0] = np.cos(theta)
+        Rz[:,0,1] = -np.sin(theta)
+        Rz[:,1,0] = np.sin(theta)
+        Rz[:,1,1] = np.cos(theta)
+        Rz[:,2,2] = 1
+        return faces, np.matmul(Rz, R), contact_points
 
     def merge(self, other_mesh):
         """ Combines this mesh with another mesh.
@@ -1157,7 +1211,7 @@ class Mesh3D(object):
         return surface
 
     @staticmethod
-    def load(filename, cache_dir,  preproc_script = None):
+    def load(filename, cache_dir,  preproc_script = None, use_binary_cache=True):
         """Load a mesh from a file.
 
         Note
@@ -1172,10 +1226,15 @@ class Mesh3D(object):
             Path to mesh file.
         cache_dir : :obj:`str`
             A directory to store a converted .obj file in, if
-            the file isn't already in .obj format.
+            the file isn't already in .obj format, and the binary
+            copy of the mesh.
         preproc_script : :obj:`str`
             The path to an optional script to run before converting
             the mesh file to .obj if necessary.
+        use_binary_cache : bool
+            Whether to load the mesh from a memory-mapped binary copy in the
+            cache directory when it is newer than the .obj file, and to write
+            one after parsing the .obj file otherwise.
 
         Returns
         -------
@@ -1197,8 +1256,25 @@ class Mesh3D(object):
         if not os.path.exists(obj_filename):
             raise ValueError('Unable to open file %s. It may not exist or meshlab may not be installed.' %(filename))
 
-        # Read mesh from obj file
-        return obj_file.ObjFile(obj_filename).read()
+        if not use_binary_cache or cache_dir is None or not os.path.isdir(cache_dir):
+            return obj_file.ObjFile(obj_filename).read()
+
+        # Read mesh from the binary copy if it is up to date, named by the source path to avoid collisions
+        path_hash = hashlib.sha1(os.path.abspath(obj_filename)).hexdigest()[:8]
+        bmesh_filename = os.path.join(cache_dir, '%s_%s%s' %(file_root, path_hash, Mesh3D.BMESH_EXT))
+        if os.path.exists(bmesh_filename) and os.path.getmtime(bmesh_filename) >= os.path.getmtime(obj_filename):
+            try:
+                return bmesh_file.BinaryMeshFile(bmesh_filename).read()
+            except (IOError, ValueError):
+                pass
+
+        # Read mesh from obj file and save the binary copy, which is best effort
+        mesh = obj_file.ObjFile(obj_filename).read()
+        try:
+            bmesh_file.BinaryMeshFile(bmesh_filename).write(mesh)
+        except (IOError, OSError):
+            pass
+        return mesh
 
     @property
     def trimesh(self):
@@ -1211,17 +1287,69 @@ class Mesh3D(object):
 
     @property
     def is_watertight(self):
-        return self.trimesh.is_watertight
+        """bool : Whether every edge of the mesh is shared by exactly two
+        triangles, after merging vertices with identical coordinates.
+        """
+        if self.is_watertight_ is None:
+            self.is_watertight_ = self._compute_is_watertight()
+        return self.is_watertight_
 
     @property
     def T_obj_world(self):
         """ Return pose. """
         return self.T_obj_world_
 
+    @property
+    def stp_cache(self):
+        """:obj:`StablePoseCache` : The cache of stable pose analysis results
+        used by this mesh, or None if results are always computed.
+        """
+        if self.stp_cache_ is not None:
+            return self.stp_cache_
+        return Mesh3D.default_stp_cache_
+
+    @stp_cache.setter
+    def stp_cache(self, cache):
+        self.stp_cache_ = cache
+
+    @staticmethod
+    def set_default_stp_cache(cache):
+        """Sets the stable pose cache used by all meshes without their own cache.
+
+        Parameters
+        ----------
+        cache : :obj:`StablePoseCache`
+            The cache to use, or None to disable caching by default.
+        """
+        Mesh3D.default_stp_cache_ = cache
+
     ##################################################################
     # Private Class Methods
     ##################################################################
 
+    def _compute_is_watertight(self):
+        """Checks whether every edge of the mesh is shared by exactly two triangles.
+
+        Returns
+        -------
+        bool
+            True if the mesh is watertight, False otherwise.
+        """
+        if self.vertices_ is None or self.triangles_ is None or self.num_triangles == 0:
+            return False
+        triangles = self.triangles_.reshape(-1, 3)
+        if np.any(triangles < 0) or np.any(triangles >= self.num_vertices):
+            return False
+
+        # merge duplicate vertices, as trimesh does before its check
+        unique_vertices, vertex_ids = np.unique(self.vertices_, axis=0, return_inverse=True)
+        if unique_vertices.shape[0] == self.num_vertices:
+            return self.topology.is_closed
+        triangles = vertex_ids[triangles]
+        num_vertices = unique_vertices.shape[0]
+        vertex_incidence = Mesh3D._compute_vertex_incidence(triangles, num_vertices)
+        return Mesh3D._Topology(triangles, vertex_incidence).is_closed
+
     def _compute_mass(self):
         """Computes the mesh mass.
 
@@ -1273,18 +1401,43 @@ class Mesh3D(object):
             3-ndarray of floats that contains the coordinates
             of the center of mass.
         """
+        if self.uniform_com_ is None:
+            self._compute_mass_properties()
+        return self.uniform_com_
+
+    def _compute_mass_properties(self):
+        """Computes the signed volume, uniform-density center of mass and
+        covariance of the mesh in a single batched pass over its triangles.
+
+        Each triangle forms a tetrahedron with the origin, and the per-tetrahedron
+        quantities are summed. The covariance is taken about the current
+        center of mass.
         """
-        total_volume = 0
-        weighted_point_sum = np.zeros([1, 3])
-        for tri in self.triangles_:
-            volume = self._signed_volume_of_tri(tri)
-            center = self._center_of_tri(tri)
-            weighted_point_sum = weighted_point_sum + volume * center
-            total_volume = total_volume + volume
-        center_of_mass = weighted_point_sum / total_volume
-        return center_of_mass[0]
+        # #tris x 3 x 3 array, where each row of a block is one vertex of the triangle
+        tri_verts = self.vertices_[self.triangles_.reshape(-1, 3)]
+
+        # volume and center of mass of the tetrahedra
+        signed_volumes = np.linalg.det(tri_verts) / 6.0
+        total_volume = np.sum(signed_volumes)
+        if total_volume != 0:
+            uniform_com = signed_volumes.dot(np.sum(tri_verts, axis=1)) / (4.0 * total_volume)
+        else:
+            uniform_com = self._compute_bb_center()
+
+        self.signed_volume_ = total_volume
+        self.uniform_com_ = uniform_com
+
+        # second moments about the center of mass
+        A = np.transpose(tri_verts - self.center_of_mass, (0, 2, 1))
+        weighted_AC = np.linalg.det(A)[:,np.newaxis,np.newaxis] * np.matmul(A, Mesh3D.C_canonical)
+        self.covariance_ = np.tensordot(weighted_AC, A, axes=([0, 2], [0, 2]))
+
+    def _reset_mass_properties(self):
+        """Flags the cached output of _compute_mass_properties for recomputation.
         """
-        return self.trimesh.center_mass
+        self.signed_volume_ = None
+        self.uniform_com_ = None
+        self.covariance_ = None
 
     def _compute_centroid(self):
         """Computes the centroid (mean) of the mesh's vertices.
@@ -1354,9 +1507,10 @@ class Mesh3D(object):
         v3 = self.vertices_[tri[2], :]
 
         A = np.zeros([3,3])
-        A[:,0] = v1 - self.center_of_mass_
-        A[:,1] = v2 - self.center_of_mass_
-        A[:,2] = v3 - self.center_of_mass_
+        center_of_mass = self.center_of_mass
+        A[:,0] = v1 - center_of_mass
+        A[:,1] = v2 - center_of_mass
+        A[:,2] = v3 - center_of_mass
         C = np.linalg.det(A) * A.dot(Mesh3D.C_canonical).dot(A.T)
         return C
 
@@ -1416,42 +1570,6 @@ class Mesh3D(object):
         p = (1-r1)*verts[0] + r1*(1-r2)*verts[1] + r1*r2*verts[2]
         return p
 
-    def _compute_proj_area(self, verts):
-        """Projects vertices onto the unit sphere from the center of mass
-        and computes the projected area.
-
-        Parameters
-        ----------
-        verts : `list` of `numpy.ndarray` of float
-            List of 3-ndarrays of floats that represent the vertices to be
-            projected onto the unit sphere.
-
-        Returns
-        -------
-        float
-            The total projected area on the unit sphere.
-        """
-        cm = self.center_of_mass
-        angles = []
-
-        proj_verts = [(v - cm) / np.linalg.norm(v - cm) for v in verts]
-
-        a = math.acos(min(1, max(-1, np.dot(proj_verts[0], proj_verts[1]) /
-                                    (np.linalg.norm(proj_verts[0]) * np.linalg.norm(proj_verts[1])))))
-        b = math.acos(min(1, max(-1, np.dot(proj_verts[0], proj_verts[2]) /
-                                    (np.linalg.norm(proj_verts[0]) * np.linalg.norm(proj_verts[2])))))
-        c = math.acos(min(1, max(-1, np.dot(proj_verts[1], proj_verts[2]) /
-                                    (np.linalg.norm(proj_verts[1]) * np.linalg.norm(proj_verts[2])))))
-        s = (a + b + c) / 2
-
-        try:
-            return 4 * math.atan(math.sqrt(math.tan(s/2)*math.tan((s-a)/2)*
-                                        math.tan((s-b)/2)*math.tan((s-c)/2)))
-        except:
-            s = s + 0.001
-            return 4 * math.atan(math.sqrt(math.tan(s/2)*math.tan((s-a)/2)*
-                                        math.tan((s-b)/2)*math.tan((s-c)/2)))
-
     def _compute_basis(self, face_verts):
         """Computes axes for a transformed basis relative to the plane in which input vertices lie.
 
@@ -1502,168 +1620,174 @@ class Mesh3D(object):
         """ Computes a directed acyclic graph (DAG) specifying the
         toppling structure of the mesh faces by:
             1) Computing the mesh convex hull
-            2) Creating maps from vertices and edges to the triangles that share them 
+            2) Computing the prior probability of landing on each hull face
             3) Connecting each triangle in the convex hull to the face it will topple to, if landed on
+        All hull faces are processed at once with array operations.
+        If the mesh has a stable pose cache, the DAG is read from it when
+        present and written to it after being computed.
         Modifies the class variable self.face_dag_.
         """
-        # compute convex hull
+        # check the cache
         cm = self.center_of_mass
-        cvh_mesh = self.convex_hull()
-        cvh_tris = cvh_mesh.triangles
-        cvh_verts  = cvh_mesh.vertices
-
-        # create vertex and edge maps, and create nodes of graph
-        nodes = {}   # mapping from triangle tuples to GraphVertex objects
-        vertex_to_tri = {} # mapping from vertex indidces to adjacent triangle lists
-        edge_to_tri = {} # mapping from edge tuples to adjacent triangle lists
-
-        for tri in cvh_tris:
-            # add vertex to tri mapping
-            for v in tri:
-                if v in vertex_to_tri:
-                    vertex_to_tri[v] += [tuple(tri)]
-                else:
-                    vertex_to_tri[v] = [tuple(tri)]
-
-            # add edges to tri mapping
-            tri_verts = [cvh_verts[i] for i in tri]
-            s1 = Mesh3D._Segment(tri_verts[0], tri_verts[1])
-            s2 = Mesh3D._Segment(tri_verts[0], tri_verts[2])
-            s3 = Mesh3D._Segment(tri_verts[1], tri_verts[2])
-            for seg in [s1, s2, s3]:
-                k = seg.tup
-                if k in edge_to_tri:
-                    edge_to_tri[k] += [tuple(tri)]
-                else:
-                    edge_to_tri[k] = [tuple(tri)]
-
-            # add triangle to graph with prior probability estimate
-            p = self._compute_proj_area(tri_verts) / (4 * math.pi)
-            nodes[tuple(tri)] = Mesh3D._GraphVertex(p, tri)
+        cache = self.stp_cache
+        if cache is not None:
+            key = cache.key(self.vertices_, self.triangles_, cm)
+            entry = cache.get(key)
+            if entry is not None:
+                cvh_mesh = Mesh3D(entry['vertices'], entry['triangles'], center_of_mass=cm)
+                self.face_dag_ = Mesh3D._FaceDAG(cvh_mesh, entry['probabilities'], entry['successors'],
+                                                 entry['sinks'], entry['resting_probs'])
+                return
 
-        # connect nodes in the graph based on geometric toppling criteria
-        # a directed edge between two graph nodes implies that landing on one face will lead to toppling onto its successor
-        # an outdegree of 0 for any graph node implies it is a sink (the object will come to rest if it topples to this face)
-        for tri in cvh_tris:
-            # vertices
-            tri_verts = [cvh_verts[i] for i in tri]
-
-            # project the center of mass onto the triangle
-            proj_cm = Mesh3D._proj_point_to_plane(tri_verts, cm)
-
-            # update list of top vertices, add edges between vertices as needed
-            if not Mesh3D._point_in_tri(tri_verts, proj_cm):
-                # form segment objects
-                s1 = Mesh3D._Segment(tri_verts[0], tri_verts[1])
-                s2 = Mesh3D._Segment(tri_verts[0], tri_verts[2])
-                s3 = Mesh3D._Segment(tri_verts[1], tri_verts[2])
-
-                # compute the closest edges
-                closest_edges = Mesh3D._closest_segment(proj_cm, [s1, s2, s3])
-
-                # choose the closest edge based on the midpoint of the triangle segments
-                if len(closest_edges) == 1:
-                    closest_edge = closest_edges[0]
-                else:
-                    closest_edge = Mesh3D._closer_segment(proj_cm, closest_edges[0], closest_edges[1])                
-            
-                # compute the topple face from the closest edge
-                for face in edge_to_tri[closest_edge.tup]:
-                    if list(face) != list(tri):
-                        topple_face = face
-                predecessor = nodes[tuple(tri)]
-                successor = nodes[tuple(topple_face)]
-                predecessor.add_edge(successor)
-        
-        # save to class variable
-        self.face_dag_ = Mesh3D._FaceDAG(cvh_mesh, nodes, vertex_to_tri, edge_to_tri)
+        # compute convex hull
+        cvh_mesh = self.convex_hull()
+        tri_verts = cvh_mesh.vertices[cvh_mesh.triangles]
 
-    class _Segment:
-        """Object representation of a finite line segment in 3D space.
+        # prior probability of landing on each face from the solid angle it subtends at the center of mass
+        probabilities = Mesh3D._solid_angles(tri_verts, cm) / (4 * np.pi)
 
-        Attributes
-        ----------
-        p1 : :obj:`numpy.ndarray` of float
-            The first endpoint of the line segment
-        p2 : :obj:`numpy.ndarray` of float
-            The second endpoint of the line segment
-        tup : :obj:`tuple` of :obj:`tuple` of float
-            A tuple representation of the segment, with the two
-            endpoints arranged in lexicographical order.
-        """
+        # project the center of mass onto the plane of each triangle
+        v0 = tri_verts[:,2,:] - tri_verts[:,0,:]
+        v1 = tri_verts[:,1,:] - tri_verts[:,0,:]
+        n = np.cross(v0, v1)
+        n = n / np.linalg.norm(n, axis=1)[:,np.newaxis]
+        dist = np.sum(n * (cm - tri_verts[:,0,:]), axis=1)
+        proj_cm = cm - dist[:,np.newaxis] * n
+
+        # check barycentric containment of the projected center of mass
+        # http://blackpawn.com/texts/pointinpoly/
+        v2 = proj_cm - tri_verts[:,0,:]
+        dot00 = np.sum(v0 * v0, axis=1)
+        dot01 = np.sum(v0 * v1, axis=1)
+        dot02 = np.sum(v0 * v2, axis=1)
+        dot11 = np.sum(v1 * v1, axis=1)
+        dot12 = np.sum(v1 * v2, axis=1)
+        inv_denom = 1.0 / (dot00 * dot11 - dot01 * dot01)
+        u = (dot11 * dot02 - dot01 * dot12) * inv_denom
+        v = (dot00 * dot12 - dot01 * dot02) * inv_denom
+        stable = (u >= 0.0) & (v >= 0.0) & (u + v <= 1.0)
 
-        def __init__(self, p1, p2):
-            """Creates a Segment with given endpoints.
+        # connect nodes in the graph based on geometric toppling criteria
+        # a face that does not contain the projected center of mass topples across its closest edge onto the neighboring face
+        # a successor of -1 implies a sink (the object will come to rest if it topples to this face)
+        successors = -np.ones(tri_verts.shape[0], dtype=np.int64)
+        topple_inds = np.where(~stable)[0]
+        if topple_inds.shape[0] > 0:
+            topple_edges = Mesh3D._closest_tri_edges(tri_verts[topple_inds], proj_cm[topple_inds])
+            successors[topple_inds] = cvh_mesh.topology.tri_neighbors[topple_inds, topple_edges]
 
-            Parameters
-            ----------
-            p1 : :obj:`numpy.ndarray` of float
-                The first endpoint of the line segment
-            p2 : :obj:`numpy.ndarray` of float
-                The second endpoint of the line segment
-            """
-            self.p1 = p1
-            self.p2 = p2
-            self.tup = self._ordered_tuple()
+        # propagate probabilities to the sinks
+        sinks, resting_probs = Mesh3D._compute_prob_map(successors, probabilities)
 
-        def dist_to_point(self, point):
-            """Computes the distance from the segment to the given 3D point.
+        # save to class variable
+        self.face_dag_ = Mesh3D._FaceDAG(cvh_mesh, probabilities, successors, sinks, resting_probs)
+        if cache is not None:
+            cache.put(key, {'vertices': cvh_mesh.vertices, 'triangles': cvh_mesh.triangles,
+                            'probabilities': probabilities, 'successors': successors,
+                            'sinks': sinks, 'resting_probs': resting_probs})
 
-            Parameters
-            ----------
-            point : :obj:`numpy.ndarray` of float
-                The 3D point to measure distance to.
+    class _Topology:
+        """Array-backed connectivity index of a triangle mesh, built once with
+        sorting instead of per-triangle dictionary updates.
 
-            Returns
-            -------
-            float
-                The euclidean distance between the segment and the point.
-            """
-            p1, p2 = self.p1, self.p2
-            ap = point - p1
-            ab = p2 - p1
-            proj_point = p1 + (np.dot(ap, ab) / np.dot(ab, ab)) * ab
-            if self._contains_proj_point(proj_point):
-                return np.linalg.norm(point - proj_point)
-            else:
-                return min(np.linalg.norm(point - p1),
-                        np.linalg.norm(point - p2))
+        Triangle edge k connects corners k and (k+1) % 3, so edges 0, 1 and 2 of
+        a triangle are (0,1), (1,2) and (2,0).
 
-        def _contains_proj_point(self, point):
-            """Is the given 3D point (assumed to be on the line that contains
-            the segment) actually within the segment?
+        Attributes
+        ----------
+        vertex_tri_offsets : :obj:`numpy.ndarray` of int
+            #verts+1 CSR offsets into vertex_tris.
+        vertex_tris : :obj:`numpy.ndarray` of int
+            Indices of the triangles incident to each vertex, in CSR order.
+        edges : :obj:`numpy.ndarray` of int
+            #edges by 2 array of unique undirected edges, sorted so that edges[:,0] < edges[:,1].
+        tri_edges : :obj:`numpy.ndarray` of int
+            #tris by 3 array of indices into edges for each triangle edge.
+        edge_tri_offsets : :obj:`numpy.ndarray` of int
+            #edges+1 CSR offsets into edge_tris.
+        edge_tris : :obj:`numpy.ndarray` of int
+            Indices of the triangles sharing each edge, in CSR order.
+        tri_neighbors : :obj:`numpy.ndarray` of int
+            #tris by 3 array with the triangle across each triangle edge, or -1
+            if the edge is not shared by exactly two triangles.
+        """
+        def __init__(self, triangles, vertex_incidence):
+            """Builds the index.
 
             Parameters
             ----------
-            point : :obj:`numpy.ndarray` of float
-                The 3D point to check against.
-
-            Returns
-            -------
-            bool
-                True if the point was within the segment or False otherwise.
+            triangles : :obj:`numpy.ndarray` of int
+                A #tris by 3 array of vertex indices.
+            vertex_incidence : :obj:`scipy.sparse.csr_matrix`
+                The vertex to triangle corner incidence matrix of the triangles.
             """
-            p1, p2 = self.p1, self.p2
-            return (point[0] >= min(p1[0],p2[0]) and point[0] <= max(p1[0],p2[0]) and
-                    point[1] >= min(p1[1],p2[1]) and point[1] <= max(p1[1],p2[1]) and
-                    point[2] >= min(p1[2],p2[2]) and point[2] <= max(p1[2],p2[2]))
+            triangles = np.asarray(triangles).reshape(-1, 3).astype(np.int64)
+            num_tris = triangles.shape[0]
+            num_vertices = vertex_incidence.shape[0]
+
+            # vertex to triangle map, read off the incidence matrix rows
+            self.vertex_tri_offsets = vertex_incidence.indptr.astype(np.int64)
+            self.vertex_tris = vertex_incidence.indices // 3
+
+            # unique undirected edges, keyed by a single integer for a fast sort
+            edge_verts = np.c_[triangles.reshape(-1), np.roll(triangles, -1, axis=1).reshape(-1)]
+            edge_verts = np.sort(edge_verts, axis=1)
+            edge_keys = edge_verts[:,0] * num_vertices + edge_verts[:,1]
+            self.edge_keys_, first_inds, edge_inds = np.unique(edge_keys, return_index=True,
+                                                               return_inverse=True)
+            self.edges = edge_verts[first_inds]
+            self.tri_edges = edge_inds.reshape(-1, 3)
+
+            # edge to triangle map
+            num_edges = self.edges.shape[0]
+            self.edge_tris = np.argsort(edge_inds, kind='mergesort') // 3
+            self.edge_tri_offsets = np.r_[0, np.cumsum(np.bincount(edge_inds, minlength=num_edges))].astype(np.int64)
+
+            # triangle adjacency across manifold edges
+            edge_counts = self.edge_counts
+            first_tris = self.edge_tris[self.edge_tri_offsets[:-1]]
+            second_tris = self.edge_tris[np.minimum(self.edge_tri_offsets[:-1] + 1, self.edge_tris.shape[0] - 1)]
+            tri_inds = np.repeat(np.arange(num_tris), 3).reshape(-1, 3)
+            first_tris = first_tris[self.tri_edges]
+            second_tris = second_tris[self.tri_edges]
+            neighbors = np.where(first_tris == tri_inds, second_tris, first_tris)
+            self.tri_neighbors = np.where(edge_counts[self.tri_edges] == 2, neighbors, -1)
 
-        def _ordered_tuple(self):
-            """Returns an ordered tuple that represents the segment.
+        @property
+        def num_edges(self):
+            return self.edges.shape[0]
 
-            The points within are ordered lexicographically.
+        @property
+        def edge_counts(self):
+            """:obj:`numpy.ndarray` of int : The number of triangles sharing each edge. """
+            return np.diff(self.edge_tri_offsets)
 
-            Returns
-            -------
+        @property
+        def boundary_edges(self):
+            """:obj:`numpy.ndarray` of int : The edges that belong to a single triangle. """
+            return self.edges[self.edge_counts == 1]
 
-            tup : :obj:`tuple` of :obj:`tuple` of float
-                A tuple representation of the segment, with the two
-                endpoints arranged in lexicographical order.
-            """
-            if (self.p1.tolist() > self.p2.tolist()):
-                return (tuple(self.p1), tuple(self.p2))
-            else:
-                return (tuple(self.p2), tuple(self.p1))
+        @property
+        def is_closed(self):
+            """bool : Whether every edge is shared by exactly two triangles. """
+            return self.num_edges > 0 and bool(np.all(self.edge_counts == 2))
+
+        def vertex_triangles(self, vertex_ind):
+            """Returns the indices of the triangles incident to a vertex. """
+            return self.vertex_tris[self.vertex_tri_offsets[vertex_ind]:self.vertex_tri_offsets[vertex_ind+1]]
+
+        def edge_triangles(self, edge_ind):
+            """Returns the indices of the triangles that share an edge. """
+            return self.edge_tris[self.edge_tri_offsets[edge_ind]:self.edge_tri_offsets[edge_ind+1]]
+
+        def edge_index(self, v1, v2):
+            """Returns the index of the edge between two vertices, or -1 if there is none. """
+            num_vertices = self.vertex_tri_offsets.shape[0] - 1
+            key = min(v1, v2) * num_vertices + max(v1, v2)
+            ind = np.searchsorted(self.edge_keys_, key)
+            if ind < self.edge_keys_.shape[0] and self.edge_keys_[ind] == key:
+                return ind
+            return -1
 
     class _FaceDAG:
         """ A directed acyclic graph specifying the topppling dependency structure
@@ -1673,58 +1797,44 @@ class Mesh3D(object):
         Attributes
         ----------
         mesh : :obj:`Mesh3D`
-            the 3D triangular mesh that the DAG refers to (usually the convex hull) 
-        nodes : :obj:`dict` mapping 3-`tuple` of integers (triangles) to :obj:`Mesh3D._GraphVertex`
-            the nodes in the DAG
-        vertex_to_tri : :obj:`dict` mapping :obj:`int` (vertex indices) to 3-`tuple` of integers (triangles)
-        edge_to_tri : :obj:`dict` mapping 2-`tuple` of integers (edges) to 3-`tuple` of integers (triangles)
-        """
-        def __init__(self, mesh, nodes, vertex_to_tri, edge_to_tri):
+            the 3D triangular mesh that the DAG refers to (usually the convex hull)
+        probabilities : :obj:`numpy.ndarray` of float
+            prior probability of landing on each triangle of the mesh
+        successors : :obj:`numpy.ndarray` of int
+            index of the triangle that each triangle topples onto, or -1 for sinks
+        sinks : :obj:`numpy.ndarray` of int
+            index of the sink that each triangle eventually topples onto, or -1 if it topples into a loop
+        resting_probs : :obj:`numpy.ndarray` of float
+            probability of coming to rest on each triangle, which is zero for non-sinks
+        """
+        def __init__(self, mesh, probabilities, successors, sinks, resting_probs):
             self.mesh = mesh
-            self.nodes = nodes
-            self.vertex_to_tri = vertex_to_tri
-            self.edge_to_tri = edge_to_tri
+            self.probabilities = probabilities
+            self.successors = successors
+            self.sinks = sinks
+            self.resting_probs = resting_probs
 
-    class _GraphVertex:
-        """A directed graph vertex that links a probability to a face.
-        """
-
-        def __init__(self, probability, face):
-            """Create a graph vertex with given probability and face.
-
-            Parameters
-            ----------
-            probability : float
-                Probability associated with this vertex.
-            face : :obj:`numpy.ndarray` of int
-                A 3x3 array that represents the face
-                associated with this vertex. Each row is a list
-                of vertices in one face.
-            """
-            self.probability = probability
-            self.children = []
-            self.parents = []
-            self.face = face
-            self.has_parent = False
-            self.num_parents = 0
-            self.sink = None
-
-        @property
-        def is_sink(self):
-            return len(self.children) == 0
+    @staticmethod
+    def _compute_vertex_incidence(triangles, num_vertices):
+        """Computes the sparse incidence matrix between vertices and triangle corners.
 
-        def add_edge(self, child):
-            """Connects this vertex to the input child vertex.
+        Parameters
+        ----------
+        triangles : :obj:`numpy.ndarray` of int
+            A #tris by 3 array of vertex indices.
+        num_vertices : int
+            The number of vertices referenced by the triangles.
 
-            Parameters
-            ----------
-            child : :obj:`_GraphVertex`
-                The child to link to.
-            """
-            self.children.append(child)
-            child.parents.append(self)
-            child.has_parent = True
-            child.num_parents += 1
+        Returns
+        -------
+        :obj:`scipy.sparse.csr_matrix` of int
+            A #verts by 3*#tris matrix with a 1 at the vertex of each triangle corner.
+        """
+        corner_vertices = np.asarray(triangles).reshape(-1).astype(np.int64)
+        num_corners = corner_vertices.shape[0]
+        return sparse.csr_matrix((np.ones(num_corners, dtype=np.int32),
+                                  (corner_vertices, np.arange(num_corners))),
+                                 shape=(num_vertices, num_corners))
 
     @staticmethod
     def _max_edge_length(tri, vertices):
@@ -1818,132 +1928,148 @@ class Mesh3D(object):
         return (u >= 0.0 and v >= 0.0 and u + v <= 1.0)
 
     @staticmethod
-    def _closest_segment(point, line_segments):
-        """Returns the finite line segment(s) the least distance from the input point.
+    def _solid_angles(tri_verts, point):
+        """Computes the solid angles subtended by triangles at a point, which
+        are the areas of the triangles projected onto the unit sphere around it.
 
         Parameters
         ----------
+        tri_verts : :obj:`numpy.ndarray` of float
+            A #tris by 3 by 3 array of triangle vertices.
         point : :obj:`numpy.ndarray` of float
-            The 3D point to measure distance to.
-        line_segments: :obj:`list` of :obj:`_Segments`
-            The list of line segments.
+            The 3D point to project the triangles from.
 
         Returns
         -------
-        :obj:`list` of :obj:`_Segments`
-            The list of line segments that were closest to the input point.
+        :obj:`numpy.ndarray` of float
+            The solid angle of each triangle.
         """
-        min_dist = sys.maxint
-        min_segs = []
-        distances = []
-        segments = []
-        common_endpoint = None
-
-        for segment in line_segments:
-            dist = segment.dist_to_point(point)
-            distances.append(dist)
-            segments.append(segment)
-            if dist < min_dist:
-                min_dist = dist
-
-        for i in range(len(distances)):
-            if min_dist + 0.000001 >= distances[i]:
-                min_segs.append(segments[i])
-
-        return min_segs
+        # Van Oosterom and Strackee's formula for the solid angle of a triangle
+        proj_verts = tri_verts - point
+        proj_verts = proj_verts / np.linalg.norm(proj_verts, axis=2)[:,:,np.newaxis]
+        p0, p1, p2 = proj_verts[:,0,:], proj_verts[:,1,:], proj_verts[:,2,:]
+        triple_prod = np.abs(np.sum(p0 * np.cross(p1, p2), axis=1))
+        denom = 1 + np.sum(p0 * p1, axis=1) + np.sum(p0 * p2, axis=1) + np.sum(p1 * p2, axis=1)
+        return 2 * np.arctan2(triple_prod, denom)
 
     @staticmethod
-    def _closer_segment(point, s1, s2):
-        """ Compute which segment is closer to a given point by seeing
-        which side of the midline between the two segments the point falls on.
+    def _closest_tri_edges(tri_verts, points):
+        """Returns the edge of each triangle that is closest to a coplanar point.
+        Edge k of a triangle connects corners k and (k+1) % 3.
+
+        Ties between two edges are broken by checking which side of the midline
+        between the two edges the point falls on.
 
         Parameters
         ----------
-        point : :obj:`numpy.ndarray`
-            3d array containing point projected onto plane spanned by s1, s1
-        s1 : :obj:`Mesh3D._Segment`
-            first segment to check
-        s2 : :obj:`Mesh3D._Segment`
-            second segment to check
+        tri_verts : :obj:`numpy.ndarray` of float
+            A #tris by 3 by 3 array of triangle vertices.
+        points : :obj:`numpy.ndarray` of float
+            A #tris by 3 array of points, each coplanar with its triangle.
 
         Returns
         -------
-        :obj:`Mesh3D._Segment`
-            best segment to check        
-        """
-        # find the shared vertex and compute the midline between the segments
-        if np.allclose(s1.p1, s2.p1):
-            p = s1.p1
-            l1 = s1.p2 - p
-            l2 = s2.p2 - p
-        elif np.allclose(s1.p2, s2.p1):
-            p = s1.p2
-            l1 = s1.p1 - p
-            l2 = s2.p2 - p
-        elif np.allclose(s1.p1, s2.p2):
-            p = s1.p1
-            l1 = s1.p2 - p
-            l2 = s2.p1 - p
-        else:
-            p = s1.p2
-            l1 = s1.p1 - p
-            l2 = s2.p1 - p
-        v = point - p
+        :obj:`numpy.ndarray` of int
+            The index in [0,2] of the closest edge of each triangle.
+
+        Raises
+        ------
+        ValueError
+            If a tie cannot be broken because a triangle is degenerate.
+        """
+        # distance to each segment, clamped to its endpoints
+        p1 = tri_verts
+        p2 = np.roll(tri_verts, -1, axis=1)
+        ab = p2 - p1
+        ap = points[:,np.newaxis,:] - p1
+        alpha = np.sum(ap * ab, axis=2) / np.sum(ab * ab, axis=2)
+        proj_points = p1 + alpha[:,:,np.newaxis] * ab
+        on_segment = np.all((proj_points >= np.minimum(p1, p2)) & (proj_points <= np.maximum(p1, p2)), axis=2)
+        endpoint_dists = np.minimum(np.linalg.norm(ap, axis=2),
+                                    np.linalg.norm(points[:,np.newaxis,:] - p2, axis=2))
+        dists = np.where(on_segment,
+                         np.linalg.norm(points[:,np.newaxis,:] - proj_points, axis=2),
+                         endpoint_dists)
+
+        # find the closest edges up to numeric tolerance
+        closest = dists <= np.min(dists, axis=1)[:,np.newaxis] + 0.000001
+        closest_edges = np.argmax(closest, axis=1)
+        tie_inds = np.where(np.sum(closest, axis=1) > 1)[0]
+        if tie_inds.shape[0] == 0:
+            return closest_edges
+
+        # find the shared vertex and compute the midline between the first two tied edges
+        k1 = closest_edges[tie_inds]
+        remaining = closest[tie_inds].copy()
+        remaining[np.arange(tie_inds.shape[0]), k1] = False
+        k2 = np.argmax(remaining, axis=1)
+        corner_table = np.array([[1, 0, 2],   # edges 0 and 1 share corner 1
+                                 [0, 1, 2],   # edges 0 and 2 share corner 0
+                                 [2, 1, 0]])  # edges 1 and 2 share corner 2
+        corners = corner_table[k1 + k2 - 1]
+        tie_verts = tri_verts[tie_inds]
+        rows = np.arange(tie_inds.shape[0])
+        p = tie_verts[rows, corners[:,0]]
+        l1 = tie_verts[rows, corners[:,1]] - p
+        l2 = tie_verts[rows, corners[:,2]] - p
+        v = points[tie_inds] - p
         midline = 0.5 * (l1 + l2)
 
         # compute projection onto the midline
-        if np.linalg.norm(midline) == 0:
+        midline_sq_norms = np.sum(midline * midline, axis=1)
+        if np.any(midline_sq_norms == 0):
             raise ValueError('Illegal triangle')
-        alpha = midline.dot(v) / midline.dot(midline)
-        w = alpha * midline
-
-        # compute residual (component of query point orthogonal to midline)
-        x = v - w
+        alpha = np.sum(midline * v, axis=1) / midline_sq_norms
+        x = v - alpha[:,np.newaxis] * midline
 
-        # figure out which line is on the same side of the midline
-        # as the residual
-        d1 = x.dot(l1)
-        d2 = x.dot(l2)
-        closer_segment = s2
-        if d1 > d2:
-            closer_segment = s1
-        return closer_segment
+        # pick the edge on the same side of the midline as the residual
+        d1 = np.sum(x * l1, axis=1)
+        d2 = np.sum(x * l2, axis=1)
+        closest_edges[tie_inds] = np.where(d1 > d2, k1, k2)
+        return closest_edges
 
     @staticmethod
-    def _compute_prob_map(vertices, cvh_verts, cm):
-        """Creates a map from faces to static stability probabilities.
+    def _compute_prob_map(successors, probabilities):
+        """Computes the sink that each face topples to and the resulting
+        static stability probability of each face.
+
+        Sinks are resolved for all faces at once by pointer jumping: every
+        pass replaces each face's pointer with its pointer's pointer, doubling
+        the distance followed, so paths are shared between all faces on them.
 
         Parameters
         ----------
-        vertices : :obj:`list` of :obj:`_GraphVertex`
+        successors : :obj:`numpy.ndarray` of int
+            index of the face that each face topples onto, or -1 for sinks
+        probabilities : :obj:`numpy.ndarray` of float
+            prior probability of landing on each face
 
         Returns
         -------
-        :obj:`dictionary` of :obj:`tuple` of int to float
-            Maps tuple representations of faces to probabilities.
-        """
-        # follow the child nodes of each vertex until a sink, then add in the resting probability
-        prob_mapping = {}
-        for vertex in vertices:
-            c = vertex
-            visited = []
-            while not c.is_sink:
-                if c in visited:
-                    break
-                visited.append(c)
-                c = c.children[0]
-
-            if tuple(c.face) not in prob_mapping.keys():
-                prob_mapping[tuple(c.face)] = 0.0
-            prob_mapping[tuple(c.face)] += vertex.probability
-            vertex.sink = c
-
-        # set resting probabilities of faces to zero
-        for vertex in vertices:
-            if not vertex.is_sink:
-                prob_mapping[tuple(vertex.face)] = 0
-
-        return prob_mapping
+        :obj:`numpy.ndarray` of int
+            The index of the sink each face topples to, or -1 if it topples into a loop.
+        :obj:`numpy.ndarray` of float
+            The probability of resting on each face, which is zero for non-sinks.
+        """
+        num_faces = successors.shape[0]
+        is_sink = successors < 0
+
+        # sinks point to themselves, so pointers stop moving once they reach one
+        pointers = np.where(is_sink, np.arange(num_faces), successors)
+        for _ in range(int(np.ceil(np.log2(max(num_faces, 2))))):
+            next_pointers = pointers[pointers]
+            if np.array_equal(next_pointers, pointers):
+                break
+            pointers = next_pointers
+
+        # faces whose pointer did not settle on a sink are caught in a loop
+        sinks = np.where(is_sink[pointers], pointers, -1)
+
+        # add the prior probability of each face to the resting probability of its sink
+        reaches_sink = sinks >= 0
+        resting_probs = np.bincount(sinks[reaches_sink], weights=probabilities[reaches_sink],
+                                    minlength=num_faces)
+        return sinks, resting_probs
 
 if __name__ == '__main__':
     pass
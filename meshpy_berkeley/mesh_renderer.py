@@ -9,17 +9,182 @@ import numpy as np
 import os
 import sys
 import time
+import weakref
 
 try:
     import meshrender
 except:
     pass
 
-from autolab_core import Point, RigidTransform
+from autolab_core import RigidTransform
 from autolab_core.utils import sph2cart, cart2sph
 from perception import CameraIntrinsics, BinaryImage, ColorImage, DepthImage, RgbdImage, ObjectRender
 from meshpy_berkeley import MaterialProperties, LightingProperties, RenderMode
 
+class RigidTransformArray(object):
+    """A sequence of rigid transformations stored as stacked rotation and
+    translation arrays. RigidTransform objects are only created when the
+    sequence is indexed or iterated, so large sets of poses can be generated
+    and passed to the renderer without creating an object per pose.
+
+    Attributes
+    ----------
+    rotations : :obj:`numpy.ndarray` of float
+        Nx3x3 array of rotation matrices.
+    translations : :obj:`numpy.ndarray` of float
+        Nx3 array of translation vectors.
+    from_frame : :obj:`str`
+        The frame of reference that the transformations operate on.
+    to_frame : :obj:`str`
+        The frame of reference that the transformations move points to.
+    """
+    def __init__(self, rotations, translations, from_frame='unassigned', to_frame='world'):
+        self.rotations = rotations
+        self.translations = translations
+        self.from_frame = from_frame
+        self.to_frame = to_frame
+
+    def __len__(self):
+        return self.rotations.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return RigidTransformArray(self.rotations[key], self.translations[key],
+                                       from_frame=self.from_frame, to_frame=self.to_frame)
+        return RigidTransform(self.rotations[key], self.translations[key],
+                              from_frame=self.from_frame, to_frame=self.to_frame)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+class CameraIntrinsicsArray(object):
+    """A sequence of camera intrinsics that differ only in their focal lengths
+    and optical centers, stored as arrays. CameraIntrinsics objects are only
+    created when the sequence is indexed or iterated.
+
+    Attributes
+    ----------
+    camera_intr : :obj:`CameraIntrinsics`
+        The intrinsics that the sequence shares except for the focal lengths and optical centers.
+    cx : :obj:`numpy.ndarray` of float
+        The x-axis optical center of each camera.
+    cy : :obj:`numpy.ndarray` of float
+        The y-axis optical center of each camera.
+    fx : :obj:`numpy.ndarray` of float
+        The x-axis focal length of each camera.
+    fy : :obj:`numpy.ndarray` of float
+        The y-axis focal length of each camera.
+    """
+    def __init__(self, camera_intr, cx, cy, fx=None, fy=None):
+        if fx is None:
+            fx = camera_intr.fx * np.ones(cx.shape[0])
+        if fy is None:
+            fy = camera_intr.fy * np.ones(cx.shape[0])
+        self.camera_intr = camera_intr
+        self.cx = cx
+        self.cy = cy
+        self.fx = fx
+        self.fy = fy
+
+    @property
+    def proj_matrices(self):
+        """:obj:`numpy.ndarray` of float : The Nx3x3 projection matrices of the cameras.
+        """
+        K = np.tile(self.camera_intr.proj_matrix, [len(self), 1, 1])
+        K[:,0,0] = self.fx
+        K[:,1,1] = self.fy
+        K[:,0,2] = self.cx
+        K[:,1,2] = self.cy
+        return K
+
+    def __len__(self):
+        return self.cx.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return CameraIntrinsicsArray(self.camera_intr, self.cx[key], self.cy[key],
+                                         fx=self.fx[key], fy=self.fy[key])
+        camera_intr = self.camera_intr
+        return CameraIntrinsics(camera_intr.frame, float(self.fx[key]), fy=float(self.fy[key]),
+                                cx=float(self.cx[key]), cy=float(self.cy[key]), skew=camera_intr.skew,
+                                height=camera_intr.height, width=camera_intr.width)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+def _inclusive_range(min_val, max_val, num):
+    """ Returns num evenly spaced values from min_val to max_val inclusive,
+    or only min_val if the bounds are equal or num is one. """
+    if max_val < min_val:
+        return np.zeros(0)
+    if max_val == min_val or num == 1:
+        return np.array([min_val], dtype=np.float64)
+    return np.linspace(min_val, max_val, num)
+
+def _exclusive_range(min_val, max_val, num):
+    """ Returns num evenly spaced values from min_val up to but excluding max_val. """
+    if max_val <= min_val:
+        return np.zeros(0)
+    return min_val + (float(max_val) - min_val) * np.arange(num) / num
+
+def _viewsphere_rotations(camera_z_obj, roll):
+    """ Returns the Nx3x3 camera to object rotations of cameras with the given
+    unit optical axes, with the camera y axis pointing down in the object frame
+    and rotated about the optical axis by the given rolls. """
+    num_poses = camera_z_obj.shape[0]
+
+    # find the canonical camera x and y axes
+    camera_x_par_obj = np.c_[camera_z_obj[:,1], -camera_z_obj[:,0], np.zeros(num_poses)]
+    x_norms = np.linalg.norm(camera_x_par_obj, axis=1)
+    degenerate = x_norms == 0
+    camera_x_par_obj[degenerate] = [1, 0, 0]
+    x_norms[degenerate] = 1
+    camera_x_par_obj = camera_x_par_obj / x_norms[:,np.newaxis]
+    camera_y_par_obj = np.cross(camera_z_obj, camera_x_par_obj)
+    camera_y_par_obj = camera_y_par_obj / np.linalg.norm(camera_y_par_obj, axis=1)[:,np.newaxis]
+    flip = camera_y_par_obj[:,2] > 0
+    camera_x_par_obj[flip] = -camera_x_par_obj[flip]
+    camera_y_par_obj[flip] = -camera_y_par_obj[flip]
+
+    # rotate by the roll
+    cos_roll = np.cos(roll)[:,np.newaxis]
+    sin_roll = np.sin(roll)[:,np.newaxis]
+    R_obj_camera = np.zeros([num_poses, 3, 3])
+    R_obj_camera[:,:,0] = cos_roll * camera_x_par_obj + sin_roll * camera_y_par_obj
+    R_obj_camera[:,:,1] = -sin_roll * camera_x_par_obj + cos_roll * camera_y_par_obj
+    R_obj_camera[:,:,2] = camera_z_obj
+    return R_obj_camera
+
+def _viewsphere_poses(radius, elev, az, roll, x=0, y=0):
+    """ Returns the Nx3x3 rotations and Nx3 translations of the object to camera
+    poses of cameras on a viewsphere with the given spherical coordinates,
+    looking at the center of the viewsphere translated by x and y. """
+    camera_center_obj = np.c_[sph2cart(radius, az, elev)]
+    camera_z_obj = -camera_center_obj / np.linalg.norm(camera_center_obj, axis=1)[:,np.newaxis]
+    R_obj_camera = _viewsphere_rotations(camera_z_obj, roll)
+    camera_center_obj = camera_center_obj + np.c_[x * np.ones(camera_center_obj.shape[0]),
+                                                  y * np.ones(camera_center_obj.shape[0]),
+                                                  np.zeros(camera_center_obj.shape[0])]
+
+    # invert the camera to object poses
+    R_camera_obj = R_obj_camera.transpose(0, 2, 1)
+    t_camera_obj = -np.einsum('nij,nj->ni', R_camera_obj, camera_center_obj)
+    return R_camera_obj, t_camera_obj
+
+def _shifted_optical_centers(proj_matrices, translations):
+    """ Returns the optical centers that project the object origin at the given
+    translations in the camera frame to the optical center of a camera with the
+    given 3x3 (or Nx3x3) projection matrices, simulating cropping around the object.
+    Projections are rounded to pixels as in CameraIntrinsics.project. """
+    proj_matrices = np.broadcast_to(proj_matrices, (translations.shape[0], 3, 3))
+    u_center_obj = np.einsum('nij,nj->ni', proj_matrices, translations)
+    u_center_obj = np.round(u_center_obj[:,:2] / u_center_obj[:,2:]).astype(np.int16)
+    cx = 2 * proj_matrices[:,0,2] - u_center_obj[:,0].astype(np.float64)
+    cy = 2 * proj_matrices[:,1,2] - u_center_obj[:,1].astype(np.float64)
+    return cx, cy
+
 class ViewsphereDiscretizer(object):
     """Set of parameters for automatically rendering a set of images from virtual
     cameras placed around a viewing sphere.
@@ -106,73 +271,22 @@ class ViewsphereDiscretizer(object):
 
     def object_to_camera_poses(self):
         """Turn the params into a set of object to camera transformations.
+        The poses of the full grid of radii, elevations, azimuths and rolls are computed at once.
 
         Returns
         -------
-        :obj:`list` of :obj:`RigidTransform`
-            A list of rigid transformations that transform from object space
+        :obj:`RigidTransformArray`
+            A sequence of rigid transformations that transform from object space
             to camera space.
         """
-        # compute increments in radial coordinates
-        if self.max_radius == self.min_radius:
-            radius_inc = 1
-        elif self.num_radii == 1:
-            radius_inc = self.max_radius - self.min_radius + 1
-        else:
-            radius_inc = (self.max_radius - self.min_radius) / (self.num_radii - 1)
-        az_inc = (self.max_az - self.min_az) / self.num_az
-        if self.max_elev == self.min_elev:
-            elev_inc = 1
-        elif self.num_elev == 1:
-            elev_inc = self.max_elev - self.min_elev + 1
-        else:
-            elev_inc = (self.max_elev - self.min_elev) / (self.num_elev - 1)
-        roll_inc = (self.max_roll - self.min_roll) / self.num_roll
-
-        # create a pose for each set of spherical coords
-        object_to_camera_poses = []
-        radius = self.min_radius
-        while radius <= self.max_radius:
-            elev = self.min_elev
-            while elev <= self.max_elev:
-                az = self.min_az
-                while az < self.max_az: #not inclusive due to topology (simplifies things)
-                    roll = self.min_roll
-                    while roll < self.max_roll:
-
-                        # generate camera center from spherical coords
-                        camera_center_obj = np.array([sph2cart(radius, az, elev)]).squeeze()
-                        camera_z_obj = -camera_center_obj / np.linalg.norm(camera_center_obj)
-
-                        # find the canonical camera x and y axes
-                        camera_x_par_obj = np.array([camera_z_obj[1], -camera_z_obj[0], 0])
-                        if np.linalg.norm(camera_x_par_obj) == 0:
-                            camera_x_par_obj = np.array([1, 0, 0])
-                        camera_x_par_obj = camera_x_par_obj / np.linalg.norm(camera_x_par_obj)
-                        camera_y_par_obj = np.cross(camera_z_obj, camera_x_par_obj)
-                        camera_y_par_obj = camera_y_par_obj / np.linalg.norm(camera_y_par_obj)
-                        if camera_y_par_obj[2] > 0:
-                            camera_x_par_obj = -camera_x_par_obj
-                            camera_y_par_obj = np.cross(camera_z_obj, camera_x_par_obj)
-                            camera_y_par_obj = camera_y_par_obj / np.linalg.norm(camera_y_par_obj)
-
-                        # rotate by the roll
-                        R_obj_camera_par = np.c_[camera_x_par_obj, camera_y_par_obj, camera_z_obj]
-                        R_camera_par_camera = np.array([[np.cos(roll), -np.sin(roll), 0],
-                                                        [np.sin(roll), np.cos(roll), 0],
-                                                        [0, 0, 1]])
-                        R_obj_camera = R_obj_camera_par.dot(R_camera_par_camera)
-                        t_obj_camera = camera_center_obj
-
-                        # create final transform
-                        T_obj_camera = RigidTransform(R_obj_camera, t_obj_camera,
-                                                      from_frame='camera', to_frame='obj')
-                        object_to_camera_poses.append(T_obj_camera.inverse())
-                        roll += roll_inc
-                    az += az_inc
-                elev += elev_inc
-            radius += radius_inc
-        return object_to_camera_poses
+        radii = _inclusive_range(self.min_radius, self.max_radius, self.num_radii)
+        elevs = _inclusive_range(self.min_elev, self.max_elev, self.num_elev)
+        azs = _exclusive_range(self.min_az, self.max_az, self.num_az) #not inclusive due to topology (simplifies things)
+        rolls = _exclusive_range(self.min_roll, self.max_roll, self.num_roll)
+        radius, elev, az, roll = [g.ravel() for g in np.meshgrid(radii, elevs, azs, rolls, indexing='ij')]
+
+        R_camera_obj, t_camera_obj = _viewsphere_poses(radius, elev, az, roll)
+        return RigidTransformArray(R_camera_obj, t_camera_obj, from_frame='obj', to_frame='camera')
 
 class PlanarWorksurfaceDiscretizer(object):
     """
@@ -252,124 +366,38 @@ class PlanarWorksurfaceDiscretizer(object):
 
     def object_to_camera_poses(self, camera_intr):
         """Turn the params into a set of object to camera transformations.
+        The poses of the full grid of radii, elevations, azimuths, rolls and
+        translations are computed at once.
 
         Returns
         -------
-        :obj:`list` of :obj:`RigidTransform`
-            A list of rigid transformations that transform from object space
+        :obj:`RigidTransformArray`
+            A sequence of rigid transformations that transform from object space
             to camera space.
-        :obj:`list` of :obj:`RigidTransform`
-            A list of rigid transformations that transform from object space
+        :obj:`RigidTransformArray`
+            A sequence of rigid transformations that transform from object space
             to camera space without the translation in the plane
-        :obj:`list` of :obj:`CameraIntrinsics`
-            A list of camera intrinsics that project the translated object
+        :obj:`CameraIntrinsicsArray`
+            A sequence of camera intrinsics that project the translated object
             into the center pixel of the camera, simulating cropping
         """
-        # compute increments in radial coordinates
-        if self.max_radius == self.min_radius:
-            radius_inc = 1
-        elif self.num_radii == 1:
-            radius_inc = self.max_radius - self.min_radius + 1
-        else:
-            radius_inc = (self.max_radius - self.min_radius) / (self.num_radii - 1)
-        az_inc = (self.max_az - self.min_az) / self.num_az
-        if self.max_elev == self.min_elev:
-            elev_inc = 1
-        elif self.num_elev == 1:
-            elev_inc = self.max_elev - self.min_elev + 1
-        else:
-            elev_inc = (self.max_elev - self.min_elev) / (self.num_elev - 1)
-        roll_inc = (self.max_roll - self.min_roll) / self.num_roll
-
-        if self.max_x == self.min_x:
-            x_inc = 1
-        elif self.num_x == 1:
-            x_inc = self.max_x - self.min_x + 1
-        else:
-            x_inc = (self.max_x - self.min_x) / (self.num_x - 1)
-
-
-        if self.max_y == self.min_y:
-            y_inc = 1
-        elif self.num_y == 1:
-            y_inc = self.max_y - self.min_y + 1
-        else:
-            y_inc = (self.max_y - self.min_y) / (self.num_y - 1)
-
-        # create a pose for each set of spherical coords
-        object_to_camera_poses = []
-        object_to_camera_normalized_poses = []
-        camera_shifted_intrinsics = []
-        radius = self.min_radius
-        while radius <= self.max_radius:
-            elev = self.min_elev
-            while elev <= self.max_elev:
-                az = self.min_az
-                while az < self.max_az: #not inclusive due to topology (simplifies things)
-                    roll = self.min_roll
-                    while roll < self.max_roll:
-                        x = self.min_x
-                        while x <= self.max_x:
-                            y = self.min_y
-                            while y <= self.max_y:
-                                num_poses = len(object_to_camera_poses)
-
-                                # generate camera center from spherical coords
-                                delta_t = np.array([x, y, 0])
-                                camera_center_obj = np.array([sph2cart(radius, az, elev)]).squeeze() + delta_t
-                                camera_z_obj = -np.array([sph2cart(radius, az, elev)]).squeeze()
-                                camera_z_obj = camera_z_obj / np.linalg.norm(camera_z_obj)
-
-                                # find the canonical camera x and y axes
-                                camera_x_par_obj = np.array([camera_z_obj[1], -camera_z_obj[0], 0])
-                                if np.linalg.norm(camera_x_par_obj) == 0:
-                                    camera_x_par_obj = np.array([1, 0, 0])
-                                camera_x_par_obj = camera_x_par_obj / np.linalg.norm(camera_x_par_obj)
-                                camera_y_par_obj = np.cross(camera_z_obj, camera_x_par_obj)
-                                camera_y_par_obj = camera_y_par_obj / np.linalg.norm(camera_y_par_obj)
-                                if camera_y_par_obj[2] > 0:
-                                    print 'Flipping', num_poses
-                                    camera_x_par_obj = -camera_x_par_obj
-                                    camera_y_par_obj = np.cross(camera_z_obj, camera_x_par_obj)
-                                    camera_y_par_obj = camera_y_par_obj / np.linalg.norm(camera_y_par_obj)
-
-                                # rotate by the roll
-                                R_obj_camera_par = np.c_[camera_x_par_obj, camera_y_par_obj, camera_z_obj]
-                                R_camera_par_camera = np.array([[np.cos(roll), -np.sin(roll), 0],
-                                                                [np.sin(roll), np.cos(roll), 0],
-                                                                [0, 0, 1]])
-                                R_obj_camera = R_obj_camera_par.dot(R_camera_par_camera)
-                                t_obj_camera = camera_center_obj
-
-                                # create final transform
-                                T_obj_camera = RigidTransform(R_obj_camera, t_obj_camera,
-                                                              from_frame='camera',
-                                                              to_frame='obj')
-                            
-                                object_to_camera_poses.append(T_obj_camera.inverse())
-
-                                # compute pose without the center offset because we can easily add in the object offset later
-                                t_obj_camera_normalized = camera_center_obj - delta_t
-                                T_obj_camera_normalized = RigidTransform(R_obj_camera, t_obj_camera_normalized,
-                                                                         from_frame='camera',
-                                                                         to_frame='obj')
-                                object_to_camera_normalized_poses.append(T_obj_camera_normalized.inverse())
-
-                                # compute new camera center by projecting object 0,0,0 into the camera
-                                center_obj_obj = Point(np.zeros(3), frame='obj')
-                                center_obj_camera = T_obj_camera.inverse() * center_obj_obj
-                                u_center_obj = camera_intr.project(center_obj_camera)
-                                camera_shifted_intr = copy.deepcopy(camera_intr)
-                                camera_shifted_intr.cx = 2 * camera_intr.cx - float(u_center_obj.x)
-                                camera_shifted_intr.cy = 2 * camera_intr.cy - float(u_center_obj.y)
-                                camera_shifted_intrinsics.append(camera_shifted_intr)
-
-                                y += y_inc
-                            x += x_inc
-                        roll += roll_inc
-                    az += az_inc
-                elev += elev_inc
-            radius += radius_inc
+        radii = _inclusive_range(self.min_radius, self.max_radius, self.num_radii)
+        elevs = _inclusive_range(self.min_elev, self.max_elev, self.num_elev)
+        azs = _exclusive_range(self.min_az, self.max_az, self.num_az) #not inclusive due to topology (simplifies things)
+        rolls = _exclusive_range(self.min_roll, self.max_roll, self.num_roll)
+        xs = _inclusive_range(self.min_x, self.max_x, self.num_x)
+        ys = _inclusive_range(self.min_y, self.max_y, self.num_y)
+        radius, elev, az, roll, x, y = [g.ravel() for g in np.meshgrid(radii, elevs, azs, rolls, xs, ys, indexing='ij')]
+
+        # compute poses with and without the translation in the plane, which is easily added in later
+        R_camera_obj, t_camera_obj = _viewsphere_poses(radius, elev, az, roll, x, y)
+        t_camera_obj_normalized = t_camera_obj + np.einsum('nij,nj->ni', R_camera_obj, np.c_[x, y, np.zeros(x.shape[0])])
+        object_to_camera_poses = RigidTransformArray(R_camera_obj, t_camera_obj, from_frame='obj', to_frame='camera')
+        object_to_camera_normalized_poses = RigidTransformArray(R_camera_obj, t_camera_obj_normalized, from_frame='obj', to_frame='camera')
+
+        # compute new camera centers by projecting the object origin into the camera
+        cx, cy = _shifted_optical_centers(camera_intr.proj_matrix, t_camera_obj)
+        camera_shifted_intrinsics = CameraIntrinsicsArray(camera_intr, cx, cy)
         return object_to_camera_poses, object_to_camera_normalized_poses, camera_shifted_intrinsics
 
 class SceneObject(object):
@@ -384,14 +412,22 @@ class VirtualCamera(object):
     """A virtualized camera for rendering virtual color and depth images of meshes.
 
     Rendering is performed by using OSMesa offscreen rendering and boost_numpy.
+    The OSMesa context and framebuffers are created on the first render and
+    reused by later renders until the camera is closed. The geometry of each
+    rendered mesh is uploaded once and reused until the mesh changes.
     """
-    def __init__(self, camera_intr):
+    def __init__(self, camera_intr, num_output_buffers=0):
         """Initialize a virtual camera.
 
         Parameters
         ----------
         camera_intr : :obj:`CameraIntrinsics`
             The CameraIntrinsics object used to parametrize the virtual camera.
+        num_output_buffers : int
+            The number of output arrays of each image type to reuse in turn across
+            renders. Images returned by a render are overwritten by the render
+            this many calls later, so this should only be used when images
+            are consumed before then. If zero, new arrays are allocated for every render.
 
         Raises
         ------
@@ -402,6 +438,76 @@ class VirtualCamera(object):
             raise ValueError('Must provide camera intrinsics as a CameraIntrinsics object')
         self._camera_intr = camera_intr
         self._scene = {} 
+        self._renderer = None
+        self._mesh_handles = {}
+        self._num_output_buffers = num_output_buffers
+        self._output_buffers = {}
+        self._output_buffer_ind = 0
+
+    def close(self):
+        """ Release the rendering context, framebuffers and uploaded meshes.
+        The camera can still be used afterwards, in which case a new context is created.
+        """
+        if self._renderer is not None:
+            self._renderer.close()
+            self._renderer = None
+        self._mesh_handles = {}
+
+    def mesh_handle(self, mesh):
+        """ Returns the handle of the mesh geometry in the renderer, uploading
+        the geometry if it has not been uploaded yet or has changed since.
+        Geometry of meshes that no longer exist is released.
+
+        Parameters
+        ----------
+        mesh : :obj:`Mesh3D`
+            The mesh to be rendered.
+
+        Returns
+        -------
+        int
+            The handle of the uploaded geometry.
+        """
+        renderer = self.renderer
+        if mesh.normals is None:
+            mesh.compute_vertex_normals()
+
+        # reuse the uploaded geometry if the mesh arrays are the same objects
+        entry = self._mesh_handles.get(id(mesh))
+        if entry is not None:
+            mesh_ref, arrays, handle = entry
+            if mesh_ref() is mesh and arrays[0] is mesh.vertices and \
+               arrays[1] is mesh.triangles and arrays[2] is mesh.normals:
+                return handle
+            renderer.release_mesh(handle)
+            del self._mesh_handles[id(mesh)]
+
+        # release geometry of deleted meshes
+        for key, (mesh_ref, arrays, handle) in self._mesh_handles.items():
+            if mesh_ref() is None:
+                renderer.release_mesh(handle)
+                del self._mesh_handles[key]
+
+        # upload contiguous copies of the mesh arrays in the formats used by the renderer
+        handle = renderer.upload_mesh(np.ascontiguousarray(mesh.vertices, dtype=np.float64),
+                                      np.ascontiguousarray(mesh.triangles, dtype=np.int32),
+                                      np.ascontiguousarray(mesh.normals, dtype=np.float64))
+        self._mesh_handles[id(mesh)] = (weakref.ref(mesh), (mesh.vertices, mesh.triangles, mesh.normals), handle)
+        return handle
+
+    @property
+    def renderer(self):
+        """:obj:`meshrender.Renderer` : The persistent renderer for the current
+        image size, created on first use.
+        """
+        if self._renderer is not None and (self._renderer.closed or \
+           self._renderer.height != self._camera_intr.height or \
+           self._renderer.width != self._camera_intr.width):
+            self.close()
+        if self._renderer is None:
+            self._renderer = meshrender.Renderer(self._camera_intr.height,
+                                                 self._camera_intr.width)
+        return self._renderer
 
     def add_to_scene(self, name, scene_object):
         """ Add an object to the scene.
@@ -447,19 +553,55 @@ class VirtualCamera(object):
         Returns
         -------
         :obj:`tuple` of `numpy.ndarray`
-            A 2-tuple of ndarrays. The first, which represents the color image,
-            contains ints (0 to 255) and is of shape (height, width, 3). 
+            A 2-tuple of ndarrays. The first, which represents the color images,
+            contains ints (0 to 255) and is of shape (num_poses, height, width, 3).
             Each pixel is a 3-ndarray (red, green, blue) associated with a given
-            y and x value. The second, which represents the depth image,
-            contains floats and is of shape (height, width). Each pixel is a
+            y and x value. The second, which represents the depth images,
+            contains floats and is of shape (num_poses, height, width). Each pixel is a
             single float that represents the depth of the image.
         """
-        # get mesh spec as numpy arrays
-        vertex_arr = mesh.vertices
-        tri_arr = mesh.triangles.astype(np.int32)
-        if mesh.normals is None:
-            mesh.compute_vertex_normals()
-        norms_arr = mesh.normals
+        color_ims, depth_ims, _ = self._render_images(mesh, object_to_camera_poses,
+                                                      meshrender.RENDER_COLOR | meshrender.RENDER_DEPTH,
+                                                      mat_props=mat_props, light_props=light_props,
+                                                      enable_lighting=enable_lighting, debug=debug)
+        return color_ims, depth_ims
+
+    def _render_images(self, mesh, object_to_camera_poses, render_flags,
+                       mat_props=None, light_props=None, enable_lighting=True, debug=False,
+                       camera_intrinsics=None):
+        """Render the images selected by a combination of the meshrender
+        RENDER_COLOR, RENDER_DEPTH and RENDER_MASK flags for all poses in one call.
+        Images that are not selected are not read back from the framebuffer.
+
+        Parameters
+        ----------
+        mesh : :obj:`Mesh3D`
+            The mesh to be rendered.
+        object_to_camera_poses : :obj:`list` of :obj:`RigidTransform`
+            A list of object to camera transforms to render from.
+        render_flags : int
+            The images to render.
+        mat_props : :obj:`MaterialProperties`
+            Material properties for the mesh
+        light_props : :obj:`MaterialProperties`
+            Lighting properties for the scene
+        enable_lighting : bool
+            Whether or not to enable lighting
+        debug : bool
+            Whether or not to debug the C++ meshrendering code.
+        camera_intrinsics : :obj:`list` of :obj:`CameraIntrinsics`
+            The intrinsics to render each pose with, which must have the image
+            size of the camera. If None, the camera intrinsics are used for all poses.
+
+        Returns
+        -------
+        :obj:`tuple` of `numpy.ndarray`
+            The color images of shape (num_poses, height, width, 3), the depth
+            images of shape (num_poses, height, width) and the uint8 masks of shape
+            (num_poses, height, width), each None if not selected.
+        """
+        # get the uploaded mesh geometry
+        mesh_handle = self.mesh_handle(mesh)
 
         # set default material properties
         if mat_props is None:
@@ -470,38 +612,143 @@ class VirtualCamera(object):
         if light_props is None:
             light_props = LightingProperties()
 
-        # render for each object to camera pose
-        # TODO: clean up interface, use modelview matrix!!!!
-        color_ims = []
-        depth_ims = []
+        # form projection matrices and light props for all object to camera poses
+        num_poses = len(object_to_camera_poses)
+        proj_matrices = self._projection_matrices(object_to_camera_poses, camera_intrinsics)
+        light_props_arr = light_props.pose_arrs(object_to_camera_poses)
+
+        # render images for all poses in one call, directly into the output arrays
+        renderer = self.renderer
+        color_out, depth_out, mask_out = self._output_arrays(render_flags, num_poses)
         render_start = time.time()
-        for T_obj_camera in object_to_camera_poses:
-            # form projection matrix
-            R = T_obj_camera.rotation
-            t = T_obj_camera.translation
-            P = self._camera_intr.proj_matrix.dot(np.c_[R, t])
-
-            # form light props
-            light_props.set_pose(T_obj_camera)
-            light_props_arr = light_props.arr
-
-            # render images for each
-            c, d = meshrender.render_mesh([P],
-                                          self._camera_intr.height,
-                                          self._camera_intr.width,
-                                          vertex_arr,
-                                          tri_arr,
-                                          norms_arr,
-                                          mat_props_arr,
-                                          light_props_arr,
-                                          enable_lighting,
-                                          debug)
-            color_ims.extend(c)
-            depth_ims.extend(d)
+        color_ims, depth_ims, mask_ims = renderer.render(mesh_handle,
+                                                         proj_matrices,
+                                                         mat_props_arr,
+                                                         light_props_arr,
+                                                         render_flags,
+                                                         enable_lighting,
+                                                         debug,
+                                                         color_out,
+                                                         depth_out,
+                                                         mask_out)
         render_stop = time.time()
         logging.debug('Rendering took %.3f sec' %(render_stop - render_start))
 
-        return color_ims, depth_ims
+        return color_ims, depth_ims, mask_ims
+
+    def scene_images(self, mesh, object_to_camera_poses,
+                     mat_props=None, light_props=None, enable_lighting=True, debug=False):
+        """Render images of the given mesh together with the objects in the scene
+        at the list of object to camera poses, where the object frame of the mesh
+        is the world frame of the scene. All objects are drawn into the same
+        depth-tested images in a single pass.
+
+        Parameters
+        ----------
+        mesh : :obj:`Mesh3D`
+            The mesh to be rendered.
+        object_to_camera_poses : :obj:`list` of :obj:`RigidTransform`
+            A list of object to camera transforms to render from.
+        mat_props : :obj:`MaterialProperties`
+            Material properties for the mesh
+        light_props : :obj:`MaterialProperties`
+            Lighting properties for the scene
+        enable_lighting : bool
+            Whether or not to enable lighting
+        debug : bool
+            Whether or not to debug the C++ meshrendering code.
+
+        Returns
+        -------
+        :obj:`tuple` of `numpy.ndarray`
+            A 3-tuple of ndarrays. The first two are the color and depth images
+            as returned by images. The third, which represents the visible object
+            at each pixel, contains uint8s and is of shape (num_poses, height, width).
+            Background pixels are 0, pixels of the mesh are 1 and pixels of the
+            scene objects are 2, 3, ... in the order of their names.
+        """
+        scene_objects = [SceneObject(mesh, None, mat_props)] + \
+                        [scene_obj for name, scene_obj in self._scene_objects()]
+        return self._render_scene_images(scene_objects, object_to_camera_poses,
+                                         meshrender.RENDER_COLOR | meshrender.RENDER_DEPTH | meshrender.RENDER_MASK,
+                                         light_props=light_props, enable_lighting=enable_lighting,
+                                         debug=debug)
+
+    def _render_scene_images(self, scene_objects, world_to_camera_poses, render_flags,
+                             light_props=None, enable_lighting=True, debug=False,
+                             camera_intrinsics=None):
+        """Render the images selected by a combination of the meshrender
+        RENDER_COLOR, RENDER_DEPTH and RENDER_MASK flags of a list of scene
+        objects in a single pass for all poses, where the mask holds the
+        index of the visible object plus one.
+
+        Parameters
+        ----------
+        scene_objects : :obj:`list` of :obj:`SceneObject`
+            The objects to render, where a transform of None is the identity.
+        world_to_camera_poses : :obj:`list` of :obj:`RigidTransform`
+            A list of world to camera transforms to render from.
+        render_flags : int
+            The images to render.
+        light_props : :obj:`MaterialProperties`
+            Lighting properties for the scene
+        enable_lighting : bool
+            Whether or not to enable lighting
+        debug : bool
+            Whether or not to debug the C++ meshrendering code.
+        camera_intrinsics : :obj:`list` of :obj:`CameraIntrinsics`
+            The intrinsics to render each pose with, which must have the image
+            size of the camera. If None, the camera intrinsics are used for all poses.
+
+        Returns
+        -------
+        :obj:`tuple` of `numpy.ndarray`
+            The color images of shape (num_poses, height, width, 3), the depth
+            images of shape (num_poses, height, width) and the uint8 object ids of
+            shape (num_poses, height, width), each None if not selected.
+        """
+        # get the uploaded geometry, model matrices and materials of the objects
+        num_objects = len(scene_objects)
+        mesh_handles = np.zeros(num_objects, dtype=np.uint32)
+        model_matrices = np.tile(np.eye(4), [num_objects, 1, 1])
+        mat_props_arr = np.zeros([num_objects, MaterialProperties().arr.shape[0]])
+        for i, scene_obj in enumerate(scene_objects):
+            mesh_handles[i] = self.mesh_handle(scene_obj.mesh)
+            if scene_obj.T_mesh_world is not None:
+                model_matrices[i] = scene_obj.T_mesh_world.matrix
+            mat_props = scene_obj.mat_props
+            if mat_props is None:
+                mat_props = MaterialProperties()
+            mat_props_arr[i] = mat_props.arr
+
+        # set default light properties
+        if light_props is None:
+            light_props = LightingProperties()
+
+        # form projection matrices and light props for all world to camera poses
+        num_poses = len(world_to_camera_poses)
+        proj_matrices = self._projection_matrices(world_to_camera_poses, camera_intrinsics)
+        light_props_arr = light_props.pose_arrs(world_to_camera_poses)
+
+        # render all objects for all poses in one call
+        renderer = self.renderer
+        color_out, depth_out, ids_out = self._output_arrays(render_flags, num_poses)
+        render_start = time.time()
+        color_ims, depth_ims, ids_ims = renderer.render_scene(mesh_handles,
+                                                              model_matrices,
+                                                              mat_props_arr,
+                                                              proj_matrices,
+                                                              light_props_arr,
+                                                              render_flags,
+                                                              enable_lighting,
+                                                              debug,
+                                                              color_out,
+                                                              depth_out,
+                                                              ids_out)
+        render_stop = time.time()
+        logging.debug('Rendering %d objects took %.3f sec' %(num_objects, render_stop - render_start))
+
+        return color_ims, depth_ims, ids_ims
 
     def images_viewsphere(self, mesh, vs_disc, mat_props=None, light_props=None):
         """Render images of the given mesh around a view sphere.
@@ -533,7 +780,7 @@ class VirtualCamera(object):
 
     def wrapped_images(self, mesh, object_to_camera_poses,
                        render_mode, stable_pose=None, mat_props=None,
-                       light_props=None,debug=False):
+                       light_props=None,debug=False, camera_intrinsics=None):
         """Create ObjectRender objects of the given mesh at the list of object to camera poses.
 
         Parameters
@@ -553,6 +800,9 @@ class VirtualCamera(object):
             Lighting properties for the scene
         debug : bool
             Whether or not to debug the C++ meshrendering code.
+        camera_intrinsics : :obj:`list` of :obj:`CameraIntrinsics`
+            The intrinsics to render each pose with, which must have the image
+            size of the camera. If None, the camera intrinsics are used for all poses.
 
         Returns
         -------
@@ -560,18 +810,31 @@ class VirtualCamera(object):
             A list of ObjectRender objects generated from the given parameters.
         """
         # pre-multiply the stable pose
-        world_to_camera_poses = [T_obj_camera.as_frames('obj', 'camera') for T_obj_camera in object_to_camera_poses]
+        input_poses = object_to_camera_poses
+        T_obj_world = None
         if stable_pose is not None:
             t_obj_stp = np.array([0,0,-stable_pose.r.dot(stable_pose.x0)[2]])
             T_obj_stp = RigidTransform(rotation=stable_pose.r,
                                        translation=t_obj_stp,
                                        from_frame='obj',
                                        to_frame='stp')            
-            stp_to_camera_poses = copy.copy(object_to_camera_poses)
-            object_to_camera_poses = []
-            for T_stp_camera in stp_to_camera_poses:
-                T_stp_camera.from_frame = 'stp'
-                object_to_camera_poses.append(T_stp_camera.dot(T_obj_stp))
+            T_obj_world = T_obj_stp
+            if isinstance(object_to_camera_poses, RigidTransformArray):
+                # compose all poses at once so they are still only materialized on iteration
+                stp_to_camera_poses = RigidTransformArray(object_to_camera_poses.rotations,
+                                                          object_to_camera_poses.translations,
+                                                          from_frame='stp',
+                                                          to_frame=object_to_camera_poses.to_frame)
+                object_to_camera_poses = RigidTransformArray(stp_to_camera_poses.rotations.dot(T_obj_stp.rotation),
+                                                             stp_to_camera_poses.rotations.dot(t_obj_stp) + stp_to_camera_poses.translations,
+                                                             from_frame='obj',
+                                                             to_frame=stp_to_camera_poses.to_frame)
+            else:
+                stp_to_camera_poses = list(object_to_camera_poses)
+                object_to_camera_poses = []
+                for T_stp_camera in stp_to_camera_poses:
+                    T_stp_camera.from_frame = 'stp'
+                    object_to_camera_poses.append(T_stp_camera.dot(T_obj_stp))
 
         # set lighting mode
         enable_lighting = True
@@ -579,97 +842,57 @@ class VirtualCamera(object):
            render_mode == RenderMode.DEPTH_SCENE:
             enable_lighting = False
 
-        # render both image types (doesn't really cost any time)
-        color_ims, depth_ims = self.images(mesh, object_to_camera_poses,
-                                           mat_props=mat_props,
-                                           light_props=light_props,
-                                           enable_lighting=enable_lighting,
-                                           debug=debug)
+        # render only the image types needed for the render mode
+        render_flags = self._render_flags(render_mode)
+        if render_mode in [RenderMode.COLOR_SCENE, RenderMode.DEPTH_SCENE, RenderMode.RGBD_SCENE]:
+            # render the mesh in the world frame along with the scene objects in one pass
+            if isinstance(input_poses, RigidTransformArray):
+                world_to_camera_poses = RigidTransformArray(input_poses.rotations, input_poses.translations,
+                                                            from_frame='obj', to_frame='camera')
+            else:
+                world_to_camera_poses = [T_obj_camera.as_frames('obj', 'camera') for T_obj_camera in input_poses]
+            scene_objects = [SceneObject(mesh, T_obj_world, mat_props)] + \
+                            [scene_obj for name, scene_obj in self._scene_objects()]
+            color_ims, depth_ims, mask_ims = self._render_scene_images(scene_objects,
+                                                                       world_to_camera_poses,
+                                                                       render_flags,
+                                                                       light_props=light_props,
+                                                                       enable_lighting=enable_lighting,
+                                                                       debug=debug,
+                                                                       camera_intrinsics=camera_intrinsics)
+        else:
+            color_ims, depth_ims, mask_ims = self._render_images(mesh, object_to_camera_poses,
+                                                                 render_flags,
+                                                                 mat_props=mat_props,
+                                                                 light_props=light_props,
+                                                                 enable_lighting=enable_lighting,
+                                                                 debug=debug,
+                                                                 camera_intrinsics=camera_intrinsics)
 
         # convert to image wrapper classes
         images = []
         if render_mode == RenderMode.SEGMASK:
             # wrap binary images
-            for binary_im in color_ims:
-                images.append(BinaryImage(binary_im[:,:,0], frame=self._camera_intr.frame, threshold=0))
+            for binary_im in mask_ims:
+                images.append(BinaryImage(binary_im, frame=self._camera_intr.frame, threshold=0))
 
-        elif render_mode == RenderMode.COLOR:
+        elif render_mode == RenderMode.COLOR or render_mode == RenderMode.COLOR_SCENE:
             # wrap color images
             for color_im in color_ims:
                 images.append(ColorImage(color_im, frame=self._camera_intr.frame))
 
-        elif render_mode == RenderMode.COLOR_SCENE:
-            # wrap color and depth images
-            for color_im in color_ims:
-                images.append(ColorImage(color_im, frame=self._camera_intr.frame))
-
-            # render images of scene objects
-            color_scene_ims = {}
-            for name, scene_obj in self._scene.iteritems():
-                scene_object_to_camera_poses = []
-                for world_to_camera_pose in world_to_camera_poses:
-                    scene_object_to_camera_poses.append(world_to_camera_pose * scene_obj.T_mesh_world)
-
-                color_scene_ims[name] = self.wrapped_images(scene_obj.mesh, scene_object_to_camera_poses, RenderMode.COLOR, mat_props=scene_obj.mat_props, light_props=light_props, debug=debug)
-
-            # combine with scene images
-            # TODO: re-add farther
-            for i in range(len(images)):
-                for j, name in enumerate(color_scene_ims.keys()):
-                    zero_px = images[i].zero_pixels()
-                    images[i].data[zero_px[:,0], zero_px[:,1], :] = color_scene_ims[name][i].image.data[zero_px[:,0], zero_px[:,1], :]
-
-        elif render_mode == RenderMode.DEPTH:
-            # render depth image
+        elif render_mode == RenderMode.DEPTH or render_mode == RenderMode.DEPTH_SCENE:
+            # wrap depth images
             for depth_im in depth_ims:
                 images.append(DepthImage(depth_im, frame=self._camera_intr.frame))
 
-        elif render_mode == RenderMode.DEPTH_SCENE:
-            # create empty depth images
-            for depth_im in depth_ims:
-                images.append(DepthImage(depth_im, frame=self._camera_intr.frame))
-
-            # render images of scene objects
-            depth_scene_ims = {}
-            for name, scene_obj in self._scene.iteritems():
-                scene_object_to_camera_poses = []
-                for world_to_camera_pose in world_to_camera_poses:
-                    scene_object_to_camera_poses.append(world_to_camera_pose * scene_obj.T_mesh_world)
-                depth_scene_ims[name] = self.wrapped_images(scene_obj.mesh, scene_object_to_camera_poses, RenderMode.DEPTH, mat_props=scene_obj.mat_props, light_props=light_props)
-
-            # combine with scene images
-            for i in range(len(images)):
-                for j, name in enumerate(depth_scene_ims.keys()):
-                    images[i] = images[i].combine_with(depth_scene_ims[name][i].image)
-
-        elif render_mode == RenderMode.RGBD:
+        elif render_mode == RenderMode.RGBD or render_mode == RenderMode.RGBD_SCENE:
             # create RGB-D images
             for color_im, depth_im in zip(color_ims, depth_ims):
                 c = ColorImage(color_im, frame=self._camera_intr.frame)
                 d = DepthImage(depth_im, frame=self._camera_intr.frame)
                 images.append(RgbdImage.from_color_and_depth(c, d))
 
-        elif render_mode == RenderMode.RGBD_SCENE:
-            # create RGB-D images
-            for color_im, depth_im in zip(color_ims, depth_ims):
-                c = ColorImage(color_im, frame=self._camera_intr.frame)
-                d = DepthImage(depth_im, frame=self._camera_intr.frame)
-                images.append(RgbdImage.from_color_and_depth(c, d))
-
-            # render images of scene objects
-            rgbd_scene_ims = {}
-            for name, scene_obj in self._scene.iteritems():
-                scene_object_to_camera_poses = []
-                for world_to_camera_pose in world_to_camera_poses:
-                    scene_object_to_camera_poses.append(world_to_camera_pose * scene_obj.T_mesh_world)
-
-                rgbd_scene_ims[name] = self.wrapped_images(scene_obj.mesh, scene_object_to_camera_poses, RenderMode.RGBD, mat_props=scene_obj.mat_props, light_props=light_props, debug=debug)
-
-           # combine with scene images
-            for i in range(len(images)):
-                for j, name in enumerate(rgbd_scene_ims.keys()):
-                    images[i] = images[i].combine_with(rgbd_scene_ims[name][i].image)
-
         elif render_mode == RenderMode.SCALED_DEPTH:
             # convert to color image
             for depth_im in depth_ims:
@@ -688,6 +911,76 @@ class VirtualCamera(object):
 
         return rendered_images
 
+    def _scene_objects(self):
+        """ Returns the (name, object) pairs of the objects in the scene, ordered by name. """
+        return [(name, self._scene[name]) for name in sorted(self._scene.keys())
+                if self._scene[name] is not None]
+
+    def _projection_matrices(self, object_to_camera_poses, camera_intrinsics=None):
+        """ Returns the num_poses x 3 x 4 projection matrices of a list of poses,
+        using the camera intrinsics or the given intrinsics of each pose.
+        """
+        num_poses = len(object_to_camera_poses)
+        T_obj_camera_arr = np.zeros([num_poses, 3, 4])
+        if isinstance(object_to_camera_poses, RigidTransformArray):
+            T_obj_camera_arr[:,:,:3] = object_to_camera_poses.rotations
+            T_obj_camera_arr[:,:,3] = object_to_camera_poses.translations
+        else:
+            for i, T_obj_camera in enumerate(object_to_camera_poses):
+                T_obj_camera_arr[i,:,:3] = T_obj_camera.rotation
+                T_obj_camera_arr[i,:,3] = T_obj_camera.translation
+        if camera_intrinsics is None:
+            return np.einsum('ij,njk->nik', self._camera_intr.proj_matrix, T_obj_camera_arr)
+
+        if len(camera_intrinsics) != num_poses:
+            raise ValueError('Must provide camera intrinsics for each pose')
+        if isinstance(camera_intrinsics, CameraIntrinsicsArray):
+            camera_intrinsics_list = [camera_intrinsics.camera_intr]
+            K_arr = camera_intrinsics.proj_matrices
+        else:
+            camera_intrinsics_list = camera_intrinsics
+            K_arr = np.array([camera_intr.proj_matrix for camera_intr in camera_intrinsics]).reshape(num_poses, 3, 3)
+        for camera_intr in camera_intrinsics_list:
+            if camera_intr.height != self._camera_intr.height or camera_intr.width != self._camera_intr.width:
+                raise ValueError('Camera intrinsics must have the image size of the camera')
+        return np.einsum('nij,njk->nik', K_arr, T_obj_camera_arr)
+
+    def _output_arrays(self, render_flags, num_poses):
+        """ Returns the next reusable output arrays for the selected image types,
+        or None for each array if output arrays are not reused.
+        """
+        if self._num_output_buffers <= 0:
+            return None, None, None
+
+        height = self._camera_intr.height
+        width = self._camera_intr.width
+        specs = [(meshrender.RENDER_COLOR, (num_poses, height, width, 3), np.uint8),
+                 (meshrender.RENDER_DEPTH, (num_poses, height, width), np.float32),
+                 (meshrender.RENDER_MASK, (num_poses, height, width), np.uint8)]
+        ind = self._output_buffer_ind
+        self._output_buffer_ind = (ind + 1) % self._num_output_buffers
+        arrays = []
+        for flag, shape, dtype in specs:
+            if not render_flags & flag:
+                arrays.append(None)
+                continue
+            buffers = self._output_buffers.setdefault(flag, [None] * self._num_output_buffers)
+            if buffers[ind] is None or buffers[ind].shape != shape:
+                buffers[ind] = np.empty(shape, dtype=dtype)
+            arrays.append(buffers[ind])
+        return tuple(arrays)
+
+    @staticmethod
+    def _render_flags(render_mode):
+        """ Returns the meshrender flags of the images needed for a render mode. """
+        if render_mode == RenderMode.SEGMASK:
+            return meshrender.RENDER_MASK
+        elif render_mode in [RenderMode.COLOR, RenderMode.COLOR_SCENE]:
+            return meshrender.RENDER_COLOR
+        elif render_mode in [RenderMode.DEPTH, RenderMode.DEPTH_SCENE, RenderMode.SCALED_DEPTH]:
+            return meshrender.RENDER_DEPTH
+        return meshrender.RENDER_COLOR | meshrender.RENDER_DEPTH
+
     def wrapped_images_viewsphere(self, mesh, vs_disc, render_mode, stable_pose=None, mat_props=None, light_props=None):
         """Create ObjectRender objects of the given mesh around a viewsphere.
 
@@ -747,15 +1040,11 @@ class VirtualCamera(object):
         :obj:`list` of :obj:`CameraIntrinsics`
             A list of the camera intrinsics used for rendering the images.
         """
-        # save original intrinsics
-        old_camera_intr = copy.deepcopy(self._camera_intr)
-        object_to_camera_poses, object_to_camera_normalized_poses, shifted_camera_intrinsics = ws_disc.object_to_camera_poses(old_camera_intr)
+        object_to_camera_poses, object_to_camera_normalized_poses, shifted_camera_intrinsics = ws_disc.object_to_camera_poses(self._camera_intr)
         logging.info('Rendering %d images' %(len(object_to_camera_poses)))
 
-        images = []
-        for T_obj_camera, shifted_camera_intr in zip(object_to_camera_poses, shifted_camera_intrinsics):
-            self._camera_intr = shifted_camera_intr
-            images.extend(self.wrapped_images(mesh, [T_obj_camera], render_mode, stable_pose=stable_pose, mat_props=mat_props, light_props=light_props))
-
-        self._camera_intr = old_camera_intr
+        # render all poses with their shifted intrinsics at once
+        images = self.wrapped_images(mesh, object_to_camera_poses, render_mode, stable_pose=stable_pose,
+                                     mat_props=mat_props, light_props=light_props,
+                                     camera_intrinsics=shifted_camera_intrinsics)
         return images, object_to_camera_poses, shifted_camera_intrinsics
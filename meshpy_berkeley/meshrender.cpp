@@ -3,6 +3,9 @@
 #include "boost/python/numeric.hpp"
 #include <boost/numpy.hpp>
 #include <iostream>
+#include <set>
+#include <vector>
+#include <cstring>
 
 #include "GL/osmesa.h"
 #include <GL/gl.h>
@@ -15,6 +18,11 @@ float near = 0.05f;
 float far = 1e2f;
 float scale = (0x0001) << 0;
 
+// flags selecting the images to read back from the framebuffer
+const int RENDER_COLOR = 1;
+const int RENDER_DEPTH = 2;
+const int RENDER_MASK = 4;
+
 // offsets for reading material buffers
 int mat_ambient_off = 3;
 int mat_diffuse_off = mat_ambient_off + 4;
@@ -28,6 +36,8 @@ int light_specular_off = light_diffuse_off + 4;
 int light_position_off = light_specular_off + 4;
 int light_direction_off = light_position_off + 3;
 int light_spot_cutoff_off = light_direction_off + 3;
+int light_props_len = light_spot_cutoff_off + 1;
+int mat_props_len = mat_shininess_off + 1;
 
 void uint2uchar(unsigned int in, unsigned char* out){
   out[0] = (in & 0x00ff0000) >> 16;
@@ -35,324 +45,637 @@ void uint2uchar(unsigned int in, unsigned char* out){
   out[2] =  in & 0x000000ff;
 }
 
-boost::python::tuple render_mesh(boost::python::list proj_matrices,
-                                 unsigned int im_height,
-                                 unsigned int im_width,
-                                 boost::python::numeric::array verts,
-                                 boost::python::numeric::array tris,
-                                 boost::python::numeric::array norms,
-                                 boost::python::numeric::array mat_props,
-                                 boost::python::numeric::array light_props,
-				 bool enable_lighting = false,
-                                 bool debug = false)
+// set material properties from a material buffer
+void set_material(const double* mat_props_buffer)
 {
-  // init rendering vars
-  OSMesaContext ctx;
-  boost::python::list color_ims;
-  boost::python::list depth_ims;
-  void *buffer;
-  unsigned char* color_result = NULL;
-  float* depth_result = NULL;
+  GLfloat mat_ambient[4];
+  GLfloat mat_diffuse[4];
+  GLfloat mat_specular[4];
+  GLfloat mat_shininess[1];
+  for (int i = 0; i < 4; i++) {
+    mat_ambient[i] = (GLfloat)mat_props_buffer[mat_ambient_off + i];
+    mat_diffuse[i] = (GLfloat)mat_props_buffer[mat_diffuse_off + i];
+    mat_specular[i] = (GLfloat)mat_props_buffer[mat_specular_off + i];
+  }
+  mat_shininess[0] = (GLfloat)mat_props_buffer[mat_shininess_off + 0];
 
-  // parse input data
-  int num_projections = boost::python::len(proj_matrices);
-  long int verts_buflen;
-  long int tris_buflen;
-  long int norms_buflen;
-  long int mat_props_buflen;
-  long int light_props_buflen;
-  void const *verts_raw_buffer;
-  void const *tris_raw_buffer;
-  void const *norms_raw_buffer;
-  void const *mat_props_raw_buffer;
-  void const *light_props_raw_buffer;
-
-  // read numpy buffers
-  bool verts_readbuf_success = !PyObject_AsReadBuffer(verts.ptr(), &verts_raw_buffer, &verts_buflen);
-  bool tris_readbuf_success = !PyObject_AsReadBuffer(tris.ptr(), &tris_raw_buffer, &tris_buflen);
-  bool norms_readbuf_success = !PyObject_AsReadBuffer(norms.ptr(), &norms_raw_buffer, &norms_buflen);
-  bool mat_props_readbuf_success = !PyObject_AsReadBuffer(mat_props.ptr(), &mat_props_raw_buffer, &mat_props_buflen);
-  bool light_props_readbuf_success = !PyObject_AsReadBuffer(light_props.ptr(), &light_props_raw_buffer, &light_props_buflen);
-
-  // cast numpy buffers to C arrays
-  const double* verts_buffer = reinterpret_cast<const double*>(verts_raw_buffer);
-  const unsigned int* tris_buffer = reinterpret_cast<const unsigned int*>(tris_raw_buffer);
-  const double* norms_buffer = reinterpret_cast<const double*>(norms_raw_buffer);
-  const double* mat_props_buffer = reinterpret_cast<const double*>(mat_props_raw_buffer);
-  const double* light_props_buffer = reinterpret_cast<const double*>(light_props_raw_buffer);
-
-  // read color
-  double final_matrix[16];
-  unsigned char colorBytes[3];
-  colorBytes[0] = (unsigned char)mat_props_buffer[0];
-  colorBytes[1] = (unsigned char)mat_props_buffer[1];
-  colorBytes[2] = (unsigned char)mat_props_buffer[2];
-
-  // compute num vertices
-  unsigned int num_verts = verts_buflen / (3 * sizeof(double));
-  unsigned int num_tris = tris_buflen / (3 * sizeof(unsigned int));
-  unsigned int num_norms = norms_buflen / (3 * sizeof(double));
-  if (debug) {
-    std::cout << "Num vertices " << num_verts << std::endl;
-    std::cout << "Num tris " << num_tris << std::endl;
-    std::cout << "Num norms " << num_norms << std::endl;
-    std::cout << "Color " << (int)colorBytes[0] << " " << (int)colorBytes[1] << " " << (int)colorBytes[2] << std::endl;
+  glMaterialfv(GL_FRONT_AND_BACK, GL_AMBIENT, mat_ambient);
+  glMaterialfv(GL_FRONT_AND_BACK, GL_DIFFUSE, mat_diffuse);
+  glMaterialfv(GL_FRONT_AND_BACK, GL_SPECULAR, mat_specular);
+  glMaterialfv(GL_FRONT_AND_BACK, GL_SHININESS, mat_shininess);
+}
+
+// set light properties from a lighting buffer
+void set_light(const double* light_props_buffer, bool debug)
+{
+  GLfloat light_ambient[4];
+  GLfloat light_diffuse[4];
+  GLfloat light_specular[4];
+  GLfloat light_position[4];
+  GLfloat light_direction[3];
+  GLfloat light_spot_cutoff[1];
+  for (int i = 0; i < 4; i++) {
+    light_ambient[i] = (GLfloat)light_props_buffer[light_ambient_off + i];
+    light_diffuse[i] = (GLfloat)light_props_buffer[light_diffuse_off + i];
+    light_specular[i] = (GLfloat)light_props_buffer[light_specular_off + i];
+  }
+  for (int i = 0; i < 3; i++) {
+    light_position[i] = (GLfloat)light_props_buffer[light_position_off + i];
+    light_direction[i] = (GLfloat)light_props_buffer[light_direction_off + i];
   }
+  light_position[3] = 1.0; // always set w to 1
+  light_spot_cutoff[0] = (GLfloat)light_props_buffer[light_spot_cutoff_off + 0];
 
-  // create an RGBA-mode context
-  ctx = OSMesaCreateContextExt( OSMESA_RGBA, 16, 0, 0, NULL );
-  if (!ctx) {
-    printf("OSMesaCreateContext failed!\n");
+  glLightfv(GL_LIGHT0, GL_AMBIENT, light_ambient);
+  glLightfv(GL_LIGHT0, GL_DIFFUSE, light_diffuse);
+  glLightfv(GL_LIGHT0, GL_SPECULAR, light_specular);
+  glLightfv(GL_LIGHT0, GL_POSITION, light_position);
+  glLightfv(GL_LIGHT0, GL_SPOT_DIRECTION, light_direction);
+  glLightfv(GL_LIGHT0, GL_SPOT_CUTOFF, light_spot_cutoff);
+
+  if (debug) {
+    std::cout << "Light pos " << light_position[0] << " " << light_position[1] << " " << light_position[2] << " " << light_position[3] << std::endl;
+    std::cout << "Light dir " << light_direction[0] << " " << light_direction[1] << " " << light_direction[2] << std::endl;
   }
+}
+
+// convert a 3x4 camera projection matrix to a column-major OpenGL projection matrix
+void compute_gl_projection(const double* projection,
+                           unsigned int im_height,
+                           unsigned int im_width,
+                           double* final_matrix)
+{
+  double inv_width_scale  = 1.0 / (im_width * scale);
+  double inv_height_scale = 1.0 / (im_height * scale);
+  double inv_width_scale_1 = inv_width_scale - 1.0;
+  double inv_height_scale_1_s = -(inv_height_scale - 1.0);
+  double inv_width_scale_2 = inv_width_scale * 2.0;
+  double inv_height_scale_2_s = -inv_height_scale * 2.0;
+  double far_a_near = far + near;
+  double far_s_near = far - near;
+  double far_d_near = far_a_near / far_s_near;
+  final_matrix[ 0] = projection[0+2*4] * inv_width_scale_1 + projection[0+0*4] * inv_width_scale_2;
+  final_matrix[ 4] = projection[1+2*4] * inv_width_scale_1 + projection[1+0*4] * inv_width_scale_2;
+  final_matrix[ 8] = projection[2+2*4] * inv_width_scale_1 + projection[2+0*4] * inv_width_scale_2;
+  final_matrix[ 12] = projection[3+2*4] * inv_width_scale_1 + projection[3+0*4] * inv_width_scale_2;
+
+  final_matrix[ 1] = projection[0+2*4] * inv_height_scale_1_s + projection[0+1*4] * inv_height_scale_2_s;
+  final_matrix[ 5] = projection[1+2*4] * inv_height_scale_1_s + projection[1+1*4] * inv_height_scale_2_s;
+  final_matrix[ 9] = projection[2+2*4] * inv_height_scale_1_s + projection[2+1*4] * inv_height_scale_2_s;
+  final_matrix[13] = projection[3+2*4] * inv_height_scale_1_s + projection[3+1*4] * inv_height_scale_2_s;
+
+  final_matrix[ 2] = projection[0+2*4] * far_d_near;
+  final_matrix[ 6] = projection[1+2*4] * far_d_near;
+  final_matrix[10] = projection[2+2*4] * far_d_near;
+  final_matrix[14] = projection[3+2*4] * far_d_near - (2*far*near)/far_s_near;
+
+  final_matrix[ 3] = projection[0+2*4];
+  final_matrix[ 7] = projection[1+2*4];
+  final_matrix[11] = projection[2+2*4];
+  final_matrix[15] = projection[3+2*4];
+}
 
-  // allocate the image buffer
-  buffer = malloc( im_width * im_height * 4 * sizeof(GLubyte) );
-  if (!buffer) {
-    printf("Alloc image buffer failed!\n");
+// Returns a pointer to the data of an output array, allocating the array if out is None
+// and checking that it is a writeable C-contiguous array of the given shape and type otherwise
+void* output_data(boost::python::object out,
+                  boost::python::tuple shape,
+                  boost::numpy::dtype dt,
+                  boost::python::object& result)
+{
+  if (out.is_none()) {
+    boost::numpy::ndarray arr = boost::numpy::empty(shape, dt);
+    result = arr;
+    return arr.get_data();
   }
 
-  // bind the buffer to the context and make it current
-  if (!OSMesaMakeCurrent( ctx, buffer, GL_UNSIGNED_BYTE, im_width, im_height )) {
-    printf("OSMesaMakeCurrent failed!\n");
+  boost::numpy::ndarray arr = boost::python::extract<boost::numpy::ndarray>(out);
+  bool valid = boost::numpy::equivalent(arr.get_dtype(), dt) && arr.get_nd() == boost::python::len(shape) &&
+    (arr.get_flags() & boost::numpy::ndarray::C_CONTIGUOUS) && (arr.get_flags() & boost::numpy::ndarray::WRITEABLE);
+  for (int i = 0; valid && i < arr.get_nd(); i++) {
+    valid = arr.get_shape()[i] == boost::python::extract<long>(shape[i]);
   }
-  OSMesaPixelStore(OSMESA_Y_UP, 0);
-
-  // setup material properties
-  if (enable_lighting) {
-    GLfloat mat_ambient[4];
-    GLfloat mat_diffuse[4];
-    GLfloat mat_specular[4];
-    GLfloat mat_shininess[1];
-    mat_ambient[0] = (GLfloat)mat_props_buffer[mat_ambient_off + 0];
-    mat_ambient[1] = (GLfloat)mat_props_buffer[mat_ambient_off + 1];
-    mat_ambient[2] = (GLfloat)mat_props_buffer[mat_ambient_off + 2];
-    mat_ambient[3] = (GLfloat)mat_props_buffer[mat_ambient_off + 3];
-
-    mat_diffuse[0] = (GLfloat)mat_props_buffer[mat_diffuse_off + 0];
-    mat_diffuse[1] = (GLfloat)mat_props_buffer[mat_diffuse_off + 1];
-    mat_diffuse[2] = (GLfloat)mat_props_buffer[mat_diffuse_off + 2];
-    mat_diffuse[3] = (GLfloat)mat_props_buffer[mat_diffuse_off + 3];
-
-    mat_specular[0] = (GLfloat)mat_props_buffer[mat_specular_off + 0];
-    mat_specular[1] = (GLfloat)mat_props_buffer[mat_specular_off + 1];
-    mat_specular[2] = (GLfloat)mat_props_buffer[mat_specular_off + 2];
-    mat_specular[3] = (GLfloat)mat_props_buffer[mat_specular_off + 3];
-
-    mat_shininess[0] = (GLfloat)mat_props_buffer[mat_shininess_off + 0];
+  if (!valid) {
+    PyErr_SetString(PyExc_ValueError, "Output array has the wrong shape or type, or is not writeable and contiguous");
+    boost::python::throw_error_already_set();
+  }
+  result = arr;
+  return arr.get_data();
+}
+
+// Offscreen renderer that owns an OSMesa context and framebuffer of a fixed size,
+// so that they can be reused across calls until the renderer is closed.
+// Meshes are uploaded once into display lists and referenced by handle when rendering.
+class Renderer
+{
+ public:
+  Renderer(unsigned int im_height, unsigned int im_width)
+    : ctx_(NULL), buffer_(NULL),
+      im_height_(im_height), im_width_(im_width),
+      depth_buffer_(im_height * im_width), stencil_buffer_(im_height * im_width)
+  {
+    // create an RGB-mode context, so that color images can be copied out directly,
+    // with a stencil buffer that marks the pixels covered by the mesh
+    ctx_ = OSMesaCreateContextExt( OSMESA_RGB, 24, 8, 0, NULL );
+    if (!ctx_) {
+      PyErr_SetString(PyExc_RuntimeError, "OSMesaCreateContext failed");
+      boost::python::throw_error_already_set();
+    }
+
+    // allocate the image buffer
+    buffer_ = malloc( im_width_ * im_height_ * 3 * sizeof(GLubyte) );
+    if (!buffer_) {
+      close();
+      PyErr_SetString(PyExc_MemoryError, "Alloc image buffer failed");
+      boost::python::throw_error_already_set();
+    }
 
+    // bind the buffer to the context and set the state that is shared by all renders
+    make_current();
+    OSMesaPixelStore(OSMESA_Y_UP, 0);
     glClearColor(0.0, 0.0, 0.0, 0.0);
     glShadeModel(GL_SMOOTH);
-    glMaterialfv(GL_FRONT_AND_BACK, GL_AMBIENT, mat_ambient);
-    glMaterialfv(GL_FRONT_AND_BACK, GL_DIFFUSE, mat_diffuse);
-    glMaterialfv(GL_FRONT_AND_BACK, GL_SPECULAR, mat_specular);
-    glMaterialfv(GL_FRONT_AND_BACK, GL_SHININESS, mat_shininess);
-
-    // setup lighting properties
-    GLfloat light_ambient[4];
-    GLfloat light_diffuse[4];
-    GLfloat light_specular[4];
-    GLfloat light_position[4];
-    GLfloat light_direction[3];
-    GLfloat light_spot_cutoff[1];
-
-    light_ambient[0] = (GLfloat)light_props_buffer[light_ambient_off + 0];
-    light_ambient[1] = (GLfloat)light_props_buffer[light_ambient_off + 1];
-    light_ambient[2] = (GLfloat)light_props_buffer[light_ambient_off + 2];
-    light_ambient[3] = (GLfloat)light_props_buffer[light_ambient_off + 3];
-
-    light_diffuse[0] = (GLfloat)light_props_buffer[light_diffuse_off + 0];
-    light_diffuse[1] = (GLfloat)light_props_buffer[light_diffuse_off + 1];
-    light_diffuse[2] = (GLfloat)light_props_buffer[light_diffuse_off + 2];
-    light_diffuse[3] = (GLfloat)light_props_buffer[light_diffuse_off + 3];
-
-    light_specular[0] = (GLfloat)light_props_buffer[light_specular_off + 0];
-    light_specular[1] = (GLfloat)light_props_buffer[light_specular_off + 1];
-    light_specular[2] = (GLfloat)light_props_buffer[light_specular_off + 2];
-    light_specular[3] = (GLfloat)light_props_buffer[light_specular_off + 3];
-
-    light_position[0] = (GLfloat)light_props_buffer[light_position_off + 0];
-    light_position[1] = (GLfloat)light_props_buffer[light_position_off + 1];
-    light_position[2] = (GLfloat)light_props_buffer[light_position_off + 2];
-    light_position[3] = 1.0; // always set w to 1
-
-    light_direction[0] = (GLfloat)light_props_buffer[light_direction_off + 0];
-    light_direction[1] = (GLfloat)light_props_buffer[light_direction_off + 1];
-    light_direction[2] = (GLfloat)light_props_buffer[light_direction_off + 2];
-
-    light_spot_cutoff[0] = (GLfloat)light_props_buffer[light_spot_cutoff_off + 0];
-
-    glLightfv(GL_LIGHT0, GL_AMBIENT, light_ambient);
-    glLightfv(GL_LIGHT0, GL_DIFFUSE, light_diffuse);
-    glLightfv(GL_LIGHT0, GL_SPECULAR, light_specular);
-    glLightfv(GL_LIGHT0, GL_POSITION, light_position);
-    glLightfv(GL_LIGHT0, GL_SPOT_DIRECTION, light_direction);
-    glLightfv(GL_LIGHT0, GL_SPOT_CUTOFF, light_spot_cutoff);
+    glLightModelf(GL_LIGHT_MODEL_TWO_SIDE, GL_TRUE);
+    glColorMaterial(GL_FRONT_AND_BACK, GL_AMBIENT_AND_DIFFUSE);
+    glEnable(GL_COLOR_MATERIAL);
+    glEnable(GL_DEPTH_TEST);
+    glDisable(GL_CULL_FACE);
+    glPolygonMode(GL_FRONT_AND_BACK, GL_FILL);
+    glViewport(0, 0, im_width_, im_height_);
+    glClearStencil(0);
+    glEnable(GL_STENCIL_TEST);
+    glStencilFunc(GL_ALWAYS, 255, 0xFF);
+    glStencilOp(GL_KEEP, GL_KEEP, GL_REPLACE);
+    glPixelStorei(GL_PACK_ALIGNMENT, 1);
+
+    // the color buffer is copied out directly, so it must be tightly packed RGB
+    GLint out_width, out_height, color_format;
+    void* p_color_buffer;
+    if (!OSMesaGetColorBuffer(ctx_, &out_width, &out_height, &color_format, &p_color_buffer) ||
+        color_format != OSMESA_RGB || out_width != (GLint)im_width_ || out_height != (GLint)im_height_) {
+      close();
+      PyErr_SetString(PyExc_RuntimeError, "OSMesa context does not have an RGB color buffer of the image size");
+      boost::python::throw_error_already_set();
+    }
 
-    if (debug) {
-      std::cout << "Light pos " << light_position[0] << " " << light_position[1] << " " << light_position[2] << " " << light_position[3] << std::endl;
-      std::cout << "Light dir " << light_direction[0] << " " << light_direction[1] << " " << light_direction[2] << std::endl;
+    // depth and stencil are read with glReadPixels, which converts from any buffer format
+    GLint depth_bits, stencil_bits;
+    glGetIntegerv(GL_DEPTH_BITS, &depth_bits);
+    glGetIntegerv(GL_STENCIL_BITS, &stencil_bits);
+    if (depth_bits < 16 || stencil_bits < 8) {
+      close();
+      PyErr_SetString(PyExc_RuntimeError, "OSMesa context needs at least 16 depth bits and 8 stencil bits");
+      boost::python::throw_error_already_set();
     }
+  }
 
-    // enable lighting
-    glLightModelf(GL_LIGHT_MODEL_TWO_SIDE, GL_TRUE);
-    glEnable(GL_LIGHTING);
-    glEnable(GL_LIGHT0);
+  ~Renderer()
+  {
+    close();
   }
 
-  // set color
-  glColorMaterial(GL_FRONT_AND_BACK, GL_AMBIENT_AND_DIFFUSE);
-  glEnable(GL_COLOR_MATERIAL);
+  // compile a mesh into a display list and return its handle. The vertices and normals
+  // must be Nx3 float64 arrays and the triangles an Mx3 array of 4-byte vertex indices,
+  // all C-contiguous, since the display list is compiled directly from their data
+  unsigned int upload_mesh(boost::python::numeric::array verts,
+                           boost::python::numeric::array tris,
+                           boost::python::numeric::array norms)
+  {
+    check_open();
+    boost::numpy::dtype double_dt = boost::numpy::dtype::get_builtin<double>();
+    boost::numpy::ndarray verts_arr = mesh_array(verts, "Vertices");
+    boost::numpy::ndarray tris_arr = mesh_array(tris, "Triangles");
+    boost::numpy::ndarray norms_arr = mesh_array(norms, "Normals");
+    if (!boost::numpy::equivalent(verts_arr.get_dtype(), double_dt) ||
+        !boost::numpy::equivalent(norms_arr.get_dtype(), double_dt)) {
+      PyErr_SetString(PyExc_ValueError, "Vertices and normals must be float64 arrays");
+      boost::python::throw_error_already_set();
+    }
+    if (!boost::numpy::equivalent(tris_arr.get_dtype(), boost::numpy::dtype::get_builtin<int>()) &&
+        !boost::numpy::equivalent(tris_arr.get_dtype(), boost::numpy::dtype::get_builtin<unsigned int>())) {
+      PyErr_SetString(PyExc_ValueError, "Triangles must be an array of 4-byte integers");
+      boost::python::throw_error_already_set();
+    }
+    unsigned int num_verts = verts_arr.get_shape()[0];
+    unsigned int num_tris = tris_arr.get_shape()[0];
+    if (norms_arr.get_shape()[0] != (Py_intptr_t)num_verts) {
+      PyErr_SetString(PyExc_ValueError, "Normals must have the same length as the vertices");
+      boost::python::throw_error_already_set();
+    }
 
-  // setup rendering
-  glEnable(GL_DEPTH_TEST);
-  glDisable(GL_CULL_FACE);
-  glPolygonMode(GL_FRONT_AND_BACK, GL_FILL);
+    // negative indices of signed triangle arrays are out of range as unsigned ints
+    const void *verts_raw_buffer = verts_arr.get_data();
+    const void *norms_raw_buffer = norms_arr.get_data();
+    const unsigned int *tris_raw_buffer = reinterpret_cast<const unsigned int*>(tris_arr.get_data());
+    for (unsigned int i = 0; i < 3 * num_tris; i++) {
+      if (tris_raw_buffer[i] >= num_verts) {
+        PyErr_SetString(PyExc_ValueError, "Triangle vertex index out of range");
+        boost::python::throw_error_already_set();
+      }
+    }
 
-  for (unsigned int k = 0; k < num_projections; k++) {
-    // load next projection matrix
-    boost::python::object proj_matrix_obj(proj_matrices[k]);
+    // vertex array commands dereference the arrays when the list is compiled,
+    // so the arrays are not needed after this call
+    make_current();
+    GLuint handle = glGenLists(1);
+    if (handle == 0) {
+      PyErr_SetString(PyExc_RuntimeError, "Failed to allocate display list");
+      boost::python::throw_error_already_set();
+    }
+    glEnableClientState(GL_VERTEX_ARRAY);
+    glEnableClientState(GL_NORMAL_ARRAY);
+    glVertexPointer(3, GL_DOUBLE, 0, verts_raw_buffer);
+    glNormalPointer(GL_DOUBLE, 0, norms_raw_buffer);
+    glNewList(handle, GL_COMPILE);
+    glDrawElements(GL_TRIANGLES, 3 * num_tris, GL_UNSIGNED_INT, tris_raw_buffer);
+    glEndList();
+    glDisableClientState(GL_VERTEX_ARRAY);
+    glDisableClientState(GL_NORMAL_ARRAY);
+    mesh_handles_.insert(handle);
+    return handle;
+  }
+
+  // delete the display list of an uploaded mesh
+  void release_mesh(unsigned int handle)
+  {
+    if (closed() || mesh_handles_.erase(handle) == 0) {
+      return;
+    }
+    make_current();
+    glDeleteLists(handle, 1);
+  }
+
+  // free the image buffer and destroy the context, along with all uploaded meshes
+  void close()
+  {
+    mesh_handles_.clear();
+    if (buffer_ != NULL) {
+      free( buffer_ );
+      buffer_ = NULL;
+    }
+    if (ctx_ != NULL) {
+      OSMesaDestroyContext( ctx_ );
+      ctx_ = NULL;
+    }
+  }
+
+  unsigned int height() const { return im_height_; }
+  unsigned int width() const { return im_width_; }
+  bool closed() const { return ctx_ == NULL; }
+
+  // render an uploaded mesh from a batch of N 3x4 projection matrices, using the
+  // lighting properties of each pose (or the same properties for all poses),
+  // and return an NxHxWx3 color array, an NxHxW depth array and an NxHxW mask array,
+  // where images not selected by the render flags are None and are not read back.
+  // Images are written into the given output arrays, or into new arrays if they are None
+  boost::python::tuple render(unsigned int mesh_handle,
+                              boost::python::numeric::array proj_matrices,
+                              boost::python::numeric::array mat_props,
+                              boost::python::numeric::array light_props,
+                              int render_flags = RENDER_COLOR | RENDER_DEPTH,
+                              bool enable_lighting = false,
+                              bool debug = false,
+                              boost::python::object color_out = boost::python::object(),
+                              boost::python::object depth_out = boost::python::object(),
+                              boost::python::object mask_out = boost::python::object())
+  {
+    check_open();
+    std::vector<unsigned int> mesh_handles(1, mesh_handle);
+    const double* mat_props_buffer = reinterpret_cast<const double*>(read_buffer(mat_props, mat_props_len, 1));
+    return render_objects(mesh_handles, NULL, mat_props_buffer, false,
+                          proj_matrices, light_props, render_flags, enable_lighting, debug,
+                          color_out, depth_out, mask_out);
+  }
+
+  // render a scene of M uploaded meshes in a single depth-tested pass for each of
+  // N 3x4 projection matrices, where each mesh is placed by a 4x4 model matrix from
+  // its frame to the frame of the projections and drawn with its own material.
+  // Returns the color and depth arrays as in render, along with an NxHxW array of the
+  // visible object at each pixel, where pixels of object i are i+1 and background pixels are 0
+  boost::python::tuple render_scene(boost::python::numeric::array mesh_handles,
+                                    boost::python::numeric::array model_matrices,
+                                    boost::python::numeric::array mat_props,
+                                    boost::python::numeric::array proj_matrices,
+                                    boost::python::numeric::array light_props,
+                                    int render_flags = RENDER_COLOR | RENDER_DEPTH,
+                                    bool enable_lighting = false,
+                                    bool debug = false,
+                                    boost::python::object color_out = boost::python::object(),
+                                    boost::python::object depth_out = boost::python::object(),
+                                    boost::python::object ids_out = boost::python::object())
+  {
+    check_open();
+
+    // read the per-object handles, model matrices and materials
+    long int handles_buflen;
+    void const *handles_raw_buffer;
+    if (PyObject_AsReadBuffer(mesh_handles.ptr(), &handles_raw_buffer, &handles_buflen)) {
+      boost::python::throw_error_already_set();
+    }
+    unsigned int num_objects = handles_buflen / sizeof(unsigned int);
+    if (num_objects > 255) {
+      PyErr_SetString(PyExc_ValueError, "Scenes can contain at most 255 objects");
+      boost::python::throw_error_already_set();
+    }
+    const unsigned int* handles_buffer = reinterpret_cast<const unsigned int*>(handles_raw_buffer);
+    std::vector<unsigned int> handles(handles_buffer, handles_buffer + num_objects);
+    const double* model_buffer = reinterpret_cast<const double*>(read_buffer(model_matrices, 16, num_objects));
+    const double* mat_props_buffer = reinterpret_cast<const double*>(read_buffer(mat_props, mat_props_len, num_objects));
+
+    return render_objects(handles, model_buffer, mat_props_buffer, true,
+                          proj_matrices, light_props, render_flags, enable_lighting, debug,
+                          color_out, depth_out, ids_out);
+  }
+
+ private:
+  // render the given uploaded meshes together for each projection. The model matrices
+  // are row-major 4x4 matrices, or NULL for the identity, and the stencil value of each
+  // object is its index plus one if object_ids is set and 255 otherwise
+  boost::python::tuple render_objects(const std::vector<unsigned int>& mesh_handles,
+                                      const double* model_buffer,
+                                      const double* mat_props_buffer,
+                                      bool object_ids,
+                                      boost::python::numeric::array proj_matrices,
+                                      boost::python::numeric::array light_props,
+                                      int render_flags,
+                                      bool enable_lighting,
+                                      bool debug,
+                                      boost::python::object color_out,
+                                      boost::python::object depth_out,
+                                      boost::python::object mask_out)
+  {
+    unsigned int num_objects = mesh_handles.size();
+    for (unsigned int m = 0; m < num_objects; m++) {
+      if (mesh_handles_.count(mesh_handles[m]) == 0) {
+        PyErr_SetString(PyExc_ValueError, "Invalid mesh handle");
+        boost::python::throw_error_already_set();
+      }
+    }
+
+    // parse input data
     long int proj_buflen;
+    long int light_props_buflen;
     void const *proj_raw_buffer;
-    bool proj_readbuf_success = !PyObject_AsReadBuffer(proj_matrix_obj.ptr(),
-                                                       &proj_raw_buffer,
-                                                       &proj_buflen);
-    const double* projection = reinterpret_cast<const double*>(proj_raw_buffer);
-    if (debug) {
-      std::cout << "Proj Matrix " << k << std::endl;
-      std::cout << projection[0] << " " << projection[1] << " " << projection[2] << " " << projection[3] << std::endl;
-      std::cout << projection[4] << " " << projection[5] << " " << projection[6] << " " << projection[7] << std::endl;
-      std::cout << projection[8] << " " << projection[9] << " " << projection[10] << " " << projection[11] << std::endl;
-    }
-
-    // create projection
-    double inv_width_scale  = 1.0 / (im_width * scale);
-    double inv_height_scale = 1.0 / (im_height * scale);
-    double inv_width_scale_1 = inv_width_scale - 1.0;
-    double inv_height_scale_1_s = -(inv_height_scale - 1.0);
-    double inv_width_scale_2 = inv_width_scale * 2.0;
-    double inv_height_scale_2_s = -inv_height_scale * 2.0;
-    double far_a_near = far + near;
-    double far_s_near = far - near;
-    double far_d_near = far_a_near / far_s_near;
-    final_matrix[ 0] = projection[0+2*4] * inv_width_scale_1 + projection[0+0*4] * inv_width_scale_2;
-    final_matrix[ 4] = projection[1+2*4] * inv_width_scale_1 + projection[1+0*4] * inv_width_scale_2;
-    final_matrix[ 8] = projection[2+2*4] * inv_width_scale_1 + projection[2+0*4] * inv_width_scale_2;
-    final_matrix[ 12] = projection[3+2*4] * inv_width_scale_1 + projection[3+0*4] * inv_width_scale_2;
-
-    final_matrix[ 1] = projection[0+2*4] * inv_height_scale_1_s + projection[0+1*4] * inv_height_scale_2_s;
-    final_matrix[ 5] = projection[1+2*4] * inv_height_scale_1_s + projection[1+1*4] * inv_height_scale_2_s;
-    final_matrix[ 9] = projection[2+2*4] * inv_height_scale_1_s + projection[2+1*4] * inv_height_scale_2_s;
-    final_matrix[13] = projection[3+2*4] * inv_height_scale_1_s + projection[3+1*4] * inv_height_scale_2_s;
-
-    final_matrix[ 2] = projection[0+2*4] * far_d_near;
-    final_matrix[ 6] = projection[1+2*4] * far_d_near;
-    final_matrix[10] = projection[2+2*4] * far_d_near;
-    final_matrix[14] = projection[3+2*4] * far_d_near - (2*far*near)/far_s_near;
-
-    final_matrix[ 3] = projection[0+2*4];
-    final_matrix[ 7] = projection[1+2*4];
-    final_matrix[11] = projection[2+2*4];
-    final_matrix[15] = projection[3+2*4];
-
-    // load projection and modelview matrices
-    glMatrixMode(GL_PROJECTION);
-    glLoadMatrixd(final_matrix);
-    glMatrixMode(GL_MODELVIEW);
-    glLoadIdentity();
-
-    // render mesh
-    glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT);
-    glViewport(0, 0, im_width, im_height);
-    for (unsigned int i = 0; i < num_tris; ++i) {
-      glColor3ubv(colorBytes);
-      glBegin(GL_POLYGON);
-
-      unsigned int a = tris_buffer[3*i + 0];
-      unsigned int b = tris_buffer[3*i + 1];
-      unsigned int c = tris_buffer[3*i + 2];
-
-      glNormal3dv(&norms_buffer[3 * a]);
-      glVertex3dv(&verts_buffer[3 * a]);
-      glNormal3dv(&norms_buffer[3 * b]);
-      glVertex3dv(&verts_buffer[3 * b]);
-      glNormal3dv(&norms_buffer[3 * c]);
-      glVertex3dv(&verts_buffer[3 * c]);
-      glEnd();
-    }
-
-    glFinish();
-
-    // pull color buffer and flip y axis
-    int i, j;
-    GLint out_width, out_height, bytes_per_depth, color_type;
-    GLboolean succeeded;
-    unsigned char* p_color_buffer;
-    succeeded = OSMesaGetColorBuffer(ctx, &out_width, &out_height, &color_type, (void**)&p_color_buffer);
-    if (color_result == NULL)
-      color_result = new unsigned char[3 * out_width * out_height];
-    for (i = 0; i < out_width; i++) {
-      for (j = 0; j < out_height; j++) {
-        int di = i + j * out_width; // index in color buffer
-        int ri = i + j * out_width; // index in rendered image
-        color_result[3*ri+0] = p_color_buffer[4*di+0];
-        color_result[3*ri+1] = p_color_buffer[4*di+1];
-        color_result[3*ri+2] = p_color_buffer[4*di+2];
+    void const *light_props_raw_buffer;
+
+    // read numpy buffers
+    if (PyObject_AsReadBuffer(proj_matrices.ptr(), &proj_raw_buffer, &proj_buflen) ||
+        PyObject_AsReadBuffer(light_props.ptr(), &light_props_raw_buffer, &light_props_buflen)) {
+      boost::python::throw_error_already_set();
+    }
+
+    // cast numpy buffers to C arrays
+    const double* proj_buffer = reinterpret_cast<const double*>(proj_raw_buffer);
+    const double* light_props_buffer = reinterpret_cast<const double*>(light_props_raw_buffer);
+
+    // compute the number of poses and the lighting buffer stride
+    unsigned int num_projections = proj_buflen / (12 * sizeof(double));
+    unsigned int num_light_props = light_props_buflen / (light_props_len * sizeof(double));
+    unsigned int light_props_stride = light_props_len;
+    if (num_light_props == 1) {
+      light_props_stride = 0;
+    }
+    else if (num_light_props != num_projections) {
+      PyErr_SetString(PyExc_ValueError, "Lighting properties must be given once or for each projection");
+      boost::python::throw_error_already_set();
+    }
+
+    // read colors
+    double final_matrix[16];
+    double model_matrix[16];
+    std::vector<unsigned char> colorBytes(3 * num_objects);
+    for (unsigned int m = 0; m < num_objects; m++) {
+      for (int c = 0; c < 3; c++) {
+        colorBytes[3*m+c] = (unsigned char)mat_props_buffer[m * mat_props_len + c];
       }
+      if (debug) {
+        std::cout << "Mesh handle " << mesh_handles[m] << std::endl;
+        std::cout << "Color " << (int)colorBytes[3*m] << " " << (int)colorBytes[3*m+1] << " " << (int)colorBytes[3*m+2] << std::endl;
+      }
+    }
+    if (debug) {
+      std::cout << "Num projections " << num_projections << std::endl;
+    }
+
+    // lighting does not affect masks
+    bool render_color = render_flags & RENDER_COLOR;
+    bool render_depth = render_flags & RENDER_DEPTH;
+    bool render_mask = render_flags & RENDER_MASK;
+    if (render_mask && !render_color) {
+      enable_lighting = false;
+    }
+
+    // allocate the output images
+    boost::python::object color_ims;
+    boost::python::object depth_ims;
+    boost::python::object mask_ims;
+    unsigned char* color_result = NULL;
+    float* depth_result = NULL;
+    unsigned char* mask_result = NULL;
+    unsigned int num_pixels = im_height_ * im_width_;
+    if (render_color) {
+      color_result = reinterpret_cast<unsigned char*>(output_data(color_out, boost::python::make_tuple(num_projections, im_height_, im_width_, 3),
+                                                                  boost::numpy::dtype::get_builtin<unsigned char>(), color_ims));
+    }
+    if (render_depth) {
+      depth_result = reinterpret_cast<float*>(output_data(depth_out, boost::python::make_tuple(num_projections, im_height_, im_width_),
+                                                          boost::numpy::dtype::get_builtin<float>(), depth_ims));
+    }
+    if (render_mask) {
+      mask_result = reinterpret_cast<unsigned char*>(output_data(mask_out, boost::python::make_tuple(num_projections, im_height_, im_width_),
+                                                                 boost::numpy::dtype::get_builtin<unsigned char>(), mask_ims));
+    }
+
+    // the context may not be current if other renderers were used since the last call
+    make_current();
+
+    // setup lighting properties, which persist in the context until changed
+    if (enable_lighting) {
+      glEnable(GL_LIGHTING);
+      glEnable(GL_LIGHT0);
     }
+    else {
+      glDisable(GL_LIGHTING);
+      glDisable(GL_LIGHT0);
+    }
+
+    for (unsigned int k = 0; k < num_projections; k++) {
+      // load next projection matrix
+      const double* projection = proj_buffer + 12 * k;
+      if (debug) {
+        std::cout << "Proj Matrix " << k << std::endl;
+        std::cout << projection[0] << " " << projection[1] << " " << projection[2] << " " << projection[3] << std::endl;
+        std::cout << projection[4] << " " << projection[5] << " " << projection[6] << " " << projection[7] << std::endl;
+        std::cout << projection[8] << " " << projection[9] << " " << projection[10] << " " << projection[11] << std::endl;
+      }
 
-    // pull depth buffer and flip y axis
-    unsigned short* p_depth_buffer;
-    succeeded = OSMesaGetDepthBuffer(ctx, &out_width, &out_height, &bytes_per_depth, (void**)&p_depth_buffer);
-    if (depth_result == NULL)
-      depth_result = new float[out_width * out_height];
-    for(i = 0; i < out_width; i++){
-      for(j = 0; j < out_height; j++){
-        int di = i + j * out_width; // index in depth buffer
-        int ri = i + (out_height-1-j)*out_width; // index in rendered image
-        if (p_depth_buffer[di] == USHRT_MAX) {
-          depth_result[ri] = 0.0f;
+      // load projection and modelview matrices
+      compute_gl_projection(projection, im_height_, im_width_, final_matrix);
+      glMatrixMode(GL_PROJECTION);
+      glLoadMatrixd(final_matrix);
+      glMatrixMode(GL_MODELVIEW);
+      glLoadIdentity();
+
+      // load the lighting for the pose, in the frame of the projection
+      if (enable_lighting && (k == 0 || light_props_stride > 0)) {
+        set_light(light_props_buffer + k * light_props_stride, debug);
+      }
+
+      // render meshes, marking the pixels of each in the stencil buffer
+      glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT | GL_STENCIL_BUFFER_BIT);
+      for (unsigned int m = 0; m < num_objects; m++) {
+        if (model_buffer != NULL) {
+          for (int r = 0; r < 4; r++) {
+            for (int c = 0; c < 4; c++) {
+              model_matrix[4*c+r] = model_buffer[16*m + 4*r + c];
+            }
+          }
+          glLoadMatrixd(model_matrix);
         }
-        else {
-          depth_result[ri] = near / (1.0f - ((float)p_depth_buffer[di] / USHRT_MAX));
+        if (enable_lighting && (k == 0 || num_objects > 1)) {
+          set_material(mat_props_buffer + m * mat_props_len);
+        }
+        glStencilFunc(GL_ALWAYS, object_ids ? m + 1 : 255, 0xFF);
+        glColor3ubv(&colorBytes[3*m]);
+        glCallList(mesh_handles[m]);
+      }
+      glFinish();
+
+      unsigned int row_len = im_width_;
+
+      // copy the color buffer, which is stored top to bottom as packed RGB, into the output image
+      if (render_color) {
+        GLint out_width, out_height, color_format;
+        unsigned char* p_color_buffer;
+        OSMesaGetColorBuffer(ctx_, &out_width, &out_height, &color_format, (void**)&p_color_buffer);
+        memcpy(color_result + 3 * num_pixels * k, p_color_buffer, 3 * num_pixels * sizeof(unsigned char));
+      }
+
+      // copy the stencil buffer into the output mask and flip y axis
+      if (render_mask) {
+        unsigned char* mask_im = mask_result + num_pixels * k;
+        glReadPixels(0, 0, im_width_, im_height_, GL_STENCIL_INDEX, GL_UNSIGNED_BYTE, &stencil_buffer_[0]);
+        for (unsigned int j = 0; j < im_height_; j++) {
+          memcpy(mask_im + (im_height_-1-j) * row_len, &stencil_buffer_[j * row_len], row_len);
+        }
+      }
+
+      // linearize the depth buffer into the output image and flip y axis,
+      // where the far plane maps to zero
+      if (render_depth) {
+        float* depth_im = depth_result + num_pixels * k;
+        glReadPixels(0, 0, im_width_, im_height_, GL_DEPTH_COMPONENT, GL_FLOAT, &depth_buffer_[0]);
+        for (unsigned int j = 0; j < im_height_; j++) {
+          const float* depth_row = &depth_buffer_[j * row_len];
+          float* depth_im_row = depth_im + (im_height_-1-j) * row_len;
+          for (unsigned int i = 0; i < row_len; i++) {
+            depth_im_row[i] = depth_row[i] < 1.0f ? near / (1.0f - depth_row[i]) : 0.0f;
+          }
         }
       }
     }
 
-    // append ndarray color image to list
-    boost::python::tuple color_shape = boost::python::make_tuple(im_height, im_width, 3);
-    boost::numpy::dtype color_dt = boost::numpy::dtype::get_builtin<unsigned char>();
-    boost::numpy::ndarray color_arr = boost::numpy::from_data(color_result, color_dt, color_shape,
-                                                              boost::python::make_tuple(color_shape[1]*color_shape[2]*sizeof(unsigned char),
-                                                                                        color_shape[2]*sizeof(unsigned char),
-                                                                                        sizeof(unsigned char)),
-                                                              boost::python::object());
-    color_ims.append(color_arr.copy());
-
-    // append ndarray depth image to list
-    boost::python::tuple depth_shape = boost::python::make_tuple(im_height, im_width);
-    boost::numpy::dtype depth_dt = boost::numpy::dtype::get_builtin<float>();
-    boost::numpy::ndarray depth_arr = boost::numpy::from_data(depth_result, depth_dt, depth_shape,
-                                                              boost::python::make_tuple(depth_shape[1]*sizeof(float),
-                                                                                        sizeof(float)),
-                                                              boost::python::object());
-    depth_ims.append(depth_arr.copy());
+    return boost::python::make_tuple(color_ims, depth_ims, mask_ims);
   }
 
-  // free the image buffer
-  free( buffer );
+  // returns the data of a float64 array with the given number of rows of the given length
+  const void* read_buffer(boost::python::numeric::array arr, unsigned int row_len, unsigned int num_rows)
+  {
+    long int buflen;
+    void const *raw_buffer;
+    if (PyObject_AsReadBuffer(arr.ptr(), &raw_buffer, &buflen)) {
+      boost::python::throw_error_already_set();
+    }
+    if (buflen < (long int)(row_len * num_rows * sizeof(double))) {
+      PyErr_SetString(PyExc_ValueError, "Array is too small for the number of objects");
+      boost::python::throw_error_already_set();
+    }
+    return raw_buffer;
+  }
 
-  // destroy the context
-  OSMesaDestroyContext( ctx );
+  // returns an object as an array, checking that it is a C-contiguous Nx3 array
+  boost::numpy::ndarray mesh_array(boost::python::object obj, const char* name)
+  {
+    boost::python::extract<boost::numpy::ndarray> extract_arr(obj);
+    if (!extract_arr.check()) {
+      PyErr_Format(PyExc_ValueError, "%s must be a numpy array", name);
+      boost::python::throw_error_already_set();
+    }
+    boost::numpy::ndarray arr = extract_arr();
+    if (arr.get_nd() != 2 || arr.get_shape()[1] != 3 || !(arr.get_flags() & boost::numpy::ndarray::C_CONTIGUOUS)) {
+      PyErr_Format(PyExc_ValueError, "%s must be a C-contiguous Nx3 array", name);
+      boost::python::throw_error_already_set();
+    }
+    return arr;
+  }
 
-  //return depth_ims;
-  boost::python::tuple ret_tuple = boost::python::make_tuple(color_ims, depth_ims);
+  void check_open()
+  {
+    if (closed()) {
+      PyErr_SetString(PyExc_RuntimeError, "Renderer has been closed");
+      boost::python::throw_error_already_set();
+    }
+  }
 
-  if (color_result != NULL)
-    delete [] color_result;
-  if (depth_result != NULL)
-    delete [] depth_result;
+  // bind the buffer to the context and make it current
+  void make_current()
+  {
+    if (!OSMesaMakeCurrent( ctx_, buffer_, GL_UNSIGNED_BYTE, im_width_, im_height_ )) {
+      PyErr_SetString(PyExc_RuntimeError, "OSMesaMakeCurrent failed");
+      boost::python::throw_error_already_set();
+    }
+  }
 
-  return ret_tuple;
+  OSMesaContext ctx_;
+  void *buffer_;
+  unsigned int im_height_;
+  unsigned int im_width_;
+  std::vector<float> depth_buffer_;
+  std::vector<unsigned char> stencil_buffer_;
+  std::set<unsigned int> mesh_handles_;
+};
+
+// Render a mesh with a temporary renderer, kept for backwards compatibility
+boost::python::tuple render_mesh(boost::python::list proj_matrices,
+                                 unsigned int im_height,
+                                 unsigned int im_width,
+                                 boost::python::numeric::array verts,
+                                 boost::python::numeric::array tris,
+                                 boost::python::numeric::array norms,
+                                 boost::python::numeric::array mat_props,
+                                 boost::python::numeric::array light_props,
+				 bool enable_lighting = false,
+                                 bool debug = false)
+{
+  Renderer renderer(im_height, im_width);
+  unsigned int mesh_handle = renderer.upload_mesh(verts, tris, norms);
+
+  // stack the projection matrices
+  int num_projections = boost::python::len(proj_matrices);
+  boost::numpy::ndarray proj_arr = boost::numpy::empty(boost::python::make_tuple(num_projections, 3, 4),
+                                                       boost::numpy::dtype::get_builtin<double>());
+  double* proj_buffer = reinterpret_cast<double*>(proj_arr.get_data());
+  for (int k = 0; k < num_projections; k++) {
+    boost::python::object proj_matrix_obj(proj_matrices[k]);
+    long int proj_buflen;
+    void const *proj_raw_buffer;
+    if (PyObject_AsReadBuffer(proj_matrix_obj.ptr(), &proj_raw_buffer, &proj_buflen)) {
+      boost::python::throw_error_already_set();
+    }
+    memcpy(proj_buffer + 12 * k, proj_raw_buffer, 12 * sizeof(double));
+  }
+
+  // split the stacked images into lists
+  boost::python::tuple ims = renderer.render(mesh_handle,
+                                             boost::python::numeric::array(boost::python::detail::borrowed_reference(proj_arr.ptr())),
+                                             mat_props, light_props, RENDER_COLOR | RENDER_DEPTH,
+                                             enable_lighting, debug);
+  boost::python::list color_ims;
+  boost::python::list depth_ims;
+  for (int k = 0; k < num_projections; k++) {
+    color_ims.append(ims[0][k]);
+    depth_ims.append(ims[1][k]);
+  }
+  return boost::python::make_tuple(color_ims, depth_ims);
 }
 
 // Test function for multiplying an array by a scalar
@@ -392,4 +715,18 @@ BOOST_PYTHON_MODULE(meshrender) {
 
   def("mul_array", &mul_array);
   def("render_mesh", &render_mesh);
+
+  boost::python::scope().attr("RENDER_COLOR") = RENDER_COLOR;
+  boost::python::scope().attr("RENDER_DEPTH") = RENDER_DEPTH;
+  boost::python::scope().attr("RENDER_MASK") = RENDER_MASK;
+
+  boost::python::class_<Renderer, boost::noncopyable>("Renderer", boost::python::init<unsigned int, unsigned int>())
+    .def("upload_mesh", &Renderer::upload_mesh)
+    .def("release_mesh", &Renderer::release_mesh)
+    .def("render", &Renderer::render)
+    .def("render_scene", &Renderer::render_scene)
+    .def("close", &Renderer::close)
+    .add_property("height", &Renderer::height)
+    .add_property("width", &Renderer::width)
+    .add_property("closed", &Renderer::closed);
 }
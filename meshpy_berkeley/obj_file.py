@@ -3,6 +3,10 @@ File for loading and saving meshes from .OBJ files
 Author: Jeff Mahler
 """
 import os
+import warnings
+
+import numpy as np
+
 import mesh
 
 class ObjFile(object):
@@ -14,6 +18,7 @@ class ObjFile(object):
     filepath : :obj:`str`
         The full path to the .obj file associated with this reader/writer.
     """
+    BLOCK_SIZE = 2**16
 
     def __init__(self, filepath):
         """Construct and initialize a .obj file reader and writer.
@@ -47,62 +52,150 @@ class ObjFile(object):
     def read(self):
         """Reads in the .obj file and returns a Mesh3D representation of that mesh.
 
+        The file is streamed line by line, and the vertex, normal and face
+        lines are parsed in large blocks with NumPy into preallocated arrays
+        as soon as each block is full. Blocks that cannot be parsed this way
+        (e.g. extra vertex components, polygons or mixed face formats) fall
+        back to parsing line by line.
+
         Returns
         -------
         :obj:`Mesh3D`
             A Mesh3D created from the data in the .obj file.
         """
-        numVerts = 0  
-        verts = []
-        norms = None
-        faces = []
-        tex_coords = []
-        face_norms = []
+        # Look for obj tags (see http://en.wikipedia.org/wiki/Wavefront_.obj_file)
+        parsers = {'v': ObjFile._parse_floats,
+                   'vn': ObjFile._parse_floats,
+                   'f': ObjFile._parse_faces}
+        lines = dict([(tag, []) for tag in parsers.keys()])
+        blocks = dict([(tag, []) for tag in parsers.keys()])
         f = open(self.filepath_, 'r')
+        for line in f:
+            vals = line.split(None, 1)
+            if len(vals) < 2 or vals[0] not in parsers:
+                continue
+            tag_lines = lines[vals[0]]
+            tag_lines.append(vals[1])
+            if len(tag_lines) == ObjFile.BLOCK_SIZE:
+                blocks[vals[0]].append(parsers[vals[0]](tag_lines))
+                del tag_lines[:]
+        f.close()
+        for tag, tag_lines in lines.iteritems():
+            if len(tag_lines) > 0 or len(blocks[tag]) == 0:
+                blocks[tag].append(parsers[tag](tag_lines))
+
+        verts = np.concatenate(blocks['v'])
+        norms = np.concatenate(blocks['vn'])
+        if norms.shape[0] == 0:
+            norms = None
+        if all([isinstance(block, np.ndarray) for block in blocks['f']]):
+            faces = np.concatenate(blocks['f'])
+        else:
+            # polygons or mixed face formats
+            faces = []
+            for block in blocks['f']:
+                faces.extend(block if isinstance(block, list) else block.tolist())
+        return mesh.Mesh3D(verts, faces, norms)
+
+    @staticmethod
+    def _parse_floats(lines):
+        """Parses the first three values of each line of a block of lines,
+        with the tags removed.
+
+        Parameters
+        ----------
+        lines : :obj:`list` of :obj:`str`
+            The lines to parse.
 
-        for line in f:  
-            # Break up the line by whitespace
+        Returns
+        -------
+        :obj:`numpy.ndarray` of float
+            A #lines by 3 array of values.
+        """
+        values = np.zeros([len(lines), 3], dtype=np.float64)
+        data = ObjFile._fromstring(' '.join(lines), np.float64)
+        if data.shape[0] == 3 * len(lines):
+            values[:] = data.reshape(-1, 3)
+        else:
+            # lines with extra or missing components
+            values[:] = [map(float, line.split()[:3]) for line in lines]
+        return values
+
+    @staticmethod
+    def _parse_faces(lines):
+        """Parses the vertex indices of a block of face lines with the tags
+        removed, which may use the `v`, `v/vt`, `v/vt/vn` or `v//vn` forms.
+        Texture coordinate and normal indices are discarded.
+
+        Parameters
+        ----------
+        lines : :obj:`list` of :obj:`str`
+            The face lines to parse.
+
+        Returns
+        -------
+        :obj:`numpy.ndarray` of int or :obj:`list` of :obj:`list` of int
+            A #faces by 3 array of zero-based vertex indices, or a list of the
+            vertex indices of each face if not all faces are triangles.
+        """
+        faces = np.zeros([len(lines), 3], dtype=np.int32)
+        if len(lines) == 0:
+            return faces
+
+        # number of fields per face vertex, from the first face
+        first_vertex = lines[0].split()[0]
+        num_fields = first_vertex.count('/') + 1
+
+        text = ' '.join(lines)
+        if num_fields > 1:
+            text = text.replace('//', '/0/').replace('/', ' ')
+        data = ObjFile._fromstring(text, np.int32)
+        if data.shape[0] != 3 * num_fields * len(lines):
+            # polygons or mixed face formats
+            return ObjFile._parse_faces_slow(lines)
+        faces[:] = data.reshape(-1, 3 * num_fields)[:,::num_fields] - 1
+        return faces
+
+    @staticmethod
+    def _parse_faces_slow(lines):
+        """Parses the vertex indices of face lines one at a time.
+
+        Parameters
+        ----------
+        lines : :obj:`list` of :obj:`str`
+            The face lines to parse, with the tags removed.
+
+        Returns
+        -------
+        :obj:`list` of :obj:`list` of int
+            The zero-based vertex indices of each face.
+        """
+        faces = []
+        for line in lines:
             vals = line.split()
-            if len(vals) > 0:
-                # Look for obj tags (see http://en.wikipedia.org/wiki/Wavefront_.obj_file)
-                if vals[0] == 'v':
-                    # Add vertex
-                    v = map(float, vals[1:4])
-                    verts.append(v)
-                if vals[0] == 'vn':
-                    # Add normal
-                    if norms is None:
-                        norms = []
-                    n = map(float, vals[1:4])
-                    norms.append(n)  
-                if vals[0] == 'f':
-                    # Add faces (includes vertex indices, texture coordinates, and normals)
-                    vi = []
-                    vti = []
-                    nti = []
-                    if vals[1].find('/') == -1:
-                        vi = map(int, vals[1:])
-                        vi = [i - 1 for i in vi]
-                    else:
-                        for j in range(1, len(vals)):
-                            # Break up like by / to read vert inds, tex coords, and normal inds
-                            val = vals[j]
-                            tokens = val.split('/')
-                            for i in range(len(tokens)):
-                                if i == 0:
-                                    vi.append(int(tokens[i]) - 1) # adjust for python 0 - indexing
-                                elif i == 1:
-                                    if tokens[i] != '':
-                                        vti.append(int(tokens[i]))
-                                elif i == 2:
-                                    nti.append(int(tokens[i]))
-                    faces.append(vi)
-                    # Below two lists are currently not in use
-                    tex_coords.append(vti)
-                    face_norms.append(nti)
-        f.close()
+            # Break up each vertex by / to read vert inds, tex coords, and normal inds
+            faces.append([int(val.split('/')[0]) - 1 for val in vals])
+        return faces
 
-        return mesh.Mesh3D(verts, faces, norms)
+    @staticmethod
+    def _fromstring(text, dtype):
+        """Parses whitespace-separated numbers, stopping at the first invalid token.
+
+        Parameters
+        ----------
+        text : :obj:`str`
+            The text to parse.
+        dtype : :obj:`numpy.dtype`
+            The type of the numbers.
+
+        Returns
+        -------
+        :obj:`numpy.ndarray`
+            The numbers parsed before the first invalid token.
+        """
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            return np.fromstring(text, dtype=dtype, sep=' ')
 
     def write(self, mesh):
         """Writes a Mesh3D object out to a .obj file format
@@ -2,17 +2,16 @@
 Random variables for sampling camera poses
 Author: Jeff Mahler
 """
-import copy
 import logging
 
 import numpy as np
 import scipy.stats as ss
 
-from autolab_core import Point, RigidTransform, RandomVariable
-from autolab_core.utils import sph2cart, cart2sph
+from autolab_core import RigidTransform, RandomVariable
 from perception import CameraIntrinsics, BinaryImage, ColorImage, DepthImage, ObjectRender, RenderMode
 
-from mesh_renderer import VirtualCamera, SceneObject
+from mesh_renderer import VirtualCamera, SceneObject, RigidTransformArray, CameraIntrinsicsArray, \
+    _viewsphere_poses, _shifted_optical_centers
 
 class CameraSample(object):
     """ Struct to encapsulate the results of sampling a camera and its pose. """
@@ -35,6 +34,42 @@ class CameraSample(object):
     def T_camera_world(self):
         return self.object_to_camera_pose.inverse().as_frames(self.camera_intr.frame, 'world')
 
+class CameraSampleBatch(object):
+    """ A batch of camera samples stored as arrays of the sampled parameters,
+    poses and intrinsics. CameraSample objects are only created when the batch
+    is indexed or iterated.
+    """
+    def __init__(self, object_to_camera_poses, camera_intrs,
+                 radius, elev, az, roll, tx, ty, focal, cx, cy):
+        self.object_to_camera_poses = object_to_camera_poses
+        self.camera_intrs = camera_intrs
+        self.radius = radius
+        self.elev = elev
+        self.az = az
+        self.roll = roll
+        self.tx = tx
+        self.ty = ty
+        self.focal = focal
+        self.cx = cx
+        self.cy = cy
+
+    def __len__(self):
+        return self.radius.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return CameraSampleBatch(self.object_to_camera_poses[key], self.camera_intrs[key],
+                                     self.radius[key], self.elev[key], self.az[key], self.roll[key],
+                                     self.tx[key], self.ty[key], self.focal[key], self.cx[key], self.cy[key])
+        return CameraSample(self.object_to_camera_poses[key], self.camera_intrs[key],
+                            self.radius[key], self.elev[key], self.az[key], self.roll[key],
+                            tx=self.tx[key], ty=self.ty[key], focal=self.focal[key],
+                            cx=self.cx[key], cy=self.cy[key])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
 class RenderSample(object):
     """ Struct to encapsulate the results of sampling rendered images from a camera. """
     def __init__(self, renders, camera):
@@ -49,7 +84,7 @@ class UniformViewsphereRandomVariable(RandomVariable):
                  min_elev, max_elev,
                  min_az=0, max_az=2*np.pi,
                  min_roll=0, max_roll=2*np.pi,
-                 num_prealloc_samples=1):
+                 num_prealloc_samples=1, frame='camera'):
         """Initialize a ViewsphereDiscretizer.
 
         Parameters
@@ -73,8 +108,11 @@ class UniformViewsphereRandomVariable(RandomVariable):
             Maximum roll for camera.
         num_prealloc_samples : int
             Number of preallocated samples.
+        frame: :obj:`str`
+            string name of the camera frame
         """
         # read params
+        self.frame = frame
         self.min_radius = min_radius
         self.max_radius = max_radius
         self.min_az = min_az * np.pi
@@ -95,34 +133,41 @@ class UniformViewsphereRandomVariable(RandomVariable):
         
     def object_to_camera_pose(self, radius, elev, az, roll):
         """ Convert spherical coords to an object-camera pose. """
-        # generate camera center from spherical coords
-        camera_center_obj = np.array([sph2cart(radius, az, elev)]).squeeze()
-        camera_z_obj = -camera_center_obj / np.linalg.norm(camera_center_obj)
-
-        # find the canonical camera x and y axes
-        camera_x_par_obj = np.array([camera_z_obj[1], -camera_z_obj[0], 0])
-        if np.linalg.norm(camera_x_par_obj) == 0:
-            camera_x_par_obj = np.array([1, 0, 0])
-        camera_x_par_obj = camera_x_par_obj / np.linalg.norm(camera_x_par_obj)
-        camera_y_par_obj = np.cross(camera_z_obj, camera_x_par_obj)
-        camera_y_par_obj = camera_y_par_obj / np.linalg.norm(camera_y_par_obj)
-        if camera_y_par_obj[2] > 0:
-            camera_x_par_obj = -camera_x_par_obj
-            camera_y_par_obj = np.cross(camera_z_obj, camera_x_par_obj)
-            camera_y_par_obj = camera_y_par_obj / np.linalg.norm(camera_y_par_obj)
-
-        # rotate by the roll
-        R_obj_camera_par = np.c_[camera_x_par_obj, camera_y_par_obj, camera_z_obj]
-        R_camera_par_camera = np.array([[np.cos(roll), -np.sin(roll), 0],
-                                        [np.sin(roll), np.cos(roll), 0],
-                                        [0, 0, 1]])
-        R_obj_camera = R_obj_camera_par.dot(R_camera_par_camera)
-        t_obj_camera = camera_center_obj
-
-        # create final transform
-        T_obj_camera = RigidTransform(R_obj_camera, t_obj_camera,
-                                      from_frame=self.frame, to_frame='obj')
-        return T_obj_camera.inverse()
+        return self.object_to_camera_poses(np.array([radius]), np.array([elev]),
+                                           np.array([az]), np.array([roll]))[0]
+
+    def object_to_camera_poses(self, radius, elev, az, roll):
+        """ Convert arrays of spherical coords to object-camera poses. """
+        R_camera_obj, t_camera_obj = _viewsphere_poses(radius, elev, az, roll)
+        return RigidTransformArray(R_camera_obj, t_camera_obj,
+                                   from_frame='obj', to_frame=self.frame)
+
+    def _preallocate_samples(self):
+        """ Preallocate samples in a single batch. """
+        self.prealloc_samples_ = list(self.sample_batch(size=self.num_prealloc_samples_))
+
+    def sample_batch(self, size=1):
+        """ Sample a batch of poses, drawing all parameters and converting
+        them to poses at once.
+
+        Parameters
+        ----------
+        size : int
+            number of sample to take
+
+        Returns
+        -------
+        :obj:`RigidTransformArray`
+            sampled object to camera poses
+        """
+        # sample params
+        radius = self.rad_rv.rvs(size=size)
+        elev = self.elev_rv.rvs(size=size)
+        az = self.az_rv.rvs(size=size)
+        roll = self.roll_rv.rvs(size=size)
+
+        # convert to camera poses
+        return self.object_to_camera_poses(radius, elev, az, roll)
 
     def sample(self, size=1):
         """ Sample random variables from the model.
@@ -134,19 +179,10 @@ class UniformViewsphereRandomVariable(RandomVariable):
         
         Returns
         -------
-        :obj:`list` of :obj:`RigidTransform`
-            sampled object to camera poses
+        :obj:`RigidTransformArray`
+            sampled object to camera poses, or a single :obj:`RigidTransform` if size is 1
         """
-        samples = []
-        for i in range(size):
-            # sample params
-            radius = self.rad_rv.rvs(size=1)[0]
-            elev = self.elev_rv.rvs(size=1)[0]
-            az = self.az_rv.rvs(size=1)[0]
-            roll = self.roll_rv.rvs(size=1)[0]
-
-            # convert to camera pose
-            samples.append(self.object_to_camera_pose(radius, elev, az, roll))
+        samples = self.sample_batch(size=size)
 
         # not a list if only 1 sample
         if size == 1:
@@ -273,54 +309,79 @@ class UniformPlanarWorksurfaceRandomVariable(RandomVariable):
         
     def object_to_camera_pose(self, radius, elev, az, roll, x, y):
         """ Convert spherical coords to an object-camera pose. """
-        # generate camera center from spherical coords
-        delta_t = np.array([x, y, 0])
-        camera_center_obj = np.array([sph2cart(radius, az, elev)]).squeeze() + delta_t
-        camera_z_obj = -np.array([sph2cart(radius, az, elev)]).squeeze()
-        camera_z_obj = camera_z_obj / np.linalg.norm(camera_z_obj)
-        
-        # find the canonical camera x and y axes
-        camera_x_par_obj = np.array([camera_z_obj[1], -camera_z_obj[0], 0])
-        if np.linalg.norm(camera_x_par_obj) == 0:
-            camera_x_par_obj = np.array([1, 0, 0])
-        camera_x_par_obj = camera_x_par_obj / np.linalg.norm(camera_x_par_obj)
-        camera_y_par_obj = np.cross(camera_z_obj, camera_x_par_obj)
-        camera_y_par_obj = camera_y_par_obj / np.linalg.norm(camera_y_par_obj)
-        if camera_y_par_obj[2] > 0:
-            camera_x_par_obj = -camera_x_par_obj
-            camera_y_par_obj = np.cross(camera_z_obj, camera_x_par_obj)
-            camera_y_par_obj = camera_y_par_obj / np.linalg.norm(camera_y_par_obj)
-
-        # rotate by the roll
-        R_obj_camera_par = np.c_[camera_x_par_obj, camera_y_par_obj, camera_z_obj]
-        R_camera_par_camera = np.array([[np.cos(roll), -np.sin(roll), 0],
-                                        [np.sin(roll), np.cos(roll), 0],
-                                        [0, 0, 1]])
-        R_obj_camera = R_obj_camera_par.dot(R_camera_par_camera)
-        t_obj_camera = camera_center_obj
-
-        # create final transform
-        T_obj_camera = RigidTransform(R_obj_camera, t_obj_camera,
-                                      from_frame=self.frame,
-                                      to_frame='obj')
-                            
-        return T_obj_camera.inverse()
+        return self.object_to_camera_poses(np.array([radius]), np.array([elev]),
+                                           np.array([az]), np.array([roll]),
+                                           np.array([x]), np.array([y]))[0]
+
+    def object_to_camera_poses(self, radius, elev, az, roll, x, y):
+        """ Convert arrays of spherical coords and plane translations to object-camera poses. """
+        R_camera_obj, t_camera_obj = _viewsphere_poses(radius, elev, az, roll, x, y)
+        return RigidTransformArray(R_camera_obj, t_camera_obj,
+                                   from_frame='obj', to_frame=self.frame)
 
     def camera_intrinsics(self, T_camera_obj, f, cx, cy):
         """ Generate shifted camera intrinsics to simulate cropping """
-        # form intrinsics
-        camera_intr = CameraIntrinsics(self.frame, fx=f, fy=f,
-                                       cx=cx, cy=cy, skew=0.0,
+        poses = RigidTransformArray(T_camera_obj.rotation[np.newaxis,:,:],
+                                    T_camera_obj.translation[np.newaxis,:],
+                                    from_frame='obj', to_frame=self.frame)
+        return self.shifted_camera_intrinsics(poses, np.array([f]), np.array([cx]), np.array([cy]))[0]
+
+    def shifted_camera_intrinsics(self, object_to_camera_poses, f, cx, cy):
+        """ Generate shifted camera intrinsics to simulate cropping for arrays
+        of object to camera poses, focal lengths and optical centers. """
+        camera_intr = CameraIntrinsics(self.frame, fx=1.0, fy=1.0,
+                                       cx=0.0, cy=0.0, skew=0.0,
                                        height=self.im_height, width=self.im_width)
+        K = np.tile(np.eye(3), [f.shape[0], 1, 1])
+        K[:,0,0] = f
+        K[:,1,1] = f
+        K[:,0,2] = cx
+        K[:,1,2] = cy
+
+        # compute new camera centers by projecting object 0,0,0 into the cameras
+        shifted_cx, shifted_cy = _shifted_optical_centers(K, object_to_camera_poses.translations)
+        return CameraIntrinsicsArray(camera_intr, shifted_cx, shifted_cy, fx=f, fy=f)
+
+    def _preallocate_samples(self):
+        """ Preallocate samples in a single batch. """
+        self.prealloc_samples_ = list(self.sample_batch(size=self.num_prealloc_samples_))
 
-        # compute new camera center by projecting object 0,0,0 into the camera
-        center_obj_obj = Point(np.zeros(3), frame='obj')
-        center_obj_camera = T_camera_obj * center_obj_obj
-        u_center_obj = camera_intr.project(center_obj_camera)
-        camera_shifted_intr = copy.deepcopy(camera_intr)
-        camera_shifted_intr.cx = 2 * camera_intr.cx - float(u_center_obj.x)
-        camera_shifted_intr.cy = 2 * camera_intr.cy - float(u_center_obj.y)
-        return camera_shifted_intr
+    def sample_batch(self, size=1):
+        """ Sample a batch of cameras, drawing all parameters and converting
+        them to poses and intrinsics at once.
+
+        Parameters
+        ----------
+        size : int
+            number of sample to take
+
+        Returns
+        -------
+        :obj:`CameraSampleBatch`
+            sampled camera poses and intrinsics
+        """
+        # sample camera params
+        focal = self.focal_rv.rvs(size=size)
+        cx = self.cx_rv.rvs(size=size)
+        cy = self.cy_rv.rvs(size=size)
+
+        # sample viewsphere params
+        radius = self.rad_rv.rvs(size=size)
+        elev = self.elev_rv.rvs(size=size)
+        az = self.az_rv.rvs(size=size)
+        roll = self.roll_rv.rvs(size=size)
+
+        # sample plane translation
+        tx = self.tx_rv.rvs(size=size)
+        ty = self.ty_rv.rvs(size=size)
+        logging.debug('Sampled %d camera poses' %(size))
+
+        # convert to poses and intrinsics
+        object_to_camera_poses = self.object_to_camera_poses(radius, elev, az, roll, tx, ty)
+        camera_shifted_intrs = self.shifted_camera_intrinsics(object_to_camera_poses,
+                                                              focal, cx, cy)
+        return CameraSampleBatch(object_to_camera_poses, camera_shifted_intrs,
+                                 radius, elev, az, roll, tx, ty, focal, cx, cy)
 
     def sample(self, size=1):
         """ Sample random variables from the model.
@@ -332,52 +393,10 @@ class UniformPlanarWorksurfaceRandomVariable(RandomVariable):
         
         Returns
         -------
-        :obj:`list` of :obj:`RigidTransform`
-            sampled object to camera poses
+        :obj:`CameraSampleBatch`
+            sampled camera poses and intrinsics, or a single :obj:`CameraSample` if size is 1
         """
-        samples = []
-        for i in range(size):
-            # sample camera params
-            focal = self.focal_rv.rvs(size=1)[0]
-            cx = self.cx_rv.rvs(size=1)[0]
-            cy = self.cy_rv.rvs(size=1)[0]
-
-            # sample viewsphere params
-            radius = self.rad_rv.rvs(size=1)[0]
-            elev = self.elev_rv.rvs(size=1)[0]
-            az = self.az_rv.rvs(size=1)[0]
-            roll = self.roll_rv.rvs(size=1)[0]
-
-            # sample plane translation
-            tx = self.tx_rv.rvs(size=1)[0]
-            ty = self.ty_rv.rvs(size=1)[0]
-
-            logging.debug('Sampled')
-
-            logging.debug('focal: %.3f' %(focal))
-            logging.debug('cx: %.3f' %(cx))
-            logging.debug('cy: %.3f' %(cy))
-
-            logging.debug('radius: %.3f' %(radius))
-            logging.debug('elev: %.3f' %(elev))
-            logging.debug('az: %.3f' %(az))
-            logging.debug('roll: %.3f' %(roll))
-
-            logging.debug('tx: %.3f' %(tx))
-            logging.debug('ty: %.3f' %(ty))
-
-            # convert to pose and intrinsics
-            object_to_camera_pose = self.object_to_camera_pose(radius, elev, az, roll,
-                                                               tx, ty)
-            camera_shifted_intr = self.camera_intrinsics(object_to_camera_pose,
-                                                         focal, cx, cy)
-            camera_sample = CameraSample(object_to_camera_pose,
-                                         camera_shifted_intr,
-                                         radius, elev, az, roll, tx=tx, ty=ty,
-                                         focal=focal, cx=cx, cy=cy)
-
-            # convert to camera pose
-            samples.append(camera_sample)
+        samples = self.sample_batch(size=size)
 
         # not a list if only 1 sample
         if size == 1:
@@ -481,24 +500,28 @@ class UniformPlanarWorksurfaceImageRandomVariable(RandomVariable):
         :obj:`list` of :obj:`RigidTransform`
             sampled object to camera poses
         """
-        samples = []
-        for i in range(size):
-            # sample camera params
-            camera_sample = self.ws_rv.sample(size=1)
+        # sample camera params
+        camera_samples = self.ws_rv.sample_batch(size=size)
 
-            # render images
-            camera = VirtualCamera(camera_sample.camera_intr)
+        # render the images of all samples at once with their own intrinsics
+        camera = VirtualCamera(camera_samples.camera_intrs[0])
+        if self.scene_objs is not None:
             for name, scene_obj in self.scene_objs.iteritems():
                 camera.add_to_scene(name, scene_obj)
 
+        images = {}
+        for render_mode in self.render_modes:
+            images[render_mode] = camera.wrapped_images(self.mesh,
+                                                        camera_samples.object_to_camera_poses,
+                                                        render_mode, stable_pose=self.stable_pose,
+                                                        camera_intrinsics=camera_samples.camera_intrs)
+        camera.close()
+
+        samples = []
+        for i, camera_sample in enumerate(camera_samples):
             image_bundle = {}
             for render_mode in self.render_modes:
-                images = camera.wrapped_images(self.mesh,
-                                               [camera_sample.object_to_camera_pose],
-                                               render_mode, stable_pose=self.stable_pose)
-                image_bundle[render_mode] = images[0]
-
-            # convert to camera pose
+                image_bundle[render_mode] = images[render_mode][i]
             samples.append(RenderSample(image_bundle, camera_sample))
 
         # not a list if only 1 sample
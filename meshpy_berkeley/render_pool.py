@@ -0,0 +1,334 @@
+"""
+Pool of worker processes for rendering large sets of poses in parallel
+Author: Jeff Mahler
+"""
+import logging
+import multiprocessing
+import numpy as np
+import os
+import shutil
+import tempfile
+import weakref
+
+from perception import CameraIntrinsics
+
+from bmesh_file import BinaryMeshFile
+from mesh_renderer import VirtualCamera, SceneObject
+
+# per-process state of the pool workers
+_worker_cameras = {}
+_worker_meshes = []
+
+class RenderPool(object):
+    """A pool of worker processes that render ObjectRenders of meshes in parallel.
+
+    The poses are split into contiguous shards that are rendered by the workers,
+    each of which keeps its own VirtualCamera for each image size, and therefore
+    its own persistent OSMesa contexts and uploaded geometry, for the lifetime
+    of the pool.
+    Meshes are passed to the workers as memory-mapped binary mesh files in
+    shared memory, so every worker maps the same copy of the mesh arrays.
+
+    The wrapped rendering methods have the same signatures as those of
+    VirtualCamera, so a RenderPool can be used in place of a VirtualCamera
+    to parallelize existing pipelines.
+    """
+    MAX_WORKER_MESHES = 8
+    SHARDS_PER_WORKER = 4
+
+    def __init__(self, camera_intr, num_workers=None, shm_dir='/dev/shm'):
+        """Initialize a render pool.
+
+        Parameters
+        ----------
+        camera_intr : :obj:`CameraIntrinsics`
+            The CameraIntrinsics object used to parametrize the virtual cameras.
+        num_workers : int
+            The number of worker processes, or None to use one per CPU.
+        shm_dir : :obj:`str`
+            The directory to store shared mesh files in. The system temporary
+            directory is used if it does not exist.
+
+        Raises
+        ------
+        ValueError
+            When camera_intr is not a CameraIntrinsics object.
+        """
+        if not isinstance(camera_intr, CameraIntrinsics):
+            raise ValueError('Must provide camera intrinsics as a CameraIntrinsics object')
+        if num_workers is None:
+            num_workers = multiprocessing.cpu_count()
+        if shm_dir is None or not os.path.isdir(shm_dir):
+            shm_dir = None
+        self._camera_intr = camera_intr
+        self._scene = {}
+        self._num_workers = num_workers
+        self._mesh_dir = tempfile.mkdtemp(prefix='meshpy_render_', dir=shm_dir)
+        self._mesh_files = {}
+        self._mesh_file_count = 0
+        self._pool = multiprocessing.Pool(num_workers, _init_worker)
+
+    @property
+    def num_workers(self):
+        """int : The number of worker processes.
+        """
+        return self._num_workers
+
+    def close(self):
+        """ Stop the worker processes and remove the shared mesh files.
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        if os.path.exists(self._mesh_dir):
+            shutil.rmtree(self._mesh_dir)
+        self._mesh_files = {}
+
+    def add_to_scene(self, name, scene_object):
+        """ Add an object to the scene.
+
+        Parameters
+        ---------
+        name : :obj:`str`
+            name of object in the scene
+        scene_object : :obj:`SceneObject`
+            object to add to the scene
+        """
+        self._scene[name] = scene_object
+
+    def remove_from_scene(self, name):
+        """ Remove an object to a from the scene.
+
+        Parameters
+        ---------
+        name : :obj:`str`
+            name of object to remove
+        """
+        self._scene[name] = None
+
+    def mesh_file(self, mesh):
+        """ Returns the path of the shared binary mesh file of a mesh, writing
+        the file if it has not been written yet or the mesh has changed since.
+
+        Parameters
+        ----------
+        mesh : :obj:`Mesh3D`
+            The mesh to be rendered.
+
+        Returns
+        -------
+        :obj:`str`
+            The full path to the shared mesh file.
+        """
+        # compute normals once instead of in every worker
+        if mesh.normals is None:
+            mesh.compute_vertex_normals()
+
+        # reuse the file if the mesh arrays are the same objects
+        entry = self._mesh_files.get(id(mesh))
+        if entry is not None:
+            mesh_ref, arrays, filename = entry
+            if mesh_ref() is mesh and arrays[0] is mesh.vertices and \
+               arrays[1] is mesh.triangles and arrays[2] is mesh.normals:
+                return filename
+            os.remove(filename)
+            del self._mesh_files[id(mesh)]
+
+        # remove files of deleted meshes
+        for key, (mesh_ref, arrays, filename) in self._mesh_files.items():
+            if mesh_ref() is None:
+                os.remove(filename)
+                del self._mesh_files[key]
+
+        # file names are never reused, so workers can cache meshes by name
+        filename = os.path.join(self._mesh_dir, 'mesh_%d.bmesh' %(self._mesh_file_count))
+        self._mesh_file_count += 1
+        BinaryMeshFile(filename).write(mesh)
+        self._mesh_files[id(mesh)] = (weakref.ref(mesh), (mesh.vertices, mesh.triangles, mesh.normals), filename)
+        return filename
+
+    def wrapped_images(self, mesh, object_to_camera_poses,
+                       render_mode, stable_pose=None, mat_props=None,
+                       light_props=None, debug=False, camera_intrinsics=None):
+        """Create ObjectRender objects of the given mesh at the list of object to camera poses,
+        rendering shards of the poses in parallel.
+
+        Parameters
+        ----------
+        mesh : :obj:`Mesh3D`
+            The mesh to be rendered.
+        object_to_camera_poses : :obj:`list` of :obj:`RigidTransform`
+            A list of object to camera transforms to render from.
+        render_mode : int
+            One of RenderMode.COLOR, RenderMode.DEPTH, or
+            RenderMode.SCALED_DEPTH.
+        stable_pose : :obj:`StablePose`
+            A stable pose to render the object in.
+        mat_props : :obj:`MaterialProperties`
+            Material properties for the mesh
+        light_props : :obj:`MaterialProperties`
+            Lighting properties for the scene
+        debug : bool
+            Whether or not to debug the C++ meshrendering code.
+        camera_intrinsics : :obj:`list` of :obj:`CameraIntrinsics`
+            The intrinsics to render each pose with, which must have the image
+            size of the camera. If None, the camera intrinsics are used for all poses.
+
+        Returns
+        -------
+        :obj:`list` of :obj:`ObjectRender`
+            A list of ObjectRender objects generated from the given parameters, in pose order.
+        """
+        if camera_intrinsics is None:
+            camera_intrinsics = [self._camera_intr] * len(object_to_camera_poses)
+        return self._render(mesh, object_to_camera_poses, camera_intrinsics,
+                            render_mode, stable_pose, mat_props, light_props, debug)
+
+    def wrapped_images_viewsphere(self, mesh, vs_disc, render_mode, stable_pose=None, mat_props=None, light_props=None):
+        """Create ObjectRender objects of the given mesh around a viewsphere.
+
+        Parameters
+        ----------
+        mesh : :obj:`Mesh3D`
+            The mesh to be rendered.
+        vs_disc : :obj:`ViewsphereDiscretizer`
+            A discrete viewsphere from which we draw object to camera
+            transforms.
+        render_mode : int
+            One of RenderMode.COLOR, RenderMode.DEPTH, or
+            RenderMode.SCALED_DEPTH.
+        stable_pose : :obj:`StablePose`
+            A stable pose to render the object in.
+        mat_props : :obj:`MaterialProperties`
+            Material properties for the mesh
+        light_props : :obj:`MaterialProperties`
+            Lighting properties for the scene
+
+        Returns
+        -------
+        :obj:`list` of :obj:`ObjectRender`
+            A list of ObjectRender objects generated from the given parameters.
+        """
+        return self.wrapped_images(mesh, vs_disc.object_to_camera_poses(), render_mode, stable_pose=stable_pose, mat_props=mat_props, light_props=light_props)
+
+    def wrapped_images_planar_worksurface(self, mesh, ws_disc, render_mode, stable_pose=None, mat_props=None, light_props=None):
+        """ Create ObjectRender objects of the given mesh around a viewsphere and
+        a planar worksurface, where translated objects project into the center of
+        the  camera.
+
+        Parameters
+        ----------
+        mesh : :obj:`Mesh3D`
+            The mesh to be rendered.
+        ws_disc : :obj:`PlanarWorksurfaceDiscretizer`
+            A discrete viewsphere and translations in plane from which we draw
+            object to camera transforms.
+        render_mode : int
+            One of RenderMode.COLOR, RenderMode.DEPTH, or
+            RenderMode.SCALED_DEPTH.
+        stable_pose : :obj:`StablePose`
+            A stable pose to render the object in.
+        mat_props : :obj:`MaterialProperties`
+            Material properties for the mesh
+        light_props : :obj:`MaterialProperties`
+            Lighting properties for the scene
+
+        Returns
+        -------
+        :obj:`list` of :obj:`ObjectRender`
+            A list of ObjectRender objects generated from the given parameters.
+        :obj:`list` of :obj:`RigidTransform`
+            A list of the transformations from object frame to camera frame used
+            for rendering the images.
+        :obj:`list` of :obj:`CameraIntrinsics`
+            A list of the camera intrinsics used for rendering the images.
+        """
+        object_to_camera_poses, object_to_camera_normalized_poses, shifted_camera_intrinsics = ws_disc.object_to_camera_poses(self._camera_intr)
+        logging.info('Rendering %d images' %(len(object_to_camera_poses)))
+        images = self._render(mesh, object_to_camera_poses, shifted_camera_intrinsics,
+                              render_mode, stable_pose, mat_props, light_props, False)
+        return images, object_to_camera_poses, shifted_camera_intrinsics
+
+    def _render(self, mesh, object_to_camera_poses, camera_intrinsics,
+                render_mode, stable_pose, mat_props, light_props, debug):
+        """ Renders shards of the poses on the workers and concatenates the
+        resulting ObjectRenders in pose order.
+        """
+        if self._pool is None:
+            raise ValueError('Render pool is closed')
+        num_poses = len(object_to_camera_poses)
+        if num_poses == 0:
+            return []
+
+        # share the mesh and scene geometry through mapped files
+        mesh_filename = self.mesh_file(mesh)
+        scene = {}
+        for name, scene_obj in self._scene.iteritems():
+            if scene_obj is not None:
+                scene[name] = (self.mesh_file(scene_obj.mesh), scene_obj.T_mesh_world, scene_obj.mat_props)
+
+        # split into contiguous shards, several per worker to balance the load
+        num_shards = min(num_poses, RenderPool.SHARDS_PER_WORKER * self._num_workers)
+        bounds = np.linspace(0, num_poses, num_shards + 1).astype(np.int64)
+        tasks = []
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            tasks.append((mesh_filename, scene,
+                          object_to_camera_poses[start:stop],
+                          camera_intrinsics[start:stop],
+                          render_mode, stable_pose, mat_props, light_props, debug))
+
+        images = []
+        for shard_images in self._pool.map(_render_shard, tasks, chunksize=1):
+            images.extend(shard_images)
+        return images
+
+def _init_worker():
+    """ Resets the per-process state of a pool worker.
+    """
+    global _worker_cameras, _worker_meshes
+    _worker_cameras = {}
+    _worker_meshes = []
+
+def _worker_mesh(filename):
+    """ Returns the mapped mesh of a shared mesh file, keeping the most
+    recently used meshes so that their uploaded geometry is reused.
+    """
+    global _worker_meshes
+    for i, (mesh_filename, mesh) in enumerate(_worker_meshes):
+        if mesh_filename == filename:
+            _worker_meshes.append(_worker_meshes.pop(i))
+            return mesh
+    mesh = BinaryMeshFile(filename).read(mmap=True)
+    _worker_meshes.append((filename, mesh))
+    _worker_meshes = _worker_meshes[-RenderPool.MAX_WORKER_MESHES:]
+    return mesh
+
+def _render_shard(task):
+    """ Renders a shard of poses with the persistent camera of a worker
+    for the image size of the shard.
+    """
+    mesh_filename, scene, object_to_camera_poses, camera_intrinsics, \
+        render_mode, stable_pose, mat_props, light_props, debug = task
+    mesh = _worker_mesh(mesh_filename)
+
+    # the poses are rendered with their own intrinsics, so cameras only differ in image size
+    camera_intr = camera_intrinsics[0]
+    key = (camera_intr.height, camera_intr.width)
+    camera = _worker_cameras.get(key)
+    if camera is None:
+        camera = VirtualCamera(camera_intr)
+        _worker_cameras[key] = camera
+
+    # the scene of the shard is only kept on the camera while rendering
+    for name, (scene_mesh_filename, T_mesh_world, scene_mat_props) in scene.iteritems():
+        camera.add_to_scene(name, SceneObject(_worker_mesh(scene_mesh_filename),
+                                              T_mesh_world, mat_props=scene_mat_props))
+    try:
+        return camera.wrapped_images(mesh, object_to_camera_poses, render_mode,
+                                     stable_pose=stable_pose, mat_props=mat_props,
+                                     light_props=light_props, debug=debug,
+                                     camera_intrinsics=camera_intrinsics)
+    finally:
+        for name in scene.keys():
+            camera.remove_from_scene(name)
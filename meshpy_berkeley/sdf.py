@@ -5,6 +5,7 @@ Author: Sahaana Suri, Jeff Mahler, and Matt Matl
 **Currently assumes clean input**
 """
 from abc import ABCMeta, abstractmethod
+import copy
 import logging
 import numpy as np
 from numbers import Number
@@ -65,16 +66,20 @@ class Sdf:
         """Center of grid.
 
         This basically transforms the world frame to grid center.
+        Computed from the surface points on first use.
 
         Returns
         -------
         :obj:`numpy.ndarray`
         """
+        if self.center_ is None:
+            spts, _ = self.surface_points()
+            self.center_ = 0.5 * (np.min(spts, axis=0) + np.max(spts, axis=0))
         return self.center_
 
     @property
     def gradients(self):
-        """Gradients of the SDF.
+        """Gradients of the SDF, computed on first use.
 
         Returns
         -------
@@ -83,6 +88,8 @@ class Sdf:
             are in axis order and specify the gradients for that axis
             at each point.
         """
+        if len(self.gradients_) == 0:
+            self._compute_gradients()
         return self.gradients_
 
     @property
@@ -157,7 +164,7 @@ class Sdf:
     def center_world(self):
         """Center of grid (basically transforms world frame to grid center)
         """
-        return self.transform_pt_grid_to_obj(self.center_)
+        return self.transform_pt_grid_to_obj(self.center)
 
     def on_surface(self, coords):
         """Determines whether or not a point is on the object surface.
@@ -198,14 +205,11 @@ class Sdf:
     def _compute_gradients(self):
         """Computes the gradients of the SDF.
 
-        Returns
-        -------
-        :obj:`list` of :obj:`numpy.ndarray` of float
-            A list of ndarrays of the same dimension as the SDF. The arrays
-            are in axis order and specify the gradients for that axis
-            at each point.
+        The gradients are stored in place in the gradients_ list, which is
+        shared by all SDFs that wrap the same data (e.g. through transform
+        and rescale), so they are only computed once.
         """
-        self.gradients_ = np.gradient(self.data_)
+        self.gradients_[:] = np.gradient(self.data_)
 
 class Sdf3D(Sdf):
     # static indexing vars
@@ -218,23 +222,38 @@ class Sdf3D(Sdf):
     max_coords_z = [3, 5, 6, 7]
 
     # def __init__(self, sdf_data, origin, resolution, use_abs=True, T_sdf_world=RigidTransform(from_frame='sdf', to_frame='world')):
-    def __init__(self, sdf_data, origin, resolution, use_abs=False, T_sdf_world=RigidTransform(from_frame='sdf', to_frame='world')):
+    def __init__(self, sdf_data, origin, resolution, use_abs=False, T_sdf_world=RigidTransform(from_frame='sdf', to_frame='world'),
+                 dtype=None):
+        # optionally store the data and gradients with less precision
+        if dtype is not None:
+            sdf_data = sdf_data.astype(dtype, copy=False)
         self.data_ = sdf_data
         self.origin_ = origin
         self.resolution_ = resolution
         self.dims_ = self.data_.shape
 
-        # set up surface params
+        # set up surface params, the center and gradients are computed lazily
         self.surface_thresh_ = self.resolution_ * np.sqrt(2) / 2 # resolution is max dist from surface when surf is orthogonal to diagonal grid cells
-        spts, _ = self.surface_points()
-        self.center_ = 0.5 * (np.min(spts, axis=0) + np.max(spts, axis=0))
-        self.points_buf_ = np.zeros([Sdf3D.num_interpolants, 3], dtype=np.int)
-        self.coords_buf_ = np.zeros([3,])
+        self.center_ = None
+        self.gradients_ = []
         self.pts_ = None
 
+        self._set_pose(T_sdf_world)
+
+        # optionally use only the absolute values (useful for non-closed meshes in 3D)
+        self.use_abs_ = use_abs
+        if use_abs:
+            self.data_ = np.abs(self.data_)
+
+    def _set_pose(self, T_sdf_world):
+        """Sets up the transforms between the grid, sdf and world frames.
+
+        Parameters
+        ----------
+        T_sdf_world : :obj:`autolab_core.RigidTransform`
+            pose of the sdf in the world frame
+        """
         # tranform sdf basis to grid (X and Z axes are flipped!)
-        t_world_grid = self.resolution_ * self.center_
-        s_world_grid = 1.0 / self.resolution_
         t_grid_sdf = self.origin / self.resolution
         self.T_grid_sdf_ = SimilarityTransform(translation=t_grid_sdf,
                                                scale=self.resolution,
@@ -247,15 +266,9 @@ class Sdf3D(Sdf):
         self.T_world_grid_ = self.T_grid_world_.inverse()
         self.T_world_sdf_ = self.T_sdf_world_.inverse()
 
-        # optionally use only the absolute values (useful for non-closed meshes in 3D)
-        self.use_abs_ = use_abs
-        if use_abs:
-            self.data_ = np.abs(self.data_)
-
-        self._compute_gradients()
-
     def transform(self, delta_T):
         """ Creates a new SDF with a given pose with respect to world coordinates.
+        The new SDF shares the data and gradients of this one.
 
         Parameters
         ----------
@@ -263,8 +276,9 @@ class Sdf3D(Sdf):
             transform from cur sdf to transformed sdf coords
         """
         new_T_sdf_world = self.T_sdf_world_ * delta_T.inverse().as_frames('sdf', 'sdf')
-        return Sdf3D(self.data_, self.origin_, self.resolution_, use_abs=self.use_abs_,
-                     T_sdf_world=new_T_sdf_world)
+        sdf = copy.copy(self)
+        sdf._set_pose(new_T_sdf_world)
+        return sdf
 
     def _signed_distance(self, coords):
         """Returns the signed distance at the given coordinates, interpolating
@@ -286,44 +300,213 @@ class Sdf3D(Sdf):
         IndexError
             If the coords vector does not have three entries.
         """
-        pass
         if len(coords) != 3:
             raise IndexError('Indexing must be 3 dimensional') 
-        if self.is_out_of_bounds(coords):
+        return self.signed_distances(np.array([coords], dtype=np.float64))[0]
+
+    def _snap_to_cells(self, coords, dims):
+        """Snaps points to the given grid dims and finds the grid cells that contain them.
+
+        Parameters
+        ----------
+        coords : :obj:`numpy.ndarray` of float
+            An Nx3 ndarray of coordinates in the grid.
+        dims : :obj:`tuple` of int
+            The dimensions of the grid.
+
+        Returns
+        -------
+        :obj:`numpy.ndarray` of int
+            An Nx3 ndarray of the min corner of the cell containing each point.
+        :obj:`numpy.ndarray` of bool
+            An Nx3 ndarray that is False along the axes where the max corner of
+            the cell is out of bounds, which only happens when the point lies on
+            the max face of the grid and the max corner has zero weight.
+        :obj:`numpy.ndarray` of float
+            An Nx3 ndarray of the offsets of the points from the min corners.
+
+        Raises
+        ------
+        IndexError
+            If the coords array is not Nx3.
+        """
+        coords = np.asarray(coords, dtype=np.float64)
+        if coords.ndim != 2 or coords.shape[1] != 3:
+            raise IndexError('Indexing must be 3 dimensional')
+        max_coords = np.array(dims) - 1
+        if (coords < 0).any() or (coords > max_coords).any():
             logging.debug('Out of bounds access. Snapping to SDF dims')
 
         # snap to grid dims
-        self.coords_buf_[0] = max(0, min(coords[0], self.dims_[0] - 1))
-        self.coords_buf_[1] = max(0, min(coords[1], self.dims_[1] - 1))
-        self.coords_buf_[2] = max(0, min(coords[2], self.dims_[2] - 1))
-
-        # regular indexing if integers
-        if type(coords[0]) is int and type(coords[1]) is int and type(coords[2]) is int:
-            self.coords_buf_ = self.coords_buf_.astype(np.int)
-            return self.data_[self.coords_buf_[0], self.coords_buf_[1], self.coords_buf_[2]]
-
-        # otherwise interpolate
-        min_coords = np.floor(self.coords_buf_)
-        max_coords = min_coords + 1 # assumed to be on grid
-        self.points_buf_[Sdf3D.min_coords_x, 0] = min_coords[0]
-        self.points_buf_[Sdf3D.max_coords_x, 0] = max_coords[0]
-        self.points_buf_[Sdf3D.min_coords_y, 1] = min_coords[1]
-        self.points_buf_[Sdf3D.max_coords_y, 1] = max_coords[1]
-        self.points_buf_[Sdf3D.min_coords_z, 2] = min_coords[2]
-        self.points_buf_[Sdf3D.max_coords_z, 2] = max_coords[2]
-
-        # bilinearly interpolate points
-        sd = 0.0
-        for i in range(Sdf3D.num_interpolants):
-            p = self.points_buf_[i,:]
-            if self.is_out_of_bounds(p):
-                v = 0.0
-            else:
-                v = self.data_[p[0], p[1], p[2]]
-            w = np.prod(-np.abs(p - self.coords_buf_) + 1)
-            sd = sd + w * v
+        coords = np.clip(coords, 0, max_coords)
+        min_coords = np.floor(coords)
+        t = coords - min_coords
+        min_coords = min_coords.astype(np.int64)
+        return min_coords, min_coords < max_coords, t
 
-        return sd
+    def _grid_cells(self, coords, dims=None):
+        """Snaps points to the SDF dims and finds the grid cells that contain them.
+
+        Parameters
+        ----------
+        coords : :obj:`numpy.ndarray` of float
+            An Nx3 ndarray of coordinates in the grid.
+        dims : :obj:`tuple` of int
+            The dimensions of the grid, or None to use the SDF dims.
+
+        Returns
+        -------
+        :obj:`numpy.ndarray` of int
+            An N ndarray of the flat indices of the min corner of each cell.
+        :obj:`numpy.ndarray` of int
+            An Nx3 ndarray of the flat index offsets from the min corner to the
+            max corner of each cell along each axis. The offsets are zero where
+            the max corner is out of bounds, which only happens when the point
+            lies on the max face of the grid and the max corner has zero weight.
+        :obj:`numpy.ndarray` of float
+            An Nx3 ndarray of the offsets of the points from the min corners.
+
+        Raises
+        ------
+        IndexError
+            If the coords array is not Nx3.
+        """
+        if dims is None:
+            dims = self.dims_
+        min_coords, has_max, t = self._snap_to_cells(coords, dims)
+
+        # flat indices of the corners
+        strides = np.array([dims[1] * dims[2], dims[2], 1])
+        return min_coords.dot(strides), has_max * strides, t
+
+    def _interpolate(self, volume, cells, derivatives=False):
+        """Trilinearly interpolates a volume over the SDF grid within the given cells.
+
+        Parameters
+        ----------
+        volume : :obj:`numpy.ndarray` of float
+            A volume with the dimensions of the SDF.
+        cells : :obj:`tuple` of :obj:`numpy.ndarray`
+            The cells containing the query points, as returned by _grid_cells.
+        derivatives : bool
+            Whether to also return the derivatives of the interpolant.
+
+        Returns
+        -------
+        :obj:`numpy.ndarray` of float
+            An N ndarray of the interpolated values.
+        :obj:`numpy.ndarray` of float
+            An Nx3 ndarray of the derivatives of the interpolant along each
+            grid axis, only returned if derivatives is True.
+        """
+        i000, offsets, t = cells
+        v = volume.ravel()
+        dx, dy, dz = offsets[:,0], offsets[:,1], offsets[:,2]
+        tx, ty, tz = t[:,0], t[:,1], t[:,2]
+
+        # gather the corner values
+        i010 = i000 + dy
+        i100 = i000 + dx
+        i110 = i100 + dy
+        v000, v001 = v[i000], v[i000 + dz]
+        v010, v011 = v[i010], v[i010 + dz]
+        v100, v101 = v[i100], v[i100 + dz]
+        v110, v111 = v[i110], v[i110 + dz]
+
+        # interpolate along z, then y, then x
+        d00 = v001 - v000
+        d01 = v011 - v010
+        d10 = v101 - v100
+        d11 = v111 - v110
+        c00 = v000 + tz * d00
+        c01 = v010 + tz * d01
+        c10 = v100 + tz * d10
+        c11 = v110 + tz * d11
+        c0 = c00 + ty * (c01 - c00)
+        c1 = c10 + ty * (c11 - c10)
+        c = c0 + tx * (c1 - c0)
+        if not derivatives:
+            return c
+
+        # differentiate the interpolant along each axis
+        dc = np.zeros([c.shape[0], 3], dtype=c.dtype)
+        dc[:,0] = c1 - c0
+        dc_dy0 = c01 - c00
+        dc[:,1] = dc_dy0 + tx * ((c11 - c10) - dc_dy0)
+        dc_dz0 = d00 + ty * (d01 - d00)
+        dc[:,2] = dc_dz0 + tx * ((d10 + ty * (d11 - d10)) - dc_dz0)
+        return c, dc
+
+    def signed_distances(self, coords):
+        """Returns the signed distances at an array of grid coordinates,
+        trilinearly interpolating all of them at once. Coordinates outside
+        the grid are snapped to the SDF dims.
+
+        Parameters
+        ----------
+        coords : :obj:`numpy.ndarray` of float
+            An Nx3 ndarray of coordinates in the grid.
+
+        Returns
+        -------
+        :obj:`numpy.ndarray` of float
+            An N ndarray of the signed distances at the given coords (interpolated).
+
+        Raises
+        ------
+        IndexError
+            If the coords array is not Nx3.
+        """
+        return self._interpolate(self.data_, self._grid_cells(coords))
+
+    def interpolated_gradients(self, coords):
+        """Returns the SDF gradients at an array of grid coordinates by
+        trilinearly interpolating the gradients of the SDF.
+        Coordinates outside the grid are snapped to the SDF dims.
+
+        Parameters
+        ----------
+        coords : :obj:`numpy.ndarray` of float
+            An Nx3 ndarray of coordinates in the grid.
+
+        Returns
+        -------
+        :obj:`numpy.ndarray` of float
+            An Nx3 ndarray of the gradients at the given coords (interpolated).
+
+        Raises
+        ------
+        IndexError
+            If the coords array is not Nx3.
+        """
+        cells = self._grid_cells(coords)
+        return np.array([self._interpolate(g, cells) for g in self.gradients]).T
+
+    def hessians(self, coords):
+        """Returns the SDF Hessians at an array of grid coordinates, computed
+        from the analytic derivatives of the trilinearly interpolated
+        gradients and symmetrized.
+        Coordinates outside the grid are snapped to the SDF dims.
+
+        Parameters
+        ----------
+        coords : :obj:`numpy.ndarray` of float
+            An Nx3 ndarray of coordinates in the grid.
+
+        Returns
+        -------
+        :obj:`numpy.ndarray` of float
+            An Nx3x3 ndarray of the Hessians at the given coords.
+
+        Raises
+        ------
+        IndexError
+            If the coords array is not Nx3.
+        """
+        cells = self._grid_cells(coords)
+        J = np.array([self._interpolate(g, cells, derivatives=True)[1] for g in self.gradients])
+        J = J.transpose(1, 0, 2)
+        return 0.5 * (J + J.transpose(0, 2, 1))
 
     def __getitem__(self, coords):
         """Returns the signed distance at the given coordinates.
@@ -331,19 +514,22 @@ class Sdf3D(Sdf):
         Parameters
         ----------
         coords : :obj:`numpy.ndarray` of int
-            A or 3-dimensional ndarray that indicates the desired
-            coordinates in the grid.
+            A 3-dimensional ndarray that indicates the desired
+            coordinates in the grid, or an Nx3 ndarray of coordinates.
 
         Returns
         -------
-        float
-            The signed distance at the given coords (interpolated).
+        float or :obj:`numpy.ndarray` of float
+            The signed distance at the given coords (interpolated), or an
+            N ndarray of signed distances for an Nx3 ndarray of coords.
 
         Raises
         ------
         IndexError
             If the coords vector does not have three entries.
         """
+        if isinstance(coords, np.ndarray) and coords.ndim == 2:
+            return self.signed_distances(coords)
         return self._signed_distance(coords)
 
     def gradient(self, coords):
@@ -357,7 +543,7 @@ class Sdf3D(Sdf):
 
         Returns
         -------
-        float
+        :obj:`numpy.ndarray` of float
             The gradient at the given coords (interpolated).
 
         Raises
@@ -367,88 +553,25 @@ class Sdf3D(Sdf):
         """
         if len(coords) != 3:
             raise IndexError('Indexing must be 3 dimensional')
-
-        # log warning if out of bounds access
-        if self.is_out_of_bounds(coords):
-            logging.debug('Out of bounds access. Snapping to SDF dims')
-
-        # snap to grid dims
-        self.coords_buf_[0] = max(0, min(coords[0], self.dims_[0] - 1))
-        self.coords_buf_[1] = max(0, min(coords[1], self.dims_[1] - 1))
-        self.coords_buf_[2] = max(0, min(coords[2], self.dims_[2] - 1))
-
-        # regular indexing if integers
-        if type(coords[0]) is int and type(coords[1]) is int and type(coords[2]) is int:
-            self.coords_buf_ = self.coords_buf_.astype(np.int)
-            return self.data_[self.coords_buf_[0], self.coords_buf_[1], self.coords_buf_[2]]
-
-        # otherwise interpolate
-        min_coords = np.floor(self.coords_buf_)
-        max_coords = min_coords + 1
-        self.points_buf_[Sdf3D.min_coords_x, 0] = min_coords[0]
-        self.points_buf_[Sdf3D.max_coords_x, 0] = min_coords[0]
-        self.points_buf_[Sdf3D.min_coords_y, 1] = min_coords[1]
-        self.points_buf_[Sdf3D.max_coords_y, 1] = max_coords[1]
-        self.points_buf_[Sdf3D.min_coords_z, 2] = min_coords[2]
-        self.points_buf_[Sdf3D.max_coords_z, 2] = max_coords[2]
-
-        # bilinear interpolation
-        g = np.zeros(3)
-        gp = np.zeros(3)
-        w_sum = 0.0
-        for i in range(Sdf3D.num_interpolants):
-            p = self.points_buf_[i,:]
-            if self.is_out_of_bounds(p):
-                gp[0] = 0.0
-                gp[1] = 0.0
-                gp[2] = 0.0
-            else:
-                gp[0] = self.gradients_[0][p[0], p[1], p[2]]
-                gp[1] = self.gradients_[1][p[0], p[1], p[2]]
-                gp[2] = self.gradients_[2][p[0], p[1], p[2]]
-
-            w = np.prod(-np.abs(p - self.coords_buf_) + 1)
-            g = g + w * gp
-
-        return g
+        return self.interpolated_gradients(np.array([coords], dtype=np.float64))[0]
 
     def curvature(self, coords, delta=0.001):
         """
-        Returns an approximation to the local SDF curvature (Hessian) at the
+        Returns the local SDF curvature (Hessian) at the
         given coordinate in grid basis.
 
         Parameters
         ---------
         coords : numpy 3-vector
             the grid coordinates at which to get the curvature
+        delta : float
+            unused, the curvature is computed analytically
 
         Returns
         -------
         curvature : 3x3 ndarray of the curvature at the surface points
         """
-        # perturb local coords
-        coords_x_up   = coords + np.array([delta, 0, 0])
-        coords_x_down = coords + np.array([-delta, 0, 0])
-        coords_y_up   = coords + np.array([0, delta, 0])
-        coords_y_down = coords + np.array([0, -delta, 0])
-        coords_z_up   = coords + np.array([0, 0, delta])
-        coords_z_down = coords + np.array([0, 0, -delta])
-
-        # get gradient
-        grad_x_up = self.gradient(coords_x_up)
-        grad_x_down = self.gradient(coords_x_down)
-        grad_y_up = self.gradient(coords_y_up)
-        grad_y_down = self.gradient(coords_y_down)
-        grad_z_up = self.gradient(coords_z_up)
-        grad_z_down = self.gradient(coords_z_down)
-
-        # finite differences
-        curvature_x = (grad_x_up - grad_x_down) / (4 * delta)
-        curvature_y = (grad_y_up - grad_y_down) / (4 * delta)
-        curvature_z = (grad_z_up - grad_z_down) / (4 * delta)
-        curvature = np.c_[curvature_x, np.c_[curvature_y, curvature_z]]
-        curvature = curvature + curvature.T
-        return curvature
+        return self.hessians(np.array([coords], dtype=np.float64))[0]
 
     def surface_normal(self, coords, delta=1.5):
         """Returns the sdf surface normal at the given coordinates by
@@ -477,58 +600,93 @@ class Sdf3D(Sdf):
         if len(coords) != 3:
             raise IndexError('Indexing must be 3 dimensional')
 
-        # log warning if out of bounds access
-        if self.is_out_of_bounds(coords):
-            logging.debug('Out of bounds access. Snapping to SDF dims')
-        # snap to grid dims
-        coords[0] = max(0, min(coords[0], self.dims_[0] - 1))
-        coords[1] = max(0, min(coords[1], self.dims_[1] - 1))
-        coords[2] = max(0, min(coords[2], self.dims_[2] - 1))
-        index_coords = np.zeros(3)
-
-        # check points on surface
-        sdf_val = self[coords]
-        if np.abs(sdf_val) >= self.surface_thresh_:
+        normals, valid = self.surface_normals(np.array([coords], dtype=np.float64), delta=delta)
+        if not valid[0]:
             logging.warning('Cannot compute normal. Point must be on surface')
             return None
+        return normals[0]
 
-        # collect all surface points within the delta sphere
-        X = []
-        d = np.zeros(3)
-        dx = -delta
-        while dx <= delta:
-            dy = -delta
-            while dy <= delta:
-                dz = -delta
-                while dz <= delta:
-                    d = np.array([dx, dy, dz])
-                    if dx != 0 or dy != 0 or dz != 0:
-                        d = delta * d / np.linalg.norm(d)
-                    index_coords[0] = coords[0] + d[0]
-                    index_coords[1] = coords[1] + d[1]
-                    index_coords[2] = coords[2] + d[2]
-                    sdf_val = self[index_coords]
-                    if np.abs(sdf_val) < self.surface_thresh_:
-                        X.append([index_coords[0], index_coords[1], index_coords[2], sdf_val])
-                    dz += delta
-                dy += delta
-            dx += delta
-
-        # fit a plane to the surface points
-        X.sort(key = lambda x: x[3])
-        X = np.array(X)[:,:3]
-        A = X - np.mean(X, axis=0)
-        try:
-            U, S, V = np.linalg.svd(A.T)
-            n = U[:,2]
-        except:
-            logging.warning('Tangent plane does not exist. Returning None.')
-            return None
+    def surface_normals(self, coords, delta=1.5, use_gradient=False, block_size=2**16):
+        """Returns the sdf surface normals at an array of grid coordinates.
+
+        By default, the normals are computed by fitting tangent planes to the
+        surface samples among the 27 points of a 3x3x3 neighborhood projected
+        onto a sphere around each point, as in surface_normal. All samples are
+        interpolated at once and the planes are fit with a stacked eigen-
+        decomposition of the sample covariances.
+
+        Parameters
+        ----------
+        coords : :obj:`numpy.ndarray` of float
+            An Nx3 ndarray of coordinates in the grid.
+        delta : float
+            A radius for collecting surface points near the target coords
+            for calculating the surface normals.
+        use_gradient : bool
+            If True, use the normalized interpolated SDF gradients as the
+            normals instead of fitting tangent planes. This is much faster
+            but less robust to noise in the SDF.
+        block_size : int
+            The number of points to process at once, to bound memory usage.
+
+        Returns
+        -------
+        :obj:`numpy.ndarray` of float
+            An Nx3 ndarray of the outward surface normals, with rows of zeros
+            where the normal could not be computed.
+        :obj:`numpy.ndarray` of bool
+            An N ndarray that is True where the normal could be computed,
+            which requires the point to be on the surface.
 
-        # make sure surface normal is outward            
-        if self[coords+n*0.01] < self[coords]:
-            n = -n
-        return n
+        Raises
+        ------
+        IndexError
+            If the coords array is not Nx3.
+        """
+        coords = np.asarray(coords, dtype=np.float64)
+        if coords.ndim != 2 or coords.shape[1] != 3:
+            raise IndexError('Indexing must be 3 dimensional')
+        coords = np.clip(coords, 0, np.array(self.dims_) - 1)
+        num_pts = coords.shape[0]
+        normals = np.zeros([num_pts, 3])
+        valid = np.abs(self.signed_distances(coords)) < self.surface_thresh_
+
+        if use_gradient:
+            normals[valid] = self.interpolated_gradients(coords[valid])
+            norms = np.linalg.norm(normals, axis=1)
+            valid = valid & (norms > 0)
+            normals[valid] = normals[valid] / norms[valid,np.newaxis]
+            normals[~valid] = 0
+            return normals, valid
+
+        # neighborhood offsets on the delta sphere
+        offsets = np.array(np.meshgrid([-1, 0, 1], [-1, 0, 1], [-1, 0, 1], indexing='ij')).reshape(3, -1).T.astype(np.float64)
+        offset_norms = np.linalg.norm(offsets, axis=1)
+        offset_norms[offset_norms == 0] = 1
+        offsets = delta * offsets / offset_norms[:,np.newaxis]
+
+        inds = np.where(valid)[0]
+        for i in range(0, inds.shape[0], block_size):
+            block_inds = inds[i:i+block_size]
+            block_coords = coords[block_inds]
+
+            # collect the surface points within the delta sphere
+            X = block_coords[:,np.newaxis,:] + offsets[np.newaxis,:,:]
+            sd = self.signed_distances(X.reshape(-1, 3)).reshape(X.shape[:2])
+            w = (np.abs(sd) < self.surface_thresh_).astype(np.float64)
+
+            # fit planes to the surface points
+            mean = np.einsum('nk,nki->ni', w, X) / np.sum(w, axis=1)[:,np.newaxis]
+            A = X - mean[:,np.newaxis,:]
+            C = np.einsum('nk,nki,nkj->nij', w, A, A)
+            _, V = np.linalg.eigh(C)
+            n = V[:,:,0]
+
+            # make sure surface normals are outward
+            flip = self.signed_distances(block_coords + 0.01 * n) < self.signed_distances(block_coords)
+            n[flip] = -n[flip]
+            normals[block_inds] = n
+        return normals, valid
 
     def surface_points(self, grid_basis=True):
         """Returns the points on the surface.
@@ -558,6 +716,7 @@ class Sdf3D(Sdf):
 
     def rescale(self, scale):
         """ Rescale an SDF by a given scale factor.
+        The new SDF shares the data and gradients of this one.
 
         Parameters
         ----------
@@ -569,9 +728,12 @@ class Sdf3D(Sdf):
         :obj:`Sdf3D`
             new sdf with given scale
         """
-        resolution_tf = scale * self.resolution_
-        return Sdf3D(self.data_, self.origin_, resolution_tf, use_abs=self.use_abs_,
-                     T_sdf_world=self.T_sdf_world_)
+        sdf = copy.copy(self)
+        sdf.resolution_ = scale * self.resolution_
+        sdf.surface_thresh_ = sdf.resolution_ * np.sqrt(2) / 2
+        sdf.center_ = None
+        sdf._set_pose(self.T_sdf_world_)
+        return sdf
 
     def transform_dense(self, delta_T, detailed = False):
         """ Transform the grid by pose T and scale with canonical reference
@@ -641,7 +803,7 @@ class Sdf3D(Sdf):
         logging.debug('Sdf3D: Time to transform coords: %f' %(all_points_t - start_t))
         logging.debug('Sdf3D: Time to transform origin: %f' %(origin_res_t - all_points_t))
         logging.debug('Sdf3D: Time to transfer sd: %f' %(tf_t - origin_res_t))
-        return Sdf3D(sdf_data_tf_grid, origin_tf, resolution_tf, use_abs=self._use_abs_, T_sdf_world=self.T_sdf_world_)
+        return Sdf3D(sdf_data_tf_grid, origin_tf, resolution_tf, use_abs=self.use_abs_, T_sdf_world=self.T_sdf_world_)
 
     def transform_pt_obj_to_grid(self, x_sdf, direction = False):
         """ Converts a point in sdf coords to the grid basis. If direction then don't translate.
@@ -748,3 +910,327 @@ class Sdf3D(Sdf):
 
         x_zc = x1 + t_zc * v
         return x_zc
+
+class SparseSdf3D(Sdf3D):
+    """ A narrow-band 3D signed distance field.
+
+    The grid is split into cubic blocks of cells. Only the blocks near the
+    surface are stored at full resolution, as bricks that hold the samples
+    at the corners of all of their cells (so neighboring bricks share a face
+    of samples). The far field is stored as a coarse grid with one sample per
+    block corner, and the last sample along each axis on the max face of the
+    grid, and is interpolated between them, so values away from the surface
+    are only approximate. The query API is the same as for Sdf3D.
+    """
+    def __init__(self, sdf_data, origin, resolution, use_abs=False,
+                 T_sdf_world=RigidTransform(from_frame='sdf', to_frame='world'),
+                 dtype=None, block_size=8, band=3.0):
+        """Construct a narrow-band SDF from a dense SDF grid.
+
+        Parameters
+        ----------
+        sdf_data : :obj:`numpy.ndarray` of float
+            The 3-dimensional ndarray that holds the grid of signed distances.
+        origin : :obj:`numpy.ndarray` of float
+            The location of the origin of the grid in the sdf frame.
+        resolution : float
+            The width of each grid cell.
+        use_abs : bool
+            Whether to only use the absolute values of the signed distances.
+        T_sdf_world : :obj:`autolab_core.RigidTransform`
+            pose of the sdf in the world frame
+        dtype : :obj:`numpy.dtype`
+            The dtype to store the bricks and gradients in, e.g. np.float32,
+            or None to use the dtype of sdf_data.
+        block_size : int
+            The width of the blocks in grid cells.
+        band : float
+            The half-width of the narrow band in grid cells. Blocks with any
+            signed distance within band cells of the surface are stored
+            at full resolution.
+        """
+        if dtype is not None:
+            sdf_data = sdf_data.astype(dtype, copy=False)
+        if use_abs:
+            sdf_data = np.abs(sdf_data)
+        self.origin_ = origin
+        self.resolution_ = resolution
+        self.dims_ = sdf_data.shape
+        self.use_abs_ = use_abs
+        self.block_size_ = block_size
+        self.band_ = band
+        self.pts_ = None
+        self._build_blocks(sdf_data)
+
+        # set up surface params
+        self.surface_thresh_ = self.resolution_ * np.sqrt(2) / 2
+        self.center_ = None
+        self._set_pose(T_sdf_world)
+
+    def _build_blocks(self, sdf_data):
+        """Splits a dense SDF grid and its gradients into narrow-band bricks
+        and a coarse far field.
+        """
+        B = self.block_size_
+        dims = np.array(self.dims_)
+        num_blocks = (dims - 1) // B + 1
+
+        def bricks(volume):
+            # pad to a whole number of blocks, then view the overlapping bricks
+            padded = np.pad(volume, [(0, n * B + 1 - d) for n, d in zip(num_blocks, dims)], mode='edge')
+            s = padded.strides
+            return np.lib.stride_tricks.as_strided(padded,
+                                                   shape=tuple(num_blocks) + (B+1, B+1, B+1),
+                                                   strides=(B * s[0], B * s[1], B * s[2]) + s)
+
+        def coarse(volume):
+            # the last interval along each axis ends on the max face of the grid
+            num_intervals = np.maximum((dims - 2) // B + 1, 1)
+            inds = [np.minimum(B * np.arange(n + 1), d - 1) for n, d in zip(num_intervals, dims)]
+            return volume[np.ix_(*inds)]
+
+        # find the blocks in the narrow band
+        abs_bricks = bricks(np.abs(sdf_data))
+        near = np.min(abs_bricks.reshape(tuple(num_blocks) + (-1,)), axis=3) < self.band_ * self.resolution_
+        self.brick_index_ = -np.ones(num_blocks, dtype=np.int64)
+        self.brick_index_[near] = np.arange(np.sum(near))
+
+        self.bricks_ = bricks(sdf_data)[near]
+        self.coarse_data_ = coarse(sdf_data)
+        self.brick_gradients_ = []
+        self.coarse_gradients_ = []
+        for axis in range(3):
+            gradient = np.gradient(sdf_data, axis=axis)
+            self.brick_gradients_.append(bricks(gradient)[near])
+            self.coarse_gradients_.append(coarse(gradient))
+
+    @property
+    def block_size(self):
+        """int : The width of the blocks in grid cells.
+        """
+        return self.block_size_
+
+    @property
+    def num_bricks(self):
+        """int : The number of blocks stored at full resolution.
+        """
+        return self.bricks_.shape[0]
+
+    @property
+    def nbytes(self):
+        """int : The number of bytes used to store the SDF and its gradients.
+        """
+        arrays = [self.bricks_, self.coarse_data_, self.brick_index_] + \
+                 self.brick_gradients_ + self.coarse_gradients_
+        return sum([a.nbytes for a in arrays])
+
+    @property
+    def data(self):
+        """The SDF data, densified from the bricks and the far field.
+
+        Returns
+        -------
+        :obj:`numpy.ndarray` of float
+            The 3-dimensional ndarray that holds the grid of signed
+            distances.
+        """
+        return self._densify(self.signed_distances)
+
+    @property
+    def gradients(self):
+        """Gradients of the SDF, densified from the bricks and the far field.
+
+        Returns
+        -------
+        :obj:`list` of :obj:`numpy.ndarray` of float
+            A list of ndarrays of the same dimension as the SDF. The arrays
+            are in axis order and specify the gradients for that axis
+            at each point.
+        """
+        g = self._densify(self.interpolated_gradients)
+        return [g[:,:,:,axis] for axis in range(3)]
+
+    def _densify(self, query):
+        """Evaluates a query at every grid point, one x slice at a time.
+        """
+        y, z = np.indices(self.dims_[1:]).reshape(2, -1)
+        slices = []
+        for x in range(self.dims_[0]):
+            values = query(np.c_[x * np.ones(y.shape[0]), y, z])
+            slices.append(values.reshape(self.dims_[1:] + values.shape[1:]))
+        return np.array(slices)
+
+    def _interpolate_sparse(self, brick_volume, coarse_volume, coords, derivatives=False):
+        """Trilinearly interpolates a volume stored as bricks and a far field.
+        """
+        B = self.block_size_
+        min_coords, has_max, t = self._snap_to_cells(coords, self.dims_)
+        blocks = min_coords // B
+        brick_inds = self.brick_index_[blocks[:,0], blocks[:,1], blocks[:,2]]
+        near = brick_inds >= 0
+        far = ~near
+
+        # interpolate in double precision, whatever the storage dtype
+        values = np.zeros(coords.shape[0])
+        if derivatives:
+            d_values = np.zeros([coords.shape[0], 3])
+
+        # interpolate within the bricks
+        if np.any(near):
+            strides = np.array([(B+1)**2, B+1, 1])
+            cells = (brick_inds[near] * (B+1)**3 + (min_coords[near] - B * blocks[near]).dot(strides),
+                     has_max[near] * strides, t[near])
+            if derivatives:
+                values[near], d_values[near] = self._interpolate(brick_volume, cells, derivatives=True)
+            else:
+                values[near] = self._interpolate(brick_volume, cells)
+
+        # interpolate the far field on the coarse grid, whose last interval
+        # along each axis can be shorter than a block
+        if np.any(far):
+            x = min_coords[far] + t[far]
+            last_min = B * (np.array(coarse_volume.shape) - 2)
+            last_width = np.maximum(np.array(self.dims_) - 1 - last_min, 1).astype(np.float64)
+            in_last = x > last_min
+            coarse_coords = np.minimum(x, last_min) / float(B) + np.maximum(x - last_min, 0) / last_width
+            cells = self._grid_cells(coarse_coords, dims=coarse_volume.shape)
+            if derivatives:
+                values[far], d_far = self._interpolate(coarse_volume, cells, derivatives=True)
+                d_values[far] = d_far / np.where(in_last, last_width, B)
+            else:
+                values[far] = self._interpolate(coarse_volume, cells)
+
+        if derivatives:
+            return values, d_values
+        return values
+
+    def signed_distances(self, coords):
+        """Returns the signed distances at an array of grid coordinates,
+        trilinearly interpolating all of them at once. Coordinates outside
+        the grid are snapped to the SDF dims.
+
+        Parameters
+        ----------
+        coords : :obj:`numpy.ndarray` of float
+            An Nx3 ndarray of coordinates in the grid.
+
+        Returns
+        -------
+        :obj:`numpy.ndarray` of float
+            An N ndarray of the signed distances at the given coords (interpolated).
+
+        Raises
+        ------
+        IndexError
+            If the coords array is not Nx3.
+        """
+        return self._interpolate_sparse(self.bricks_, self.coarse_data_, np.asarray(coords))
+
+    def interpolated_gradients(self, coords):
+        """Returns the SDF gradients at an array of grid coordinates by
+        trilinearly interpolating the gradients of the SDF.
+        Coordinates outside the grid are snapped to the SDF dims.
+
+        Parameters
+        ----------
+        coords : :obj:`numpy.ndarray` of float
+            An Nx3 ndarray of coordinates in the grid.
+
+        Returns
+        -------
+        :obj:`numpy.ndarray` of float
+            An Nx3 ndarray of the gradients at the given coords (interpolated).
+
+        Raises
+        ------
+        IndexError
+            If the coords array is not Nx3.
+        """
+        coords = np.asarray(coords)
+        return np.array([self._interpolate_sparse(g, c, coords)
+                         for g, c in zip(self.brick_gradients_, self.coarse_gradients_)]).T
+
+    def hessians(self, coords):
+        """Returns the SDF Hessians at an array of grid coordinates, computed
+        from the analytic derivatives of the trilinearly interpolated
+        gradients and symmetrized.
+        Coordinates outside the grid are snapped to the SDF dims.
+
+        Parameters
+        ----------
+        coords : :obj:`numpy.ndarray` of float
+            An Nx3 ndarray of coordinates in the grid.
+
+        Returns
+        -------
+        :obj:`numpy.ndarray` of float
+            An Nx3x3 ndarray of the Hessians at the given coords.
+
+        Raises
+        ------
+        IndexError
+            If the coords array is not Nx3.
+        """
+        coords = np.asarray(coords)
+        J = np.array([self._interpolate_sparse(g, c, coords, derivatives=True)[1]
+                      for g, c in zip(self.brick_gradients_, self.coarse_gradients_)])
+        J = J.transpose(1, 0, 2)
+        return 0.5 * (J + J.transpose(0, 2, 1))
+
+    def surface_points(self, grid_basis=True):
+        """Returns the points on the surface, which must lie in the narrow band.
+
+        Parameters
+        ----------
+        grid_basis : bool
+            If False, the surface points are transformed to the world frame.
+            If True (default), the surface points are left in grid coordinates.
+
+        Returns
+        -------
+        :obj:`tuple` of :obj:`numpy.ndarray` of int, :obj:`numpy.ndarray` of float
+            The points on the surface and the signed distances at those points.
+        """
+        # each grid point is owned by the brick that has it as a min corner
+        B = self.block_size_
+        owned = self.bricks_[:,:B,:B,:B]
+        brick_inds, x, y, z = np.where(np.abs(owned) < self.surface_thresh_)
+        blocks = np.array(np.where(self.brick_index_ >= 0)).T
+        surface_points = B * blocks[brick_inds] + np.c_[x, y, z]
+        surface_vals = owned[brick_inds, x, y, z]
+
+        # remove the padding and sort like the dense grid
+        in_bounds = np.all(surface_points < np.array(self.dims_), axis=1)
+        surface_points = surface_points[in_bounds]
+        surface_vals = surface_vals[in_bounds]
+        order = np.lexsort(surface_points.T[::-1])
+        surface_points = surface_points[order]
+        surface_vals = surface_vals[order]
+        if not grid_basis:
+            surface_points = self.transform_pt_grid_to_obj(surface_points.T)
+            surface_points = surface_points.T
+
+        return surface_points, surface_vals
+
+    def transform_dense(self, delta_T, detailed = False):
+        """ Transform the grid by pose T and scale with canonical reference
+        frame at the SDF center with axis alignment. The grid is densified,
+        transformed as a dense SDF and split into bricks again.
+
+        Parameters
+        ----------
+        delta_T : SimilarityTransform
+            the transformation from the current frame of reference to the new frame of reference
+        detailed : bool
+            whether or not to use interpolation
+
+        Returns
+        -------
+        :obj:`SparseSdf3D`
+            new narrow-band sdf with grid warped by T, with the same block size and band
+        """
+        sdf = Sdf3D(self.data, self.origin_, self.resolution_, T_sdf_world=self.T_sdf_world_)
+        sdf_tf = sdf.transform_dense(delta_T, detailed=detailed)
+        return SparseSdf3D(sdf_tf.data_, sdf_tf.origin_, sdf_tf.resolution_, use_abs=self.use_abs_,
+                           T_sdf_world=self.T_sdf_world_, dtype=self.bricks_.dtype,
+                           block_size=self.block_size_, band=self.band_)
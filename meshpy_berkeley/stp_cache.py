@@ -0,0 +1,173 @@
+"""
+On-disk cache of stable pose analysis results keyed by mesh geometry.
+"""
+import hashlib
+import os
+
+import numpy as np
+
+from atomic_file import atomic_write
+
+class StablePoseCache:
+    """
+    A size-bounded on-disk cache of the toppling graphs used for stable
+    pose analysis, keyed by a content hash of the mesh vertices, triangles
+    and center of mass. Each entry is stored as a .npz file in the cache
+    directory, so the cache can be shared between processes and jobs.
+    Least recently used entries are evicted when the total size exceeds
+    the limit.
+
+    Attributes
+    ----------
+    cache_dir : :obj:`str`
+        The directory that holds the cache entries.
+    max_size : int
+        The maximum total size of the cache entries in bytes.
+    """
+    STP_EXT = '.npz'
+    VERSION = 1
+
+    def __init__(self, cache_dir, max_size=2**30):
+        """Construct a stable pose cache.
+
+        Parameters
+        ----------
+        cache_dir : :obj:`str`
+            The directory to store cache entries in. Created if it does not exist.
+        max_size : int
+            The maximum total size of the cache entries in bytes.
+
+        Raises
+        ------
+        ValueError
+            If the maximum size is not positive.
+        """
+        if max_size <= 0:
+            raise ValueError('Maximum cache size must be positive')
+        self.cache_dir_ = cache_dir
+        self.max_size_ = max_size
+        if not os.path.exists(self.cache_dir_):
+            os.makedirs(self.cache_dir_)
+
+    @property
+    def cache_dir(self):
+        """:obj:`str` : The directory that holds the cache entries.
+        """
+        return self.cache_dir_
+
+    @property
+    def max_size(self):
+        """int : The maximum total size of the cache entries in bytes.
+        """
+        return self.max_size_
+
+    @staticmethod
+    def key(vertices, triangles, center_of_mass):
+        """Computes the cache key of a mesh geometry.
+
+        Parameters
+        ----------
+        vertices : :obj:`numpy.ndarray` of float
+            A #verts by 3 array of mesh vertices.
+        triangles : :obj:`numpy.ndarray` of int
+            A #tris by 3 array of vertex indices.
+        center_of_mass : :obj:`numpy.ndarray` of float
+            The 3D location of the mesh's center of mass.
+
+        Returns
+        -------
+        :obj:`str`
+            A hex digest identifying the geometry.
+        """
+        h = hashlib.sha1()
+        h.update(str(StablePoseCache.VERSION))
+        for a, dtype in [(vertices, np.float64), (triangles, np.int64), (center_of_mass, np.float64)]:
+            a = np.ascontiguousarray(a, dtype=dtype)
+            h.update(str(a.shape))
+            h.update(a.data)
+        return h.hexdigest()
+
+    def filename(self, key):
+        """Returns the path of the cache entry for a key.
+
+        Parameters
+        ----------
+        key : :obj:`str`
+            The cache key.
+
+        Returns
+        -------
+        :obj:`str`
+            The full path to the entry, which may not exist.
+        """
+        return os.path.join(self.cache_dir_, key + StablePoseCache.STP_EXT)
+
+    def get(self, key):
+        """Reads a cache entry and marks it as recently used.
+
+        Parameters
+        ----------
+        key : :obj:`str`
+            The cache key.
+
+        Returns
+        -------
+        :obj:`dict` of :obj:`str` to :obj:`numpy.ndarray`
+            The arrays stored for the key, or None if there is no valid entry.
+        """
+        filename = self.filename(key)
+        try:
+            with np.load(filename) as data:
+                entry = dict([(name, data[name]) for name in data.files])
+            os.utime(filename, None)
+        except Exception:
+            # missing, partially evicted or unreadable entries are treated as misses
+            return None
+        return entry
+
+    def put(self, key, arrays):
+        """Writes a cache entry and evicts least recently used entries if the
+        cache exceeds its maximum size. The entry is written to a temporary
+        file first so that concurrent readers never see a partial entry.
+
+        Parameters
+        ----------
+        key : :obj:`str`
+            The cache key.
+        arrays : :obj:`dict` of :obj:`str` to :obj:`numpy.ndarray`
+            The arrays to store for the key.
+        """
+        with atomic_write(self.filename(key)) as f:
+            np.savez(f, **arrays)
+        self.evict()
+
+    def evict(self):
+        """Removes least recently used entries until the total size of the
+        cache is within its maximum size.
+        """
+        entries = []
+        for filename in os.listdir(self.cache_dir_):
+            if filename.startswith('.') or not filename.endswith(StablePoseCache.STP_EXT):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir_, filename))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, filename))
+
+        total_size = sum([size for _, size, _ in entries])
+        for _, size, filename in sorted(entries):
+            if total_size <= self.max_size_:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir_, filename))
+            except OSError:
+                pass
+            total_size -= size
+
+    def clear(self):
+        """Removes all entries from the cache.
+        """
+        for filename in os.listdir(self.cache_dir_):
+            if not filename.startswith('.') and filename.endswith(StablePoseCache.STP_EXT):
+                os.remove(os.path.join(self.cache_dir_, filename))
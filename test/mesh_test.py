@@ -1,6 +1,72 @@
-from unittest import TestCase
+from unittest import TestCase, skipIf
+import os
+import shutil
+import tempfile
+import threading
 import numpy as np
-from meshpy_berkeley import Mesh3D
+from autolab_core import RigidTransform, Point
+from autolab_core.utils import sph2cart
+from perception import CameraIntrinsics
+from meshpy_berkeley import Mesh3D, StablePose, ObjFile, BinaryMeshFile, StablePoseCache, ViewsphereDiscretizer, PlanarWorksurfaceDiscretizer, Sdf3D, SparseSdf3D
+from meshpy_berkeley import VirtualCamera, SceneObject, RenderPool, render_pool, RenderMode, RigidTransformArray
+from meshpy_berkeley import CameraSampleBatch, UniformViewsphereRandomVariable, UniformPlanarWorksurfaceRandomVariable
+try:
+    from meshpy_berkeley import meshrender
+except ImportError:
+    meshrender = None
+
+class StubCamera(VirtualCamera):
+    """ A virtual camera that records what it would render instead of rendering. """
+    def wrapped_images(self, mesh, object_to_camera_poses, render_mode, stable_pose=None,
+                       mat_props=None, light_props=None, debug=False, camera_intrinsics=None):
+        names = [name for name, scene_obj in self._scene_objects()]
+        return [(T.translation[0], intr.fx, id(self), mesh.vertices.shape[0], names)
+                for T, intr in zip(object_to_camera_poses, camera_intrinsics)]
+
+class RecordingCamera(VirtualCamera):
+    """ A virtual camera that records the poses passed to the renderer and renders blank depth images. """
+    @staticmethod
+    def _render_flags(render_mode):
+        return 0
+
+    def _render_images(self, mesh, object_to_camera_poses, render_flags, **kwargs):
+        return self._blank_images(object_to_camera_poses)
+
+    def _render_scene_images(self, scene_objects, world_to_camera_poses, render_flags, **kwargs):
+        self.scene_objects = scene_objects
+        return self._blank_images(world_to_camera_poses)
+
+    def _blank_images(self, poses):
+        self.rendered_poses = poses
+        depth_ims = np.zeros([len(poses), self._camera_intr.height, self._camera_intr.width], dtype=np.float32)
+        return None, depth_ims, None
+
+def viewsphere_pose(radius, elev, az, roll, x=0, y=0, frame='camera'):
+    """ Object to camera pose of a viewsphere sample, computed one sample at a time. """
+    camera_center_obj = np.array(sph2cart(radius, az, elev)) + np.array([x, y, 0])
+    camera_z_obj = -np.array(sph2cart(radius, az, elev))
+    camera_z_obj = camera_z_obj / np.linalg.norm(camera_z_obj)
+    camera_x_par_obj = np.array([camera_z_obj[1], -camera_z_obj[0], 0])
+    if np.linalg.norm(camera_x_par_obj) == 0:
+        camera_x_par_obj = np.array([1, 0, 0])
+    camera_x_par_obj = camera_x_par_obj / np.linalg.norm(camera_x_par_obj)
+    camera_y_par_obj = np.cross(camera_z_obj, camera_x_par_obj)
+    if camera_y_par_obj[2] > 0:
+        camera_x_par_obj = -camera_x_par_obj
+        camera_y_par_obj = np.cross(camera_z_obj, camera_x_par_obj)
+    camera_y_par_obj = camera_y_par_obj / np.linalg.norm(camera_y_par_obj)
+    R_camera_par_camera = np.array([[np.cos(roll), -np.sin(roll), 0],
+                                    [np.sin(roll), np.cos(roll), 0],
+                                    [0, 0, 1]])
+    R_obj_camera = np.c_[camera_x_par_obj, camera_y_par_obj, camera_z_obj].dot(R_camera_par_camera)
+    return RigidTransform(R_obj_camera, camera_center_obj, from_frame=frame, to_frame='obj').inverse()
+
+def shifted_intrinsics(T_camera_obj, f, cx, cy, height, width, frame='camera'):
+    """ Intrinsics that project the object center to the given optical center. """
+    camera_intr = CameraIntrinsics(frame, fx=f, fy=f, cx=cx, cy=cy, skew=0.0, height=height, width=width)
+    u_center_obj = camera_intr.project(T_camera_obj * Point(np.zeros(3), frame='obj'))
+    return CameraIntrinsics(frame, fx=f, fy=f, cx=2 * cx - float(u_center_obj.x),
+                            cy=2 * cy - float(u_center_obj.y), skew=0.0, height=height, width=width)
 
 class TestMesh(TestCase):
 
@@ -24,6 +90,74 @@ class TestMesh(TestCase):
         self.assertTrue(m.vertices.shape == (4,3))
         self.assertTrue(m.triangles.shape == (4,3))
 
+    def test_read_face_formats(self):
+        m = Mesh3D.load('test/data/tetrahedron.obj', 'test/cache')
+        cache_dir = tempfile.mkdtemp()
+        try:
+            for fmt in ['%d/%d/%d', '%d//%d', '%d/%d']:
+                filename = os.path.join(cache_dir, 'tetrahedron.obj')
+                with open(filename, 'w') as f:
+                    for v in m.vertices:
+                        f.write('v %f %f %f\n' %(v[0], v[1], v[2]))
+                        f.write('vn 0.0 0.0 1.0\n')
+                    for t in m.triangles + 1:
+                        f.write('f ' + ' '.join([fmt %((i,) * fmt.count('%d')) for i in t]) + '\n')
+                m2 = ObjFile(filename).read()
+                self.assertEqual(m2.vertices.tolist(), m.vertices.tolist())
+                self.assertEqual(m2.triangles.tolist(), m.triangles.tolist())
+                self.assertEqual(m2.normals.shape, (4,3))
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_read_indented_lines(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(cache_dir, 'tetrahedron.obj')
+            with open(filename, 'w') as f:
+                f.write('  v 1 0 0\nv 0 1 0\n\tv -1 0 0\nv 0 0 1\n')
+                f.write('  f 4 1 2\nf 4 2 3\n\tf 4 3 1\nf 1 3 2\n')
+            m = ObjFile(filename).read()
+            self.assertEqual(m.vertices.tolist(), [[1,0,0],[0,1,0],[-1,0,0],[0,0,1]])
+            self.assertEqual(m.triangles.tolist(), [[3,0,1],[3,1,2],[3,2,0],[0,2,1]])
+            self.assertEqual(m.normals, None)
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_binary_mesh_file(self):
+        m = Mesh3D.load('test/data/tetrahedron.obj', 'test/cache')
+        m.compute_vertex_normals()
+        m.center_of_mass = m.centroid
+        volume = m.total_volume()
+        cache_dir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(cache_dir, 'tetrahedron.bmesh')
+            umask = os.umask(0027)
+            try:
+                BinaryMeshFile(filename).write(m)
+            finally:
+                os.umask(umask)
+            self.assertEqual(os.stat(filename).st_mode & 0777, 0640)
+            self.assertEqual(os.listdir(cache_dir), ['tetrahedron.bmesh'])
+            for mmap in [True, False]:
+                m2 = BinaryMeshFile(filename).read(mmap=mmap)
+                self.assertEqual(m2.vertices.tolist(), m.vertices.tolist())
+                self.assertEqual(m2.triangles.tolist(), m.triangles.tolist())
+                self.assertEqual(m2.normals.tolist(), m.normals.tolist())
+                self.assertEqual(m2.center_of_mass.tolist(), m.center_of_mass.tolist())
+                self.assertEqual(m2.density, m.density)
+                self.assertAlmostEqual(m2.total_volume(), volume)
+
+            # the binary copy is written on the first load and read on the next
+            m3 = Mesh3D.load('test/data/tetrahedron.obj', cache_dir)
+            self.assertEqual(len([f for f in os.listdir(cache_dir) if f.startswith('tetrahedron_')]), 1)
+            m4 = Mesh3D.load('test/data/tetrahedron.obj', cache_dir)
+            self.assertTrue(isinstance(m4.vertices, np.memmap))
+            self.assertEqual(m4.vertices.tolist(), m3.vertices.tolist())
+            self.assertEqual(m4.triangles.tolist(), m3.triangles.tolist())
+            self.assertTrue(m4.normals is None)
+        finally:
+            shutil.rmtree(cache_dir)
+
     def test_min_coords(self):
         m = Mesh3D.load('test/data/tetrahedron.obj', 'test/cache')
         self.assertTrue(m.min_coords().tolist() == [-1.0, 0.0, 0.0])
@@ -70,6 +204,28 @@ class TestMesh(TestCase):
         self.assertTrue([0.0, -1.0, 0.0] in n.tolist())
         self.assertTrue([0.0, 0.0, -1.0] in n.tolist())
 
+    def test_vertex_normals(self):
+        m = Mesh3D.load('test/data/tetrahedron.obj', 'test/cache')
+        self.assertEqual(m.vertex_incidence.shape, (4,12))
+        self.assertEqual(m.vertex_incidence.getnnz(axis=1).tolist(), [3,3,3,3])
+        m.compute_vertex_normals()
+        self.assertEqual(m.normals.shape, (4,3))
+        self.assertTrue(np.allclose(np.linalg.norm(m.normals, axis=1), 1.0))
+        self.assertTrue(np.all(np.sum(m.normals * (m.vertices - m.centroid), axis=1) > 0))
+
+    def test_topology(self):
+        m = Mesh3D.load('test/data/tetrahedron.obj', 'test/cache')
+        topo = m.topology
+        self.assertEqual(topo.num_edges, 6)
+        self.assertTrue(topo.is_closed)
+        self.assertEqual(topo.boundary_edges.shape[0], 0)
+        self.assertEqual(sorted(topo.vertex_triangles(0).tolist()), [0, 2, 3])
+        self.assertEqual(sorted(topo.edge_triangles(topo.edge_index(3, 0)).tolist()), [0, 2])
+        self.assertEqual(topo.tri_neighbors[0].tolist(), [2, 3, 1])
+        m.triangles = m.triangles[:3]
+        self.assertFalse(m.is_watertight)
+        self.assertEqual(m.topology.boundary_edges.tolist(), [[0, 1], [0, 2], [1, 2]])
+
     def test_total_volume(self):
         m = Mesh3D.load('test/data/tetrahedron.obj', 'test/cache')
         v = m.total_volume()
@@ -83,6 +239,28 @@ class TestMesh(TestCase):
                       [0.0, 1.0/60.0, 1.0/30.0]])
         self.assertEqual(np.round(cv, 5).tolist(), np.round(actual_cov, 5).tolist())
 
+    def test_center_of_mass(self):
+        m = Mesh3D.load('test/data/tetrahedron.obj', 'test/cache')
+        self.assertTrue(m.is_watertight)
+        self.assertEqual(np.round(m.center_of_mass, 5).tolist(), [0.0, 0.25, 0.25])
+
+    def test_center_of_mass_update(self):
+        m = Mesh3D.load('test/data/tetrahedron.obj', 'test/cache')
+        m.rescale(2.0)
+        self.assertEqual(np.round(m.center_of_mass, 5).tolist(), [0.0, 0.5, 0.5])
+        m.center_of_mass = np.zeros(3)
+        m.rescale(0.5)
+        self.assertEqual(m.center_of_mass.tolist(), [0.0, 0.0, 0.0])
+
+    def test_inertia(self):
+        m = Mesh3D.load('test/data/tetrahedron.obj', 'test/cache')
+        m.density = 2.0
+        C = np.zeros([3,3])
+        for tri in m.triangles:
+            C += m._covariance_of_tri(tri)
+        self.assertEqual(m.mass, 2.0 / 3.0)
+        self.assertTrue(np.allclose(m.inertia, 2.0 * (np.trace(C) * np.eye(3) - C)))
+
     def test_remove_bad_tris(self):
         m = Mesh3D.load('test/data/bad_tetrahedron.obj', 'test/cache')
         self.assertEqual(m.triangles.shape[0], 6)
@@ -165,6 +343,487 @@ class TestMesh(TestCase):
         m.center_of_mass = m.centroid
         stps = m.stable_poses()
         self.assertEqual(len(stps), 4)
+        self.assertAlmostEqual(sum([stp.p for stp in stps]), 1.0)
+
+    def test_stable_pose_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            cache = StablePoseCache(cache_dir)
+            m = Mesh3D.load('test/data/tetrahedron.obj', 'test/cache')
+            m.center_of_mass = m.centroid
+            m.stp_cache = cache
+            stps = m.stable_poses()
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+            m2 = Mesh3D.load('test/data/tetrahedron.obj', 'test/cache')
+            m2.center_of_mass = m2.centroid
+            m2.stp_cache = cache
+            stps2 = m2.stable_poses()
+            self.assertEqual([stp.p for stp in stps], [stp.p for stp in stps2])
+            self.assertEqual([stp.face.tolist() for stp in stps], [stp.face.tolist() for stp in stps2])
+
+            m2.center_of_mass = m2.bb_center
+            m2.stable_poses()
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+            # concurrent writers of the same key use separate temporary files
+            # that get the default permissions of the current umask
+            arrays = {'a': np.arange(100000)}
+            umask = os.umask(0022)
+            try:
+                threads = [threading.Thread(target=cache.put, args=('key', arrays)) for i in range(8)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                self.assertEqual(os.stat(cache.filename('key')).st_mode & 0777, 0644)
+                os.umask(0002)
+                cache.put('key', arrays)
+                self.assertEqual(os.stat(cache.filename('key')).st_mode & 0777, 0664)
+            finally:
+                os.umask(umask)
+            self.assertEqual(len(os.listdir(cache_dir)), 3)
+            self.assertEqual(cache.get('key')['a'].tolist(), arrays['a'].tolist())
+
+            cache = StablePoseCache(cache_dir, max_size=1)
+            cache.evict()
+            self.assertEqual(len(os.listdir(cache_dir)), 0)
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_resting_poses(self):
+        m = Mesh3D.load('test/data/tetrahedron.obj', 'test/cache')
+        m.center_of_mass = m.centroid
+        rotations = np.array([np.eye(3),
+                              [[1, 0, 0], [0, 0, -1], [0, 1, 0]],
+                              [[0, 0, 1], [0, 1, 0], [-1, 0, 0]]], dtype=np.float64)
+        faces, R, x0 = m.resting_poses(rotations)
+        self.assertEqual(faces.shape, (3,3))
+        self.assertEqual(R.shape, (3,3,3))
+        self.assertTrue(np.all(faces >= 0))
+        self.assertTrue(np.allclose(np.matmul(R, np.transpose(R, [0,2,1])), np.eye(3)))
+        stp = m.resting_pose(RigidTransform(rotation=rotations[1], from_frame='obj', to_frame='world'))
+        self.assertEqual(stp.face.tolist(), faces[1].tolist())
+
+    def test_prob_map(self):
+        successors = np.array([1, 2, -1, 4, 3, 2, 0, -1])
+        probs = np.arange(8) / 28.0
+        sinks, resting_probs = Mesh3D._compute_prob_map(successors, probs)
+        self.assertEqual(sinks.tolist(), [2, 2, 2, -1, -1, 2, 2, 7])
+        self.assertEqual(np.round(resting_probs, 5).tolist(), [0, 0, 0.5, 0, 0, 0, 0, 0.25])
+
+    def test_viewsphere_discretizer(self):
+        vs_disc = ViewsphereDiscretizer(0.5, 0.7, 3, 0.1, np.pi / 2, 4, num_az=6, num_roll=2)
+        poses = vs_disc.object_to_camera_poses()
+        self.assertEqual(len(poses), 3 * 4 * 6 * 2)
+        for T_obj_camera in poses[::7]:
+            self.assertEqual(T_obj_camera.from_frame, 'obj')
+            self.assertTrue(np.allclose(T_obj_camera.translation[:2], 0))
+
+        camera_intr = CameraIntrinsics('camera', 520.0, 520.0, 319.5, 239.5, height=480, width=640)
+        ws_disc = PlanarWorksurfaceDiscretizer(0.5, 0.7, 2, 0.1, 0.4, 2, num_az=3, num_roll=2,
+                                               min_x=-0.1, max_x=0.1, num_x=3, min_y=-0.1, max_y=0.1, num_y=2)
+        poses, normalized_poses, camera_intrs = ws_disc.object_to_camera_poses(camera_intr)
+        self.assertEqual(len(poses), 2 * 2 * 3 * 2 * 3 * 2)
+        self.assertEqual(len(camera_intrs), len(poses))
+        for T_obj_camera, T_obj_camera_normalized, shifted_intr in zip(poses, normalized_poses, camera_intrs)[::5]:
+            self.assertTrue(np.allclose(T_obj_camera_normalized.translation[:2], 0))
+            u = shifted_intr.proj_matrix.dot(T_obj_camera.translation)
+            self.assertTrue(np.allclose(u[:2] / u[2], [camera_intr.cx, camera_intr.cy], atol=1.0))
+
+    def test_sdf_interpolation(self):
+        x, y, z = np.indices([10, 8, 6]).astype(np.float64)
+        sdf = Sdf3D(x + 0.5 * y - 0.25 * z - 4.5, np.zeros(3), 1.0)
+        pts = np.random.uniform(0, 5, size=(100, 3))
+        sd = sdf[pts]
+        self.assertEqual(sd.shape, (100,))
+        self.assertTrue(np.allclose(sd, pts.dot([1, 0.5, -0.25]) - 4.5))
+        self.assertTrue(np.allclose(sd[:5], [sdf[p] for p in pts[:5]]))
+
+        # out of bounds coords are snapped to the grid
+        sd = sdf[np.array([[-1.0, 2.0, 3.0], [12.0, 9.0, 5.0]])]
+        self.assertTrue(np.allclose(sd, [-4.25, 6.75]))
+        self.assertEqual(sdf[[9, 7, 5]], 9 + 3.5 - 1.25 - 4.5)
+
+    def test_sdf_derivatives(self):
+        x, y, z = np.indices([10, 8, 6]).astype(np.float64)
+        sdf = Sdf3D(0.1 * x**2 + y - 4.5, np.zeros(3), 1.0)
+        pts = np.random.uniform(1, 5, size=(100, 3))
+        g = sdf.interpolated_gradients(pts)
+        self.assertEqual(g.shape, (100, 3))
+        self.assertTrue(np.allclose(g, np.c_[0.2 * pts[:,0], np.ones(100), np.zeros(100)]))
+        self.assertTrue(np.allclose(g[0], sdf.gradient(pts[0])))
+
+        H = sdf.hessians(pts)
+        self.assertEqual(H.shape, (100, 3, 3))
+        self.assertTrue(np.allclose(H, np.diag([0.2, 0, 0])))
+        self.assertTrue(np.allclose(H[0], sdf.curvature(pts[0])))
+
+    def test_sdf_surface_normals(self):
+        x, y, z = np.indices([20, 20, 20]).astype(np.float64)
+        center = np.array([9.3, 10.1, 9.7])
+        sdf = Sdf3D(np.sqrt((x - center[0])**2 + (y - center[1])**2 + (z - center[2])**2) - 6.0, np.zeros(3), 1.0)
+        dirs = np.random.randn(50, 3)
+        dirs = dirs / np.linalg.norm(dirs, axis=1)[:,np.newaxis]
+        pts = np.r_[center + 6.0 * dirs, [[1.0, 1.0, 1.0]]]
+        for use_gradient in [False, True]:
+            normals, valid = sdf.surface_normals(pts, use_gradient=use_gradient)
+            self.assertEqual(valid.tolist(), 50 * [True] + [False])
+            self.assertTrue(np.all(np.sum(normals[:50] * dirs, axis=1) > 0.9))
+        self.assertTrue(np.allclose(sdf.surface_normal(pts[0]), sdf.surface_normals(pts[:1])[0][0]))
+        self.assertEqual(sdf.surface_normal(pts[50]), None)
+
+    def test_sparse_sdf(self):
+        x, y, z = np.indices([40, 36, 44]).astype(np.float64)
+        center = np.array([19.3, 17.1, 21.7])
+        data = 0.01 * (np.sqrt((x - center[0])**2 + (y - center[1])**2 + (z - center[2])**2) - 10.0)
+        sdf = Sdf3D(data, np.zeros(3), 0.01)
+        sparse_sdf = SparseSdf3D(data, np.zeros(3), 0.01, block_size=4)
+        self.assertTrue(sparse_sdf.nbytes < 4 * data.nbytes)
+        self.assertTrue(np.allclose(sparse_sdf.center, sdf.center))
+        self.assertEqual(sparse_sdf.surface_points()[0].tolist(), sdf.surface_points()[0].tolist())
+
+        # exact in the narrow band
+        dirs = np.random.randn(100, 3)
+        dirs = dirs / np.linalg.norm(dirs, axis=1)[:,np.newaxis]
+        pts = center + np.random.uniform(9, 11, size=(100, 1)) * dirs
+        self.assertTrue(np.allclose(sparse_sdf[pts], sdf[pts]))
+        self.assertTrue(np.allclose(sparse_sdf.interpolated_gradients(pts), sdf.interpolated_gradients(pts)))
+        self.assertTrue(np.allclose(sparse_sdf.hessians(pts), sdf.hessians(pts)))
+
+        # approximate in the far field
+        pts = np.random.uniform(-2, 45, size=(100, 3))
+        self.assertTrue(np.all(np.sign(sparse_sdf[pts]) == np.sign(sdf[pts])))
+        self.assertEqual(sparse_sdf.data.shape, data.shape)
+        self.assertTrue(sparse_sdf.transform(RigidTransform(from_frame='sdf', to_frame='sdf')).bricks_ is sparse_sdf.bricks_)
+
+    def test_sparse_sdf_far_field(self):
+        # the grid dims are not whole numbers of blocks, so the last coarse intervals are shorter
+        x, y, z = np.indices([20, 21, 19]).astype(np.float64)
+        data = 0.5 * x + 0.25 * y - 0.75 * z + 2.0
+        sdf = Sdf3D(data, np.zeros(3), 1.0)
+        sparse_sdf = SparseSdf3D(data, np.zeros(3), 1.0, block_size=8, band=1.0)
+        self.assertTrue(0 < sparse_sdf.num_bricks < 27)
+
+        # trilinear interpolation of a linear field is exact in the bricks and the far field
+        self.assertTrue(np.allclose(sparse_sdf.data, data))
+        pts = np.random.uniform(0, 20, size=(200, 3))
+        self.assertTrue(np.allclose(sparse_sdf[pts], sdf[pts]))
+        self.assertTrue(np.allclose(sparse_sdf.interpolated_gradients(pts), [0.5, 0.25, -0.75]))
+        self.assertTrue(np.allclose(sparse_sdf.hessians(pts), 0))
+
+        # dense transforms split the transformed dense grid into bricks again
+        delta_T = RigidTransform(RigidTransform.z_axis_rotation(np.pi / 2), [0.5, -1.0, 2.0],
+                                 from_frame='sdf', to_frame='sdf')
+        for detailed in [False, True]:
+            sparse_sdf_tf = sparse_sdf.transform_dense(delta_T, detailed=detailed)
+            sdf_tf = sdf.transform_dense(delta_T, detailed=detailed)
+            expected_sdf_tf = SparseSdf3D(sdf_tf.data, sdf_tf.origin, 1.0, block_size=8, band=1.0)
+            self.assertTrue(isinstance(sparse_sdf_tf, SparseSdf3D))
+            self.assertEqual(sparse_sdf_tf.block_size, 8)
+            self.assertTrue(np.allclose(sparse_sdf_tf.origin, sdf_tf.origin))
+            self.assertTrue(np.allclose(sparse_sdf_tf.data, expected_sdf_tf.data))
+            self.assertEqual(sparse_sdf_tf.surface_points()[0].tolist(), sdf_tf.surface_points()[0].tolist())
+
+    def test_sdf_shared_gradients(self):
+        x, y, z = np.indices([10, 8, 6]).astype(np.float64)
+        sdf = Sdf3D(0.1 * x**2 + y - 4.5, np.zeros(3), 1.0)
+        sdf_tf = sdf.transform(RigidTransform(translation=[0.1, 0, 0], from_frame='sdf', to_frame='sdf'))
+        sdf_scaled = sdf.rescale(2.0)
+        self.assertTrue(sdf_tf.data is sdf.data)
+        self.assertEqual(len(sdf.gradients_), 0)
+        g = sdf_tf.gradients
+        self.assertTrue(sdf.gradients[0] is g[0] and sdf_scaled.gradients[0] is g[0])
+        self.assertTrue(np.allclose(sdf_tf.T_sdf_world_.translation, [-0.1, 0, 0]))
+        self.assertEqual(sdf_scaled.resolution, 2.0)
+
+        sdf32 = Sdf3D(0.1 * x**2 + y - 4.5, np.zeros(3), 1.0, dtype=np.float32)
+        self.assertEqual(sdf32.data.dtype, np.float32)
+        self.assertEqual(sdf32.gradients[0].dtype, np.float32)
+        pts = np.random.uniform(1, 5, size=(10, 3))
+        self.assertTrue(np.allclose(sdf32.interpolated_gradients(pts), sdf.interpolated_gradients(pts), atol=1e-5))
+
+        sparse_sdf32 = SparseSdf3D(0.1 * x**2 + y - 4.5, np.zeros(3), 1.0, dtype=np.float32, block_size=4)
+        self.assertEqual(sparse_sdf32.bricks_.dtype, np.float32)
+        self.assertEqual(sparse_sdf32.brick_gradients_[0].dtype, np.float32)
+        self.assertEqual(sparse_sdf32.signed_distances(pts).dtype, np.float64)
+        self.assertEqual(sparse_sdf32.interpolated_gradients(pts).dtype, np.float64)
+        self.assertEqual(sparse_sdf32.hessians(pts).dtype, np.float64)
+        self.assertTrue(np.allclose(sparse_sdf32.signed_distances(pts), sdf32.signed_distances(pts), atol=1e-5))
+        self.assertTrue(np.allclose(sparse_sdf32.interpolated_gradients(pts), sdf.interpolated_gradients(pts), atol=1e-5))
+
+    def assertPosesAlmostEqual(self, T, T_expected):
+        self.assertEqual((T.from_frame, T.to_frame), (T_expected.from_frame, T_expected.to_frame))
+        self.assertTrue(np.allclose(T.rotation, T_expected.rotation))
+        self.assertTrue(np.allclose(T.translation, T_expected.translation))
+
+    def test_viewsphere_random_variable(self):
+        rv = UniformViewsphereRandomVariable(0.5, 0.7, 0.1, 0.4, 0.0, 2.0, 0.0, 2.0)
+
+        # a single sample draws the parameters in the same order as sampling one at a time
+        np.random.seed(0)
+        T = rv.sample()
+        np.random.seed(0)
+        params = [r.rvs(size=1)[0] for r in [rv.rad_rv, rv.elev_rv, rv.az_rv, rv.roll_rv]]
+        self.assertPosesAlmostEqual(T, viewsphere_pose(*params))
+
+        samples = rv.sample(size=5)
+        self.assertEqual(len(samples), 5)
+        self.assertEqual(len(samples[1:3]), 2)
+        self.assertPosesAlmostEqual(samples[1:3][1], samples[2])
+        for T in samples:
+            self.assertEqual((T.from_frame, T.to_frame), ('obj', 'camera'))
+            self.assertTrue(np.allclose(T.rotation.dot(T.rotation.T), np.eye(3)))
+            self.assertTrue(0.5 <= np.linalg.norm(T.translation) <= 0.7)
+
+    def test_planar_worksurface_random_variable(self):
+        config = {'min_f': 500.0, 'max_f': 550.0, 'min_cx': 310.0, 'max_cx': 330.0,
+                  'min_cy': 230.0, 'max_cy': 250.0, 'im_height': 480, 'im_width': 640,
+                  'min_radius': 0.5, 'max_radius': 0.7, 'min_elev': 5.0, 'max_elev': 30.0,
+                  'min_az': 0.0, 'max_az': 360.0, 'min_roll': 0.0, 'max_roll': 360.0,
+                  'min_x': -0.1, 'max_x': 0.1, 'min_y': -0.1, 'max_y': 0.1}
+        rv = UniformPlanarWorksurfaceRandomVariable('camera', config)
+
+        # a single sample draws the parameters in the same order as sampling one at a time
+        np.random.seed(0)
+        sample = rv.sample()
+        np.random.seed(0)
+        focal, cx, cy, radius, elev, az, roll, tx, ty = \
+            [r.rvs(size=1)[0] for r in [rv.focal_rv, rv.cx_rv, rv.cy_rv, rv.rad_rv, rv.elev_rv,
+                                        rv.az_rv, rv.roll_rv, rv.tx_rv, rv.ty_rv]]
+        self.assertEqual([sample.focal, sample.cx, sample.cy, sample.radius, sample.elev,
+                          sample.az, sample.roll, sample.tx, sample.ty],
+                         [focal, cx, cy, radius, elev, az, roll, tx, ty])
+        T = viewsphere_pose(radius, elev, az, roll, tx, ty)
+        self.assertPosesAlmostEqual(sample.object_to_camera_pose, T)
+        camera_intr = shifted_intrinsics(T, focal, cx, cy, 480, 640)
+        for attr in ['frame', 'fx', 'fy', 'cx', 'cy', 'height', 'width']:
+            self.assertAlmostEqual(getattr(sample.camera_intr, attr), getattr(camera_intr, attr))
+
+        # every sample of a batch has its own pose and intrinsics
+        batch = rv.sample(size=6)
+        self.assertTrue(isinstance(batch, CameraSampleBatch))
+        self.assertEqual(len(batch), 6)
+        self.assertEqual(len(list(batch)), 6)
+        self.assertEqual(len(batch.camera_intrs.fx), 6)
+        self.assertEqual(len(np.unique(batch.camera_intrs.fx)), 6)
+        self.assertEqual(len(np.unique(batch.camera_intrs.cx)), 6)
+        for i, sample in enumerate(batch):
+            self.assertEqual(sample.radius, batch.radius[i])
+            self.assertEqual(sample.camera_intr.fx, batch.focal[i])
+            self.assertEqual(sample.camera_intr.cx, batch.camera_intrs.cx[i])
+            T = viewsphere_pose(sample.radius, sample.elev, sample.az, sample.roll, sample.tx, sample.ty)
+            self.assertPosesAlmostEqual(sample.object_to_camera_pose, T)
+            camera_intr = shifted_intrinsics(T, sample.focal, sample.cx, sample.cy, 480, 640)
+            self.assertAlmostEqual(sample.camera_intr.fx, camera_intr.fx)
+            self.assertAlmostEqual(sample.camera_intr.cx, camera_intr.cx)
+            self.assertAlmostEqual(sample.camera_intr.cy, camera_intr.cy)
+
+        sub_batch = batch[2:5]
+        self.assertTrue(isinstance(sub_batch, CameraSampleBatch))
+        self.assertEqual(len(sub_batch), 3)
+        self.assertEqual(sub_batch.tx.tolist(), batch.tx[2:5].tolist())
+        self.assertEqual(sub_batch[1].camera_intr.cx, batch[3].camera_intr.cx)
+        self.assertPosesAlmostEqual(sub_batch[1].object_to_camera_pose, batch[3].object_to_camera_pose)
+
+    def test_wrapped_images_scene_poses(self):
+        m = Mesh3D.load('test/data/tetrahedron.obj', 'test/cache')
+        camera = RecordingCamera(CameraIntrinsics('camera', 50.0, 50.0, 31.5, 23.5, height=48, width=64))
+        angles = np.linspace(0, np.pi, 5)
+        poses = RigidTransformArray(np.array([RigidTransform.z_axis_rotation(a) for a in angles]),
+                                    np.c_[angles, np.zeros(5), np.ones(5)],
+                                    from_frame='sdf', to_frame='camera')
+
+        # stacked poses are relabeled without creating a transform per pose
+        renders = camera.wrapped_images(m, poses, RenderMode.DEPTH_SCENE)
+        self.assertEqual(len(renders), 5)
+        self.assertTrue(isinstance(camera.rendered_poses, RigidTransformArray))
+        self.assertEqual((camera.rendered_poses.from_frame, camera.rendered_poses.to_frame), ('obj', 'camera'))
+        self.assertTrue(camera.rendered_poses.rotations is poses.rotations)
+        self.assertTrue(camera.rendered_poses.translations is poses.translations)
+        self.assertTrue(camera.scene_objects[0].mesh is m)
+
+        renders = camera.wrapped_images(m, list(poses), RenderMode.DEPTH_SCENE)
+        self.assertEqual(len(renders), 5)
+        for T, T_expected in zip(camera.rendered_poses, poses):
+            self.assertPosesAlmostEqual(T, T_expected.as_frames('obj', 'camera'))
+
+    def test_wrapped_images_stable_pose(self):
+        m = Mesh3D.load('test/data/tetrahedron.obj', 'test/cache')
+        camera = RecordingCamera(CameraIntrinsics('camera', 50.0, 50.0, 31.5, 23.5, height=48, width=64))
+        stable_pose = StablePose(1.0, RigidTransform.x_axis_rotation(np.pi / 3), np.array([0.1, 0.2, 0.3]))
+        angles = np.linspace(0, np.pi, 5)
+        poses = RigidTransformArray(np.array([RigidTransform.z_axis_rotation(a).dot(RigidTransform.y_axis_rotation(a))
+                                              for a in angles]),
+                                    np.c_[angles, np.zeros(5), np.ones(5)],
+                                    from_frame='obj', to_frame='camera')
+
+        # stacked poses are composed with the stable pose as arrays
+        renders = camera.wrapped_images(m, poses, RenderMode.DEPTH, stable_pose=stable_pose)
+        composed_poses = camera.rendered_poses
+        self.assertTrue(isinstance(composed_poses, RigidTransformArray))
+        self.assertEqual((composed_poses.from_frame, composed_poses.to_frame), ('obj', 'camera'))
+        self.assertEqual(len(renders), 5)
+
+        # and match composing one pose at a time
+        renders_list = camera.wrapped_images(m, list(poses), RenderMode.DEPTH, stable_pose=stable_pose)
+        self.assertTrue(isinstance(camera.rendered_poses, list))
+        for T, T_expected in zip(composed_poses, camera.rendered_poses):
+            self.assertPosesAlmostEqual(T, T_expected)
+        for render, render_expected in zip(renders, renders_list):
+            self.assertPosesAlmostEqual(render.T_camera_world, render_expected.T_camera_world)
+
+    def test_render_pool(self):
+        m = Mesh3D.load('test/data/tetrahedron.obj', 'test/cache')
+        camera_intr = CameraIntrinsics('camera', 50.0, 50.0, 31.5, 23.5, height=48, width=64)
+        poses = [RigidTransform(translation=[i, 0, 1], from_frame='obj', to_frame='camera') for i in range(13)]
+        intrs = [CameraIntrinsics('camera', 50.0 + i, 50.0, 31.5, 23.5, height=48, width=64) for i in range(13)]
+
+        # workers are forked from this process and so render with the stub camera
+        virtual_camera = render_pool.VirtualCamera
+        render_pool.VirtualCamera = StubCamera
+        try:
+            pool = RenderPool(camera_intr, num_workers=2)
+        finally:
+            render_pool.VirtualCamera = virtual_camera
+        try:
+            images = pool.wrapped_images(m, poses, 0)
+            self.assertEqual([im[0] for im in images], range(13))
+            self.assertEqual([im[1] for im in images], [50.0] * 13)
+            self.assertEqual([im[4] for im in images], [[]] * 13)
+
+            pool.add_to_scene('table', SceneObject(m, RigidTransform(from_frame='obj', to_frame='world')))
+            images = pool.wrapped_images(m, poses, 0, camera_intrinsics=intrs)
+            self.assertEqual([im[0] for im in images], range(13))
+            self.assertEqual([im[1] for im in images], [intr.fx for intr in intrs])
+            self.assertEqual([im[4] for im in images], [['table']] * 13)
+
+            pool.remove_from_scene('table')
+            images = pool.wrapped_images(m, poses[:3], 0)
+            self.assertEqual([im[0] for im in images], range(3))
+            self.assertEqual([im[4] for im in images], [[]] * 3)
+        finally:
+            pool.close()
+
+    def test_render_pool_mesh_files(self):
+        m = Mesh3D.load('test/data/tetrahedron.obj', 'test/cache')
+        camera_intr = CameraIntrinsics('camera', 50.0, 50.0, 31.5, 23.5, height=48, width=64)
+        pool = RenderPool(camera_intr, num_workers=1)
+        try:
+            # files are reused until the mesh arrays change
+            filename = pool.mesh_file(m)
+            self.assertEqual(pool.mesh_file(m), filename)
+            self.assertEqual(BinaryMeshFile(filename).read().vertices.tolist(), m.vertices.tolist())
+            m.vertices = m.vertices + 1
+            new_filename = pool.mesh_file(m)
+            self.assertNotEqual(new_filename, filename)
+            self.assertFalse(os.path.exists(filename))
+            self.assertEqual(BinaryMeshFile(new_filename).read().vertices.tolist(), m.vertices.tolist())
+
+            # files of deleted meshes are removed on the next write
+            m2 = m.copy()
+            filename = pool.mesh_file(m2)
+            self.assertTrue(os.path.exists(filename))
+            del m2
+            pool.mesh_file(Mesh3D(m.vertices, m.triangles))
+            self.assertFalse(os.path.exists(filename))
+            self.assertTrue(os.path.exists(new_filename))
+        finally:
+            pool.close()
+
+    def test_render_pool_worker_state(self):
+        m = Mesh3D.load('test/data/tetrahedron.obj', 'test/cache')
+        m.compute_vertex_normals()
+        num_meshes = RenderPool.MAX_WORKER_MESHES
+        small_intr = CameraIntrinsics('camera', 50.0, 50.0, 31.5, 23.5, height=48, width=64)
+        large_intr = CameraIntrinsics('camera', 100.0, 100.0, 63.5, 47.5, height=96, width=128)
+        pose = RigidTransform(translation=[0, 0, 1], from_frame='obj', to_frame='camera')
+        mesh_dir = tempfile.mkdtemp()
+        virtual_camera = render_pool.VirtualCamera
+        render_pool.VirtualCamera = StubCamera
+        try:
+            filenames = [os.path.join(mesh_dir, 'mesh_%d.bmesh' %(i)) for i in range(num_meshes + 1)]
+            for filename in filenames:
+                BinaryMeshFile(filename).write(m)
+
+            # shards reuse the camera of their image size and do not keep their scene
+            render_pool._init_worker()
+            scene = {'table': (filenames[1], RigidTransform(from_frame='obj', to_frame='world'), None)}
+            shard = lambda scene, intr: render_pool._render_shard((filenames[0], scene, [pose], [intr],
+                                                                   0, None, None, None, False))[0]
+            small = shard(scene, small_intr)
+            self.assertEqual(small[4], ['table'])
+            self.assertEqual(shard({}, small_intr)[2], small[2])
+            self.assertEqual(shard({}, small_intr)[4], [])
+            large = shard({}, large_intr)
+            self.assertNotEqual(large[2], small[2])
+            self.assertEqual(large[1], 100.0)
+
+            # the least recently used mesh is evicted
+            render_pool._init_worker()
+            meshes = [render_pool._worker_mesh(filename) for filename in filenames[:-1]]
+            self.assertTrue(render_pool._worker_mesh(filenames[0]) is meshes[0])
+            render_pool._worker_mesh(filenames[-1])
+            self.assertEqual(len(render_pool._worker_meshes), num_meshes)
+            self.assertTrue(render_pool._worker_mesh(filenames[0]) is meshes[0])
+            self.assertTrue(render_pool._worker_mesh(filenames[2]) is meshes[2])
+            self.assertFalse(render_pool._worker_mesh(filenames[1]) is meshes[1])
+        finally:
+            render_pool.VirtualCamera = virtual_camera
+            render_pool._init_worker()
+            shutil.rmtree(mesh_dir)
+
+    @skipIf(meshrender is None, 'meshrender is not built')
+    def test_render_tetrahedron(self):
+        verts = np.array([[1,0,0],[0,1,0],[-1,0,0],[0,0,1]], dtype=np.float64)
+        tris = np.array([[3,0,1],[3,1,2],[3,2,0],[0,2,1]], dtype=np.int32)
+        norms = verts / np.linalg.norm(verts, axis=1)[:,np.newaxis]
+        K = np.array([[50.0, 0, 31.5], [0, 50.0, 23.5], [0, 0, 1]])
+        proj = K.dot(np.c_[np.eye(3), [0, -0.3, 3.0]])[np.newaxis,:,:]
+        mat_props = np.zeros(16)
+        mat_props[:3] = [200, 100, 50]
+        light_props = np.zeros(19)
+
+        renderer = meshrender.Renderer(48, 64)
+        try:
+            handle = renderer.upload_mesh(verts, tris, norms)
+            color, depth, mask = renderer.render(handle, proj, mat_props, light_props,
+                                                 meshrender.RENDER_COLOR | meshrender.RENDER_DEPTH | meshrender.RENDER_MASK,
+                                                 False, False, None, None, None)
+        finally:
+            renderer.close()
+        self.assertEqual(color.shape, (1, 48, 64, 3))
+        self.assertEqual(depth.shape, (1, 48, 64))
+        self.assertEqual(mask.shape, (1, 48, 64))
+
+        # the face in the z = 0 plane of the mesh covers the center of the image at depth 3
+        self.assertEqual(color[0,24,32].tolist(), [200, 100, 50])
+        self.assertAlmostEqual(depth[0,24,32], 3.0, delta=0.2)
+        self.assertEqual(mask[0,24,32], 255)
+
+        # the face spans about 33 columns and 17 rows
+        self.assertTrue(30 <= np.sum(mask[0,24] > 0) <= 36)
+        self.assertTrue(14 <= np.sum(mask[0,:,32] > 0) <= 20)
+        self.assertEqual(np.sum(mask[0,:5] > 0), 0)
+        self.assertEqual(color[0,0,0].tolist(), [0, 0, 0])
+        self.assertEqual(depth[0,0,0], 0.0)
+        self.assertTrue(np.all((depth[0] > 0) == (mask[0] > 0)))
+
+    @skipIf(meshrender is None, 'meshrender is not built')
+    def test_upload_mesh_validation(self):
+        verts = np.array([[1,0,0],[0,1,0],[-1,0,0],[0,0,1]], dtype=np.float64)
+        tris = np.array([[3,0,1],[3,1,2],[3,2,0],[0,2,1]], dtype=np.int32)
+        renderer = meshrender.Renderer(48, 64)
+        try:
+            self.assertTrue(renderer.upload_mesh(verts, tris, verts) > 0)
+            self.assertRaises(ValueError, renderer.upload_mesh, verts, tris, verts[:3])
+            self.assertRaises(ValueError, renderer.upload_mesh, verts, tris.astype(np.int64), verts)
+            self.assertRaises(ValueError, renderer.upload_mesh, verts.astype(np.float32), tris, verts)
+            self.assertRaises(ValueError, renderer.upload_mesh, verts, tris + 1, verts)
+            self.assertRaises(ValueError, renderer.upload_mesh, verts, tris - 1, verts)
+            self.assertRaises(ValueError, renderer.upload_mesh, verts, tris.T, verts)
+        finally:
+            renderer.close()
 
     def test_visualize(self):
         pass